@@ -68,6 +68,18 @@ export class AutoIngestStack extends cdk.Stack {
       description: "Destination prefix for S3 Bucket ingestion",
       default: "ingest",
     });
+    const additionalDestinations = new cdk.CfnParameter(this, "AdditionalDestinations", {
+      type: "String",
+      description:
+        'Optional json list of more destinations in this account, e.g. [{"bucket": "<bucket>", "prefix": "ingest", "storageClass": "STANDARD_IA"}]',
+      default: "",
+    });
+    const additionalDestinationBuckets = new cdk.CfnParameter(this, "AdditionalDestinationBuckets", {
+      type: "CommaDelimitedList",
+      description:
+        "Optional comma separated list of the buckets of AdditionalDestinations, the function can only write to these buckets",
+      default: "",
+    });
 
     /**
      * Template metadata
@@ -86,6 +98,8 @@ export class AutoIngestStack extends cdk.Stack {
               mediaExchangeBucket.logicalId,
               destinationBucket.logicalId,
               destinationPrefix.logicalId,
+              additionalDestinations.logicalId,
+              additionalDestinationBuckets.logicalId,
             ],
           },
         ],
@@ -160,6 +174,41 @@ export class AutoIngestStack extends cdk.Stack {
     });
     customResourcePolicy.attachToRole(driverFunctionRole);
 
+    // writes are allowed to the objects of AdditionalDestinationBuckets in this
+    // account. Join does not take a function as the delimiter, the partition of
+    // the arns is a wildcard.
+    const hasAdditionalDestinations = new cdk.CfnCondition(this, "HasAdditionalDestinations", {
+      expression: cdk.Fn.conditionNot(cdk.Fn.conditionEquals(additionalDestinations.valueAsString, "")),
+    });
+    const additionalDestinationsPolicy = new iam.Policy(this, "AdditionalDestinationsPolicy", {
+      statements: [
+        new iam.PolicyStatement({
+          sid: "S3WriteAdditional",
+          resources: cdk.Fn.split(
+            ",",
+            cdk.Fn.join("", [
+              "arn:*:s3:::",
+              cdk.Fn.join("/*,arn:*:s3:::", additionalDestinationBuckets.valueAsList),
+              "/*",
+            ])
+          ),
+          actions: [
+            "s3:GetObject",
+            "s3:PutObject",
+            "s3:PutObjectAcl",
+            "s3:PutObjectVersionAcl",
+            "s3:PutObjectTagging",
+            "s3:PutObjectVersionTagging",
+          ],
+          conditions: {
+            StringEquals: { "s3:ResourceAccount": cdk.Aws.ACCOUNT_ID },
+          },
+        }),
+      ],
+    });
+    additionalDestinationsPolicy.attachToRole(driverFunctionRole);
+    (additionalDestinationsPolicy.node.defaultChild as iam.CfnPolicy).cfnOptions.condition = hasAdditionalDestinations;
+
     // KMS
     const kmsPolicy = new iam.PolicyDocument({
       statements: [
@@ -236,13 +285,17 @@ export class AutoIngestStack extends cdk.Stack {
         SOURCE_BUCKET_NAME: mediaExchangeBucket.valueAsString,
         DESTINATION_BUCKET_NAME: destinationBucket.valueAsString,
         DESTINATION_PREFIX: destinationPrefix.valueAsString,
+        DESTINATIONS: additionalDestinations.valueAsString,
         SOLUTION_IDENTIFIER: "AwsSolution/SO0133/__VERSION__-Autoingest",
         LogLevel: "INFO",
         SendAnonymizedMetric: cdk.Fn.findInMap('AnonymizedData', 'SendAnonymizedData', 'Data')
       },
       functionName: `${cdk.Aws.STACK_NAME}-custom-resource`,
       role: driverFunctionRole,
-      code: lambda.Code.fromAsset("lib/autoingest/lambda/autoingest_driver/"),
+      code: lambda.Code.fromAsset("lib/autoingest/lambda/autoingest_driver/", {
+        // checksums.py links to lib/common
+        followSymlinks: cdk.SymlinkFollowMode.ALWAYS,
+      }),
       timeout: cdk.Duration.seconds(900),
       deadLetterQueue: dlq,
       deadLetterQueueEnabled: true,
@@ -2,6 +2,7 @@
 # SPDX-License-Identifier: Apache-2.0
 
 import os
+import json
 import logging
 import boto3
 import jsonpickle
@@ -10,6 +11,14 @@ from time import sleep
 import urllib
 from random import randint
 from botocore import config
+from boto3.s3.transfer import TransferConfig
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from checksums import ChecksumMismatchError, verify_checksum
+except ImportError:
+    # imported as a package by the unit tests
+    from .checksums import ChecksumMismatchError, verify_checksum
 
 logger = logging.getLogger()
 logger.setLevel(os.environ['LogLevel'])
@@ -25,6 +34,7 @@ if os.environ['SendAnonymizedMetric'] == 'Yes':
 s3client = boto3.client('s3', config=presetConfig)
 
 
+
 def match_bucket_name(source_bucket):
     if (source_bucket != os.environ['SOURCE_BUCKET_NAME']):
         raise ClientError({
@@ -36,22 +46,178 @@ def match_bucket_name(source_bucket):
         }, 'match_bucket_name')
         
 
-def check_object(source_bucket,source_key):
+def check_object(source_bucket, source_key, source_version=None):
 
+    # the one HEAD of the source, shared by the copies to all destinations
+    version = {'VersionId': source_version} if source_version else {}
     pre_flight_response = s3client.head_object(
         Bucket=source_bucket,
-        Key=source_key
+        Key=source_key,
+        ChecksumMode='ENABLED',
+        **version
     )
     logger.debug('## PREFLIGHT_RESPONSE\r' + jsonpickle.encode(dict(**pre_flight_response)))
 
     size = pre_flight_response['ContentLength']
     #1 TB
     if (size > 1099511627776):
-        logger.warn("the object size is " + size + ". The lambda function may timeout.")
+        logger.warn("the object size is " + str(size) + ". The lambda function may timeout.")
+
+    return pre_flight_response
+
+# DESTINATIONS is a json list of additional destinations, e.g.
+# [{"bucket": "<bucket>", "prefix": "ingest", "storageClass": "INTELLIGENT_TIERING"}]
+# prefix defaults to DESTINATION_PREFIX and storageClass to the S3 default.
+def get_destinations():
+
+    destinations = []
+    if os.environ.get('DESTINATION_BUCKET_NAME'):
+        destinations.append({'bucket': os.environ['DESTINATION_BUCKET_NAME'], 'prefix': os.environ['DESTINATION_PREFIX']})
+        if os.environ.get('DESTINATION_STORAGE_CLASS'):
+            destinations[0]['storageClass'] = os.environ['DESTINATION_STORAGE_CLASS']
+
+    try:
+        additional = json.loads(os.environ.get('DESTINATIONS') or '[]')
+    except ValueError as e:
+        raise ValueError('DESTINATIONS is not valid json: ' + str(e))
+    if not isinstance(additional, list) or not all(isinstance(d, dict) and d.get('bucket') for d in additional):
+        raise ValueError('DESTINATIONS must be a json list of objects with a bucket')
+
+    for destination in additional:
+        destinations.append({'prefix': os.environ.get('DESTINATION_PREFIX', 'ingest'), **destination})
+
+    return destinations
+
+# an invalid DESTINATIONS fails the cold start, not each message
+get_destinations()
+
+def get_checksum_algorithm():
+
+    return os.environ.get('CHECKSUM_ALGORITHM', 'SHA256')
+
+# CopyObject copies up to 5GB in one request and S3 computes the checksum of
+# the whole object, which compares with a source uploaded in one request.
+# Larger objects and sources that were uploaded in parts are copied in parts of
+# the size of the parts of the source, so that the checksums of the multipart
+# uploads can be compared.
+MAX_COPY_OBJECT_SIZE_IN_BYTES = 5 * 1024 ** 3
+
+def get_part_size(source_bucket, source_key, source_version, source):
 
-def copy_object(source_bucket, source_key, source_version, destination_bucket, prefix):
+    # 0 when the object is copied in one request
+    source_checksum = source.get('Checksum' + get_checksum_algorithm())
+    if source['ContentLength'] <= MAX_COPY_OBJECT_SIZE_IN_BYTES and (source_checksum is None or '-' not in source_checksum):
+        return 0
 
-    s3client.copy(CopySource={'Bucket': source_bucket,'Key': source_key, 'VersionId': source_version}, Bucket=destination_bucket, Key='{}/{}'.format(prefix,source_key))
+    version = {'VersionId': source_version} if source_version else {}
+    return s3client.head_object(Bucket=source_bucket, Key=source_key, PartNumber=1, **version)['ContentLength']
+
+def copy_object(source_bucket, source_key, source_version, destination_bucket, prefix, storage_class=None, source=None, part_size=None):
+
+    algorithm = get_checksum_algorithm()
+    extra_args = {'ChecksumAlgorithm': algorithm}
+    if storage_class:
+        extra_args['StorageClass'] = storage_class
+
+    version = {'VersionId': source_version} if source_version else {}
+    copy_source = {'Bucket': source_bucket, 'Key': source_key, **version}
+
+    if source is None:
+        source = s3client.head_object(Bucket=source_bucket, Key=source_key, ChecksumMode='ENABLED', **version)
+
+    if part_size is None:
+        part_size = get_part_size(source_bucket, source_key, source_version, source)
+    if not part_size:
+        s3client.copy_object(CopySource=copy_source, Bucket=destination_bucket, Key='{}/{}'.format(prefix,source_key), **extra_args)
+        return
+
+    transfer_config = TransferConfig(multipart_threshold=part_size, multipart_chunksize=part_size)
+
+    s3client.copy(CopySource=copy_source, Bucket=destination_bucket, Key='{}/{}'.format(prefix,source_key), ExtraArgs=extra_args, Config=transfer_config)
+
+def verify_copy(source_bucket, source_key, source_version, destination_bucket, prefix, source=None):
+
+    algorithm = get_checksum_algorithm()
+
+    if source is None:
+        source = s3client.head_object(Bucket=source_bucket, Key=source_key, VersionId=source_version, ChecksumMode='ENABLED')
+    destination = s3client.head_object(Bucket=destination_bucket, Key='{}/{}'.format(prefix,source_key), ChecksumMode='ENABLED')
+
+    return verify_checksum(algorithm, source.get('Checksum' + algorithm), destination.get('Checksum' + algorithm))
+
+def is_copied(source_key, source, destination):
+
+    # a copy written after this version of the source, by a previous delivery
+    # of the same message. A copy that failed verify_copy has the same size.
+    try:
+        response = s3client.head_object(Bucket=destination['bucket'], Key='{}/{}'.format(destination['prefix'], source_key), ChecksumMode='ENABLED')
+    except ClientError as e:
+        if e.response['Error']['Code'] in ['404', 'NoSuchKey']:
+            return False
+        raise
+
+    if response['ContentLength'] != source['ContentLength'] or response['LastModified'] < source['LastModified']:
+        return False
+
+    algorithm = get_checksum_algorithm()
+    try:
+        verify_checksum(algorithm, source.get('Checksum' + algorithm), response.get('Checksum' + algorithm))
+    except ChecksumMismatchError:
+        return False
+
+    return True
+
+def get_error_result(e):
+
+    error_code = e.response['Error']['Code']
+    error_message = e.response['Error']['Message']
+
+    logger.debug(error_message)
+
+    if error_code == 'TooManyRequestsException':
+        return 'TemporaryFailure', 'Retry request to batch due to throttling.'
+    elif error_code == 'RequestTimeout':
+        return 'TemporaryFailure', 'Retry request to Amazon S3 due to timeout.'
+    elif (error_code == '304'):
+        return 'Succeeded', 'Not modified'
+    elif (error_code == '400'):
+        return 'Succeeded', error_message
+    elif (error_code == 'SlowDown'):
+        return 'TemporaryFailure', 'Retry request to s3 due to throttling.'
+
+    return 'PermanentFailure', '{}: {}'.format(error_code, error_message)
+
+def copy_to_destination(source_bucket, source_key, source_version, source, destination, redelivered=False, part_size=None):
+
+    result = {'Bucket': destination['bucket'], 'Prefix': destination['prefix']}
+
+    try:
+        if redelivered and is_copied(source_key, source, destination):
+            result.update({'ResultCode': '0', 'ResultString': 'Already copied'})
+            return result
+
+        copy_object(source_bucket, source_key, source_version, destination['bucket'], destination['prefix'], destination.get('storageClass'), source, part_size)
+        checksum = verify_copy(source_bucket, source_key, source_version, destination['bucket'], destination['prefix'], source)
+        result.update({'ResultCode': '0', 'ResultString': checksum})
+
+    except ClientError as e:
+        result_code, result_string = get_error_result(e)
+        result.update({'ResultCode': '0' if result_code == 'Succeeded' else result_code, 'ResultString': result_string, 'Error': e})
+
+    except Exception as e:
+        result.update({'ResultCode': 'PermanentFailure', 'ResultString': 'Exception: {}'.format(e)})
+
+    logger.info(result['ResultCode'] + ' # ' + result['ResultString'] + ' # s3://' + destination['bucket'] + '/' + destination['prefix'])
+    return result
+
+def copy_to_destinations(source_bucket, source_key, source_version, source, destinations, redelivered=False):
+
+    # the destinations are copied concurrently from the same source version,
+    # in parts of the same size
+    part_size = get_part_size(source_bucket, source_key, source_version, source)
+    workers = max(1, min(len(destinations), int(os.environ.get('DESTINATION_CONCURRENCY', '8'))))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda destination: copy_to_destination(source_bucket, source_key, source_version, source, destination, redelivered, part_size), destinations))
 
 
 def lambda_handler(event, _):
@@ -89,9 +255,24 @@ def lambda_handler(event, _):
 
 
         if (message['reason'] == 'PutObject' or message['reason'] == 'CopyObject' or message['reason'] == 'CompleteMultipartUpload'):
-            check_object(source_bucket, source_key)
-            copy_object(source_bucket, source_key, source_version, os.environ['DESTINATION_BUCKET_NAME'], os.environ['DESTINATION_PREFIX'])
-            return {'ResultCode': result_code, 'ResultString': result_string}
+            source = check_object(source_bucket, source_key, source_version)
+            destinations = get_destinations()
+
+            # SQS delivers the message again when a destination failed temporarily,
+            # destinations that were copied by then are not copied again
+            redelivered = int(record.get('attributes', {}).get('ApproximateReceiveCount', '1')) > 1
+            results = copy_to_destinations(source_bucket, source_key, source_version, source, destinations, redelivered)
+
+            temporary = [r for r in results if r['ResultCode'] == 'TemporaryFailure']
+            if temporary:
+                raise temporary[0]['Error']
+
+            failed = [r for r in results if r['ResultCode'] != '0']
+            if failed:
+                result_code = 'PermanentFailure'
+                result_string = 'Failed to copy to ' + str(len(failed)) + ' of ' + str(len(results)) + ' destinations'
+
+            return {'ResultCode': result_code, 'ResultString': result_string, 'Destinations': [{k: v for k, v in r.items() if k != 'Error'} for r in results]}
         else:
             result_code = '-1'
             result_string = 'did not process ' + message['reason'] + ' event'
@@ -100,29 +281,7 @@ def lambda_handler(event, _):
         # If request timed out, mark as a temp failure
         # and S3 Batch Operations will make the task for retry. If
         # any other exceptions are received, mark as permanent failure.
-        error_code = e.response['Error']['Code']
-        error_message = e.response['Error']['Message']
-
-        logger.debug(error_message)
-
-        if error_code == 'TooManyRequestsException':
-            result_code = 'TemporaryFailure'
-            result_string = 'Retry request to batch due to throttling.'
-        elif error_code == 'RequestTimeout':
-            result_code = 'TemporaryFailure'
-            result_string = 'Retry request to Amazon S3 due to timeout.'
-        elif (error_code == '304'):
-            result_code = 'Succeeded'
-            result_string = 'Not modified'
-        elif (error_code == '400'):
-            result_code = 'Succeeded'
-            result_string = error_message
-        elif (error_code == 'SlowDown'):
-            result_code = 'TemporaryFailure'
-            result_string = 'Retry request to s3 due to throttling.'
-        else:
-            result_code = 'PermanentFailure'
-            result_string = '{}: {}'.format(error_code, error_message)
+        result_code, result_string = get_error_result(e)
 
         if (result_code == 'TemporaryFailure'):
             #cooloff anytime between 1-10s. SQS does not support exponential backoff based retry
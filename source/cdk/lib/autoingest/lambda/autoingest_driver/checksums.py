@@ -0,0 +1 @@
+../../../common/checksums.py
\ No newline at end of file
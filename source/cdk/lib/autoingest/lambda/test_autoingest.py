@@ -51,8 +51,8 @@ class TestAutoIngestLambdaFunction(unittest.TestCase):
 
     def test_check_object_success(self):
         from autoingest_driver.app import check_object
-        file_content = check_object(S3_BUCKET_NAME, S3_TEST_FILE_KEY)
-        self.assertIsNone(file_content)
+        file_content = check_object(S3_BUCKET_NAME, S3_TEST_FILE_KEY, self.S3_TEST_FILE_VERSION)
+        self.assertEqual(file_content['ContentLength'], len(json.dumps(S3_TEST_FILE_CONTENT)))
     
     def test_check_object_error(self):
         from autoingest_driver.app import check_object
@@ -63,10 +63,94 @@ class TestAutoIngestLambdaFunction(unittest.TestCase):
         file_content = copy_object(S3_BUCKET_NAME, S3_TEST_FILE_KEY, self.S3_TEST_FILE_VERSION, DESTINATION_S3_BUCKET_NAME, 'ingest')
         self.assertIsNone(file_content)
 
+    def test_verify_copy_success(self):
+        from autoingest_driver.app import copy_object, verify_copy
+        copy_object(S3_BUCKET_NAME, S3_TEST_FILE_KEY, self.S3_TEST_FILE_VERSION, DESTINATION_S3_BUCKET_NAME, 'ingest')
+        self.assertTrue(verify_copy(S3_BUCKET_NAME, S3_TEST_FILE_KEY, self.S3_TEST_FILE_VERSION, DESTINATION_S3_BUCKET_NAME, 'ingest').startswith('ChecksumSHA256 '))
+
+    def test_copy_object_size_success(self):
+        import autoingest_driver.app as app
+        source = {'ContentLength': app.MAX_COPY_OBJECT_SIZE_IN_BYTES, 'ChecksumSHA256': 'AAAA'}
+        with mock.patch.object(app, 's3client') as s3client:
+            # up to 5GB in one request
+            app.copy_object(S3_BUCKET_NAME, S3_TEST_FILE_KEY, None, DESTINATION_S3_BUCKET_NAME, 'ingest', source=source)
+            s3client.copy_object.assert_called_once()
+            self.assertEqual(s3client.copy_object.call_args.kwargs['ChecksumAlgorithm'], 'SHA256')
+            self.assertEqual(s3client.copy_object.call_args.kwargs['CopySource'], {'Bucket': S3_BUCKET_NAME, 'Key': S3_TEST_FILE_KEY})
+            s3client.copy.assert_not_called()
+
+            # larger objects and multipart sources in parts of the size of the source parts
+            s3client.head_object.return_value = {'ContentLength': 64 * 1024 * 1024}
+            for source in [{'ContentLength': app.MAX_COPY_OBJECT_SIZE_IN_BYTES + 1}, {'ContentLength': 1024 ** 3, 'ChecksumSHA256': 'AAAA-16'}]:
+                s3client.copy.reset_mock()
+                app.copy_object(S3_BUCKET_NAME, S3_TEST_FILE_KEY, self.S3_TEST_FILE_VERSION, DESTINATION_S3_BUCKET_NAME, 'ingest', source=source)
+                s3client.head_object.assert_called_with(Bucket=S3_BUCKET_NAME, Key=S3_TEST_FILE_KEY, PartNumber=1, VersionId=self.S3_TEST_FILE_VERSION)
+                config = s3client.copy.call_args.kwargs['Config']
+                self.assertEqual((config.multipart_threshold, config.multipart_chunksize), (64 * 1024 * 1024, 64 * 1024 * 1024))
+                self.assertEqual(s3client.copy.call_args.kwargs['ExtraArgs'], {'ChecksumAlgorithm': 'SHA256'})
+
     def test_copy_object_error(self):
         from autoingest_driver.app import copy_object
         self.assertRaises(Exception, copy_object, S3_TEST_FILE_KEY, S3_BUCKET_NAME, self.S3_TEST_FILE_VERSION, DESTINATION_S3_BUCKET_NAME, 'ingest')
 
+    def test_get_destinations_success(self):
+        from autoingest_driver.app import get_destinations
+        with mock.patch.dict(os.environ, {'DESTINATIONS': '[{"bucket": "other", "storageClass": "GLACIER_IR"}, {"bucket": "third", "prefix": "in"}]'}):
+            self.assertEqual(get_destinations(), [
+                {'bucket': DESTINATION_S3_BUCKET_NAME, 'prefix': 'ingest'},
+                {'bucket': 'other', 'prefix': 'ingest', 'storageClass': 'GLACIER_IR'},
+                {'bucket': 'third', 'prefix': 'in'}
+            ])
+
+    def test_get_destinations_error(self):
+        import importlib
+        from autoingest_driver import app
+        for destinations in ['[{"bucket": "other"', '{"bucket": "other"}', '[{"prefix": "in"}]']:
+            with mock.patch.dict(os.environ, {'DESTINATIONS': destinations}):
+                self.assertRaises(ValueError, app.get_destinations)
+                # at cold start
+                self.assertRaises(ValueError, importlib.reload, app)
+        importlib.reload(app)
+
+    def test_copy_to_destinations_partial_error(self):
+        from autoingest_driver.app import check_object, copy_to_destinations
+        self.s3.create_bucket(Bucket='otherbucket')
+        source = check_object(S3_BUCKET_NAME, S3_TEST_FILE_KEY, self.S3_TEST_FILE_VERSION)
+        destinations = [{'bucket': DESTINATION_S3_BUCKET_NAME, 'prefix': 'ingest'}, {'bucket': 'otherbucket', 'prefix': 'a', 'storageClass': 'STANDARD_IA'}, {'bucket': 'missingbucket', 'prefix': 'ingest'}]
+        results = copy_to_destinations(S3_BUCKET_NAME, S3_TEST_FILE_KEY, self.S3_TEST_FILE_VERSION, source, destinations)
+        self.assertEqual([r['ResultCode'] for r in results], ['0', '0', 'PermanentFailure'])
+        self.assertEqual(self.s3.Object('otherbucket', 'a/' + S3_TEST_FILE_KEY).storage_class, 'STANDARD_IA')
+
+        # copies of a previous delivery are kept
+        with mock.patch('autoingest_driver.app.copy_object') as copy_object:
+            results = copy_to_destinations(S3_BUCKET_NAME, S3_TEST_FILE_KEY, self.S3_TEST_FILE_VERSION, source, destinations[:2], redelivered=True)
+            self.assertEqual([r['ResultString'] for r in results], ['Already copied', 'Already copied'])
+            copy_object.assert_not_called()
+
+    def test_copy_to_destinations_checksum_mismatch(self):
+        import autoingest_driver.app as app
+        source = app.check_object(S3_BUCKET_NAME, S3_TEST_FILE_KEY, self.S3_TEST_FILE_VERSION)
+        app.copy_object(S3_BUCKET_NAME, S3_TEST_FILE_KEY, self.S3_TEST_FILE_VERSION, DESTINATION_S3_BUCKET_NAME, 'ingest')
+        destination = {'bucket': DESTINATION_S3_BUCKET_NAME, 'prefix': 'ingest'}
+        copy = self.s3.meta.client.head_object(Bucket=DESTINATION_S3_BUCKET_NAME, Key='ingest/' + S3_TEST_FILE_KEY)
+        # a copy of the same size that did not verify on the previous delivery is copied again
+        with mock.patch.object(app.s3client, 'head_object', return_value={**copy, 'ChecksumSHA256': 'BBBB'}):
+            self.assertFalse(app.is_copied(S3_TEST_FILE_KEY, {**source, 'ChecksumSHA256': 'AAAA'}, destination))
+            self.assertTrue(app.is_copied(S3_TEST_FILE_KEY, {**source, 'ChecksumSHA256': 'BBBB'}, destination))
+
+    def test_copy_to_destinations_part_size(self):
+        import autoingest_driver.app as app
+        source = {'ContentLength': app.MAX_COPY_OBJECT_SIZE_IN_BYTES + 1}
+        destinations = [{'bucket': DESTINATION_S3_BUCKET_NAME, 'prefix': 'ingest'}, {'bucket': 'otherbucket', 'prefix': 'a'}]
+        with mock.patch.object(app, 's3client') as s3client:
+            s3client.head_object.return_value = {'ContentLength': 64 * 1024 * 1024, 'ChecksumSHA256': 'AAAA-2'}
+            results = app.copy_to_destinations(S3_BUCKET_NAME, S3_TEST_FILE_KEY, None, source, destinations)
+            self.assertEqual([r['ResultCode'] for r in results], ['0', '0'])
+            # one HEAD of the first part for all destinations, then one HEAD of each copy
+            part_heads = [c for c in s3client.head_object.call_args_list if c.kwargs.get('PartNumber') == 1]
+            self.assertEqual(len(part_heads), 1)
+            self.assertEqual(s3client.copy.call_count, 2)
+
     def test_handler_success(self):
         from autoingest_driver.app import lambda_handler
         event = {
@@ -89,5 +173,7 @@ class TestAutoIngestLambdaFunction(unittest.TestCase):
             ]
         }
         result = lambda_handler(event, {})
-        self.assertEqual(result, {'ResultCode': '0', 'ResultString': 'Successfully copied'})
+        self.assertEqual(result['ResultCode'], '0')
+        self.assertEqual(result['ResultString'], 'Successfully copied')
+        self.assertEqual([(d['Bucket'], d['ResultCode']) for d in result['Destinations']], [(DESTINATION_S3_BUCKET_NAME, '0')])
 
@@ -0,0 +1,26 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+# Shared by the MediaSync and autoingest drivers and verify_copy.py, each directory links
+# to this file and the link is followed when the function is packaged.
+
+class ChecksumMismatchError(Exception):
+    pass
+
+def verify_checksum(algorithm, source_checksum, destination_checksum):
+
+    # S3 computes the checksum of the destination from the bytes it copied. It
+    # can be compared when the source was uploaded with the same algorithm and
+    # part sizes. Checksums of multipart uploads end with -<number of parts>.
+    name = 'Checksum' + algorithm
+
+    if destination_checksum is None:
+        return name + ' not available'
+    if source_checksum is None:
+        return name + ' ' + destination_checksum
+    if source_checksum == destination_checksum:
+        return name + ' ' + destination_checksum + ' verified'
+    if '-' in source_checksum or '-' in destination_checksum:
+        return name + ' ' + destination_checksum + ' not comparable to ' + source_checksum
+
+    raise ChecksumMismatchError(name + ' ' + destination_checksum + ' does not match ' + source_checksum)
@@ -0,0 +1,42 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+# Shared by scripts/plan_copy_job.py of MediaSync and scripts/plan_hash_job.py
+# of fixity, each scripts directory links to this file.
+#
+# The schedule of a run: driver invocations run on a number of concurrent
+# Lambda invocations, and the jobs they submit run first in, first out on the
+# vCPUs of the compute environment.
+
+import heapq
+
+
+class Schedule:
+
+    def __init__(self, concurrency, max_vcpus):
+        # when each of the concurrent invocations is free
+        self.invocations = [0.0] * concurrency
+        # (end, vcpus) of the running jobs
+        self.running = []
+        self.max_vcpus = max_vcpus
+        self.vcpus = 0
+        self.last_start = 0.0
+        self.makespan = 0.0
+
+    def invoke(self, seconds):
+        end = heapq.heappop(self.invocations) + seconds
+        heapq.heappush(self.invocations, end)
+        self.makespan = max(self.makespan, end)
+        return end
+
+    def run_job(self, submitted, vcpus, seconds):
+        # first in, first out, a job waits for the jobs before it and for free vCPUs
+        start = max(submitted, self.last_start)
+        while self.running and (self.running[0][0] <= start or self.vcpus + vcpus > self.max_vcpus):
+            end, done = heapq.heappop(self.running)
+            self.vcpus -= done
+            start = max(start, end)
+        self.vcpus += vcpus
+        heapq.heappush(self.running, (start + seconds, vcpus))
+        self.last_start = start
+        self.makespan = max(self.makespan, start + seconds)
@@ -0,0 +1,78 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+# Shared by the scripts of MediaSync and fixity, each scripts directory links
+# to this file.
+#
+# Manifests are csv files (local or s3 uri) of bucket,key[,size] as for S3
+# Batch, inventories are read from the manifest.json of an S3 inventory report
+# in CSV format.
+
+import io
+import csv
+import gzip
+import json
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+
+def parse_s3_uri(uri):
+
+    bucket, _, key = uri[len('s3://'):].partition('/')
+    return bucket, key
+
+
+def read_manifest(client, manifest, decode_keys=True):
+
+    # bucket,key[,size], keys are url encoded and stay so without decode_keys,
+    # e.g. to be written to another manifest
+    if manifest.startswith('s3://'):
+        bucket, key = parse_s3_uri(manifest)
+        f = io.TextIOWrapper(client.get_object(Bucket=bucket, Key=key)['Body'], encoding='utf-8')
+    else:
+        f = open(manifest, newline='', encoding='utf-8')
+
+    with f:
+        for row in csv.reader(f):
+            if row:
+                yield row[0], urllib.parse.unquote_plus(row[1]) if decode_keys else row[1], int(row[2]) if len(row) > 2 and row[2] else None
+
+
+def read_inventory(client, manifest, decode_keys=True, require_size=True):
+
+    # keys are url encoded in inventory reports as in manifests, sizes are None
+    # when the inventory has no Size field and require_size is not set
+
+    bucket, key = parse_s3_uri(manifest)
+    manifest = json.loads(client.get_object(Bucket=bucket, Key=key)['Body'].read())
+
+    if manifest.get('fileFormat') != 'CSV':
+        raise ValueError('unsupported inventory format ' + str(manifest.get('fileFormat')))
+
+    columns = [column.strip() for column in manifest['fileSchema'].split(',')]
+    if require_size and 'Size' not in columns:
+        raise ValueError('inventory has no Size field')
+
+    for f in manifest['files']:
+        body = client.get_object(Bucket=manifest['destinationBucket'].split(':::')[-1], Key=f['key'])['Body'].read()
+        for row in csv.reader(io.TextIOWrapper(gzip.GzipFile(fileobj=io.BytesIO(body)), encoding='utf-8')):
+            entry = dict(zip(columns, row))
+            if entry.get('IsLatest', 'true') == 'true' and entry.get('IsDeleteMarker', 'false') != 'true':
+                yield entry['Bucket'], urllib.parse.unquote_plus(entry['Key']) if decode_keys else entry['Key'], int(entry['Size']) if entry.get('Size') else None
+
+
+def with_sizes(client, objects, batch_size=1000):
+
+    # HEAD the rows without a size, a batch at a time
+    def head(entry):
+        bucket, key, size = entry
+        return bucket, key, size if size is not None else client.head_object(Bucket=bucket, Key=key)['ContentLength']
+
+    with ThreadPoolExecutor(max_workers=64) as executor:
+        batch = []
+        for entry in objects:
+            batch.append(entry)
+            if len(batch) == batch_size:
+                yield from executor.map(head, batch)
+                batch = []
+        yield from executor.map(head, batch)
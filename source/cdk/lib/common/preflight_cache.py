@@ -0,0 +1,65 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+# Shared by the MediaSync and fixity drivers, each driver directory links to
+# this file and the link is followed when the function is packaged.
+#
+# Least recently used HEAD responses by key, kept for ttl seconds. Permanent
+# errors (the object or bucket is missing or not readable) are cached as well,
+# unless get is called with errors=False.
+
+import threading
+import time
+from collections import OrderedDict
+from botocore.exceptions import ClientError
+
+class PreflightCache:
+
+    PERMANENT_ERRORS = ['403', '404', 'AccessDenied', 'NoSuchKey', 'NoSuchBucket']
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, load, now=None, errors=True):
+        now = time.time() if now is None else now
+
+        with self._lock:
+            entry = self._entries.get(key)
+            # without errors, cached errors are loaded again and new ones are not cached
+            if entry is not None and entry[0] > now and (errors or entry[2] is None):
+                # least recently used first
+                self._entries.move_to_end(key)
+            else:
+                entry = None
+
+        if entry is not None:
+            if entry[2] is not None:
+                raise entry[2]
+            return entry[1]
+
+        try:
+            response = load()
+        except ClientError as e:
+            if errors and e.response['Error']['Code'] in self.PERMANENT_ERRORS:
+                self._put(key, None, e, now)
+            raise
+
+        self._put(key, response, None, now)
+        return response
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def _put(self, key, response, error, now):
+        if self.ttl <= 0 or self.size <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (now + self.ttl, response, error)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
@@ -0,0 +1,34 @@
+#######################################################################################################################
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.                                                 #
+#                                                                                                                     #
+#  Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance     #
+#  with the License. A copy of the License is located at                                                              #
+#                                                                                                                     #
+#      http://www.apache.org/licenses/LICENSE-2.0                                                                     #
+#                                                                                                                     #
+#  or in the 'license' file accompanying this file. This file is distributed on an 'AS IS' BASIS, WITHOUT WARRANTIES  #
+#  OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions     #
+#  and limitations under the License.                                                                                 #
+#######################################################################################################################
+import os
+import unittest
+
+class TestChecksums(unittest.TestCase):
+
+    def test_verify_checksum_success(self):
+        from checksums import verify_checksum
+        self.assertEqual(verify_checksum('SHA256', 'AAAA', 'AAAA'), 'ChecksumSHA256 AAAA verified')
+        self.assertEqual(verify_checksum('SHA256', None, 'AAAA'), 'ChecksumSHA256 AAAA')
+        self.assertEqual(verify_checksum('CRC32C', 'AAAAAA==', None), 'ChecksumCRC32C not available')
+        self.assertEqual(verify_checksum('CRC32C', 'AAAAAA==-2', 'BBBBBB=='), 'ChecksumCRC32C BBBBBB== not comparable to AAAAAA==-2')
+
+    def test_verify_checksum_error(self):
+        from checksums import verify_checksum, ChecksumMismatchError
+        self.assertRaises(ChecksumMismatchError, verify_checksum, 'SHA256', 'AAAA', 'BBBB')
+
+    def test_driver_checksums_success(self):
+        # the drivers and the scripts link to this module
+        common = os.path.dirname(os.path.realpath(__file__))
+        for driver in ['autoingest/lambda/autoingest_driver', 'mediasync/lambda/mediasync_driver', 'mediasync/scripts']:
+            path = os.path.join(common, '..', driver, 'checksums.py')
+            self.assertEqual(os.path.realpath(path), os.path.join(common, 'checksums.py'))
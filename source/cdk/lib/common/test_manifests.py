@@ -0,0 +1,78 @@
+#######################################################################################################################
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.                                                 #
+#                                                                                                                     #
+#  Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance     #
+#  with the License. A copy of the License is located at                                                              #
+#                                                                                                                     #
+#      http://www.apache.org/licenses/LICENSE-2.0                                                                     #
+#                                                                                                                     #
+#  or in the 'license' file accompanying this file. This file is distributed on an 'AS IS' BASIS, WITHOUT WARRANTIES  #
+#  OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions     #
+#  and limitations under the License.                                                                                 #
+#######################################################################################################################
+import gzip
+import json
+import os
+import tempfile
+import unittest
+import boto3
+import mock
+from moto import mock_s3
+
+S3_BUCKET_NAME = 'buckettestname'
+DEFAULT_REGION = 'us-east-1'
+
+
+@mock_s3
+class TestManifests(unittest.TestCase):
+    def setUp(self):
+        # moto does not decode aws-chunked uploads
+        environ = mock.patch.dict(os.environ, {'AWS_DEFAULT_REGION': DEFAULT_REGION, 'AWS_REQUEST_CHECKSUM_CALCULATION': 'when_required'})
+        environ.start()
+        self.addCleanup(environ.stop)
+        boto3.setup_default_session()
+        self.s3 = boto3.client('s3', region_name=DEFAULT_REGION)
+        self.s3.create_bucket(Bucket=S3_BUCKET_NAME)
+
+    def test_read_manifest_success(self):
+        from manifests import read_manifest, with_sizes
+        self.s3.put_object(Bucket=S3_BUCKET_NAME, Key='a b.mp4', Body=b'abc')
+        rows = S3_BUCKET_NAME + ',a+b.mp4\n\n' + S3_BUCKET_NAME + ',c.mp4,20\n'
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write(rows)
+        self.addCleanup(os.remove, f.name)
+        self.s3.put_object(Bucket=S3_BUCKET_NAME, Key='manifest.csv', Body=rows.encode())
+        for manifest in [f.name, 's3://' + S3_BUCKET_NAME + '/manifest.csv']:
+            self.assertEqual(list(read_manifest(self.s3, manifest)), [(S3_BUCKET_NAME, 'a b.mp4', None), (S3_BUCKET_NAME, 'c.mp4', 20)])
+        # HEAD for the rows without a size
+        self.assertEqual(list(with_sizes(self.s3, read_manifest(self.s3, f.name))), [(S3_BUCKET_NAME, 'a b.mp4', 3), (S3_BUCKET_NAME, 'c.mp4', 20)])
+
+    def test_read_inventory_success(self):
+        from manifests import read_inventory
+        rows = 'buckettestname,a+b.mp4,10,true\nbuckettestname,c.mp4,20,false\n'
+        self.s3.put_object(Bucket=S3_BUCKET_NAME, Key='inventory/data/0.csv.gz', Body=gzip.compress(rows.encode()))
+        manifest = {'fileFormat': 'CSV', 'fileSchema': 'Bucket, Key, Size, IsLatest', 'destinationBucket': 'arn:aws:s3:::' + S3_BUCKET_NAME,
+                    'files': [{'key': 'inventory/data/0.csv.gz'}]}
+        self.s3.put_object(Bucket=S3_BUCKET_NAME, Key='inventory/manifest.json', Body=json.dumps(manifest))
+        self.assertEqual(list(read_inventory(self.s3, 's3://' + S3_BUCKET_NAME + '/inventory/manifest.json')), [(S3_BUCKET_NAME, 'a b.mp4', 10)])
+
+    def test_read_raw_keys_success(self):
+        from manifests import read_manifest, read_inventory
+        self.s3.put_object(Bucket=S3_BUCKET_NAME, Key='manifest.csv', Body=(S3_BUCKET_NAME + ',a+b.mp4\n').encode())
+        self.assertEqual(list(read_manifest(self.s3, 's3://' + S3_BUCKET_NAME + '/manifest.csv', decode_keys=False)), [(S3_BUCKET_NAME, 'a+b.mp4', None)])
+        # an inventory without sizes
+        self.s3.put_object(Bucket=S3_BUCKET_NAME, Key='inventory/data/0.csv.gz', Body=gzip.compress(b'buckettestname,a+b.mp4\n'))
+        manifest = {'fileFormat': 'CSV', 'fileSchema': 'Bucket, Key', 'destinationBucket': 'arn:aws:s3:::' + S3_BUCKET_NAME,
+                    'files': [{'key': 'inventory/data/0.csv.gz'}]}
+        self.s3.put_object(Bucket=S3_BUCKET_NAME, Key='inventory/manifest.json', Body=json.dumps(manifest))
+        uri = 's3://' + S3_BUCKET_NAME + '/inventory/manifest.json'
+        self.assertRaises(ValueError, list, read_inventory(self.s3, uri))
+        self.assertEqual(list(read_inventory(self.s3, uri, decode_keys=False, require_size=False)), [(S3_BUCKET_NAME, 'a+b.mp4', None)])
+
+    def test_driver_scripts_success(self):
+        # the scripts link to this module
+        common = os.path.dirname(os.path.realpath(__file__))
+        for scripts in ['fixity/scripts', 'mediasync/scripts']:
+            for module in ['manifests.py', 'job_schedule.py']:
+                path = os.path.join(common, '..', scripts, module)
+                self.assertEqual(os.path.realpath(path), os.path.join(common, module))
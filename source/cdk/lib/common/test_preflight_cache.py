@@ -0,0 +1,65 @@
+#######################################################################################################################
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.                                                 #
+#                                                                                                                     #
+#  Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance     #
+#  with the License. A copy of the License is located at                                                              #
+#                                                                                                                     #
+#      http://www.apache.org/licenses/LICENSE-2.0                                                                     #
+#                                                                                                                     #
+#  or in the 'license' file accompanying this file. This file is distributed on an 'AS IS' BASIS, WITHOUT WARRANTIES  #
+#  OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions     #
+#  and limitations under the License.                                                                                 #
+#######################################################################################################################
+import os
+import unittest
+import mock
+from botocore.exceptions import ClientError
+
+class TestPreflightCache(unittest.TestCase):
+
+    def test_preflight_cache_success(self):
+        from preflight_cache import PreflightCache
+        cache = PreflightCache(2, 60)
+        load = mock.Mock(side_effect=[{'ContentLength': 1}, {'ContentLength': 2}, {'ContentLength': 3}, {'ContentLength': 4}])
+        self.assertEqual(cache.get(('a', 'k'), load, now=0), {'ContentLength': 1})
+        self.assertEqual(cache.get(('a', 'k'), load, now=59), {'ContentLength': 1})
+        # expired
+        self.assertEqual(cache.get(('a', 'k'), load, now=60), {'ContentLength': 2})
+        # the least recently used entry is evicted
+        cache.get(('a', 'l'), load, now=61)
+        cache.get(('a', 'k'), load, now=62)
+        cache.get(('a', 'm'), load, now=63)
+        self.assertEqual(cache.get(('a', 'k'), load, now=64), {'ContentLength': 2})
+        self.assertEqual(load.call_count, 4)
+
+    def test_preflight_cache_error(self):
+        from preflight_cache import PreflightCache
+        cache = PreflightCache(10, 60)
+        not_found = ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+        throttled = ClientError({'Error': {'Code': 'SlowDown', 'Message': 'Slow Down'}}, 'HeadObject')
+        load = mock.Mock(side_effect=[not_found, throttled, throttled])
+        # permanent errors are cached, throttling is not
+        self.assertRaises(ClientError, cache.get, ('a', 'k'), load, 0)
+        self.assertRaises(ClientError, cache.get, ('a', 'k'), load, 1)
+        self.assertRaises(ClientError, cache.get, ('a', 'l'), load, 1)
+        self.assertRaises(ClientError, cache.get, ('a', 'l'), load, 1)
+        self.assertEqual(load.call_count, 3)
+
+    def test_preflight_cache_without_errors(self):
+        from preflight_cache import PreflightCache
+        cache = PreflightCache(10, 60)
+        not_found = ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+        load = mock.Mock(side_effect=[not_found, not_found, {'ContentLength': 1}])
+        self.assertRaises(ClientError, cache.get, ('a', 'k'), load, 0)
+        # the cached error is loaded again, and the new one is not cached
+        self.assertRaises(ClientError, cache.get, ('a', 'k'), load, 1, False)
+        self.assertEqual(cache.get(('a', 'k'), load, now=2, errors=False), {'ContentLength': 1})
+        self.assertEqual(cache.get(('a', 'k'), load, now=3), {'ContentLength': 1})
+        self.assertEqual(load.call_count, 3)
+
+    def test_driver_preflight_cache_success(self):
+        # the drivers link to this module
+        common = os.path.dirname(os.path.realpath(__file__))
+        for driver in ['fixity/lambda/fixity_driver', 'mediasync/lambda/mediasync_driver']:
+            path = os.path.join(common, '..', driver, 'preflight_cache.py')
+            self.assertEqual(os.path.realpath(path), os.path.join(common, 'preflight_cache.py'))
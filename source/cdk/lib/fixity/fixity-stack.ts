@@ -19,7 +19,10 @@ import * as lambda from "aws-cdk-lib/aws-lambda";
 import * as apigateway from "aws-cdk-lib/aws-apigateway";
 import * as ec2 from "aws-cdk-lib/aws-ec2";
 import * as batch from "aws-cdk-lib/aws-batch";
+import * as sqs from "aws-cdk-lib/aws-sqs";
+import * as events from "aws-cdk-lib/aws-events";
 import { RemovalPolicy } from "aws-cdk-lib";
+import * as fs from "fs";
 
 export class FixityStack extends cdk.Stack {
   constructor(scope: Construct, id: string, props?: cdk.StackProps) {
@@ -46,6 +49,18 @@ export class FixityStack extends cdk.Stack {
       type: "String",
       description: "Image Name",
     });
+    const regionalJobQueues = new cdk.CfnParameter(this, "RegionalJobQueues", {
+      type: "String",
+      description:
+        'Optional json map of the fixity job queues and job definitions in other regions, e.g. {"eu-west-1": {"jobQueue": "<arn>", "jobSizeSmall": "<arn>", "jobSizeLarge": "<arn>"}}',
+      default: "",
+    });
+    const eventBuckets = new cdk.CfnParameter(this, "EventBuckets", {
+      type: "CommaDelimitedList",
+      description:
+        "Optional comma separated list of the buckets whose objects are hashed as they are created. The buckets must send their events to Amazon EventBridge.",
+      default: "",
+    });
 
     /**
      * Template metadata
@@ -55,7 +70,7 @@ export class FixityStack extends cdk.Stack {
         ParameterGroups: [
           {
             Label: { default: "Deployment Configuration" },
-            Parameters: [environment.logicalId, imageName.logicalId],
+            Parameters: [environment.logicalId, imageName.logicalId, regionalJobQueues.logicalId, eventBuckets.logicalId],
           },
         ],
       },
@@ -262,20 +277,102 @@ export class FixityStack extends cdk.Stack {
       ],
     });
 
+    // Event driven fixity. Objects created in buckets that send their events
+    // to EventBridge are hashed as they land.
+    const eventDeadLetterQueue = new sqs.CfnQueue(this, "EventDeadLetterQueue", {
+      sqsManagedSseEnabled: true,
+      messageRetentionPeriod: 1209600,
+    });
+
+    const eventQueue = new sqs.CfnQueue(this, "EventQueue", {
+      sqsManagedSseEnabled: true,
+      delaySeconds: 60, // debounce, an object written several times in a minute is hashed once
+      messageRetentionPeriod: 86400,
+      visibilityTimeout: 900,
+      redrivePolicy: {
+        deadLetterTargetArn: eventDeadLetterQueue.attrArn,
+        maxReceiveCount: 3,
+      },
+    });
+
+    const hasEventBuckets = new cdk.CfnCondition(this, "HasEventBuckets", {
+      expression: cdk.Fn.conditionNot(
+        cdk.Fn.conditionEquals(cdk.Fn.join("", eventBuckets.valueAsList), "")
+      ),
+    });
+
+    const objectCreatedRule = new events.CfnRule(this, "ObjectCreatedRule", {
+      description: "Objects to hash",
+      state: cdk.Fn.conditionIf(hasEventBuckets.logicalId, "ENABLED", "DISABLED").toString(),
+      eventPattern: {
+        source: ["aws.s3"],
+        "detail-type": ["Object Created"],
+        detail: { bucket: { name: eventBuckets.valueAsList } },
+      },
+      targets: [{ id: "EventQueue", arn: eventQueue.attrArn }],
+    });
+
+    new sqs.CfnQueuePolicy(this, "EventQueuePolicy", { // NOSONAR
+      queues: [eventQueue.ref],
+      policyDocument: {
+        Version: "2012-10-17",
+        Statement: [
+          {
+            Effect: "Allow",
+            Principal: { Service: "events.amazonaws.com" },
+            Action: "sqs:SendMessage",
+            Resource: eventQueue.attrArn,
+            Condition: { ArnEquals: { "aws:SourceArn": objectCreatedRule.attrArn } },
+          },
+        ],
+      },
+    });
+
+    // Checksum records of hashed objects, compacted by scripts/digest_index.py
+    const indexBucket = new s3.Bucket(this, "IndexBucket", {
+      enforceSSL: true,
+      blockPublicAccess: new s3.BlockPublicAccess({
+        blockPublicAcls: true,
+        blockPublicPolicy: true,
+        ignorePublicAcls: true,
+        restrictPublicBuckets: true,
+      }),
+      encryption: s3.BucketEncryption.S3_MANAGED,
+      removalPolicy: RemovalPolicy.RETAIN,
+    });
+    // keeps the bucket, and the records in it, of earlier deployments
+    (indexBucket.node.defaultChild as s3.CfnBucket).overrideLogicalId("IndexBucket");
+
+    indexBucket.addToResourcePolicy(
+      new iam.PolicyStatement({
+        sid: "RequireTLS",
+        actions: ["s3:*"],
+        effect: iam.Effect.DENY,
+        resources: [`${indexBucket.bucketArn}/*`],
+        principals: [new iam.AnyPrincipal()],
+        conditions: {
+          Bool: {
+            "aws:SecureTransport": false,
+          },
+        },
+      })
+    );
+
     const batchAccessPolicy = new iam.ManagedPolicy(this, "BatchAccessPolicy", {
       managedPolicyName: `mxc-${cdk.Aws.REGION}-${environment.valueAsString}-fixity-lambda-access-policy`,
       statements: [
         new iam.PolicyStatement({
           effect: iam.Effect.ALLOW,
-          actions: ["batch:ListJobs", "batch:TagResource"],
+          actions: ["batch:ListJobs", "batch:TagResource", "batch:DescribeJobs"],
           resources: ["*"],
         }),
         new iam.PolicyStatement({
           effect: iam.Effect.ALLOW,
           actions: ["batch:SubmitJob", "batch:DescribeJobs"],
+          // jobs are submitted to the region of the bucket, see RegionalJobQueues
           resources: [
-            `arn:aws:batch:${cdk.Aws.REGION}:${cdk.Aws.ACCOUNT_ID}:job-definition/*`,
-            `arn:aws:batch:${cdk.Aws.REGION}:${cdk.Aws.ACCOUNT_ID}:job-queue/*`,
+            `arn:aws:batch:*:${cdk.Aws.ACCOUNT_ID}:job-definition/*`,
+            `arn:aws:batch:*:${cdk.Aws.ACCOUNT_ID}:job-queue/*`,
           ],
         }),
         new iam.PolicyStatement({
@@ -287,9 +384,39 @@ export class FixityStack extends cdk.Stack {
         new iam.PolicyStatement({
           sid: "s3get",
           effect: iam.Effect.ALLOW,
-          actions: ["s3:GetObject", "s3:GetObjectVersion"],
+          actions: ["s3:GetObject", "s3:GetObjectVersion", "s3:GetObjectTagging", "s3:GetBucketLocation"],
           resources: ["*"],
         }),
+        new iam.PolicyStatement({
+          sid: "s3tag",
+          effect: iam.Effect.ALLOW,
+          actions: ["s3:PutObjectTagging"],
+          // objects hashed in the event function, arn:aws:s3:::<bucket>/* for each of EventBuckets
+          resources: cdk.Fn.split(
+            ",",
+            cdk.Fn.join("", [
+              "arn:aws:s3:::",
+              cdk.Fn.join("/*,arn:aws:s3:::", eventBuckets.valueAsList),
+              "/*",
+            ])
+          ),
+        }),
+        new iam.PolicyStatement({
+          sid: "s3index",
+          effect: iam.Effect.ALLOW,
+          actions: ["s3:PutObject"],
+          resources: [`${indexBucket.bucketArn}/*`],
+        }),
+        new iam.PolicyStatement({
+          sid: "sqs",
+          effect: iam.Effect.ALLOW,
+          actions: [
+            "sqs:ReceiveMessage",
+            "sqs:DeleteMessage",
+            "sqs:GetQueueAttributes",
+          ],
+          resources: [eventQueue.attrArn],
+        }),
       ],
     });
 
@@ -304,6 +431,41 @@ export class FixityStack extends cdk.Stack {
     });
     batchAccessPolicy.attachToRole(customLambdaRole);
 
+    // Digest state of large hash jobs, a retried job resumes from its checkpoint
+    const checkpointBucket = new s3.Bucket(this, "CheckpointBucket", {
+      enforceSSL: true,
+      blockPublicAccess: new s3.BlockPublicAccess({
+        blockPublicAcls: true,
+        blockPublicPolicy: true,
+        ignorePublicAcls: true,
+        restrictPublicBuckets: true,
+      }),
+      encryption: s3.BucketEncryption.S3_MANAGED,
+      removalPolicy: RemovalPolicy.RETAIN,
+      lifecycleRules: [
+        {
+          id: "Expire",
+          enabled: true,
+          expiration: cdk.Duration.days(7),
+        },
+      ],
+    });
+
+    checkpointBucket.addToResourcePolicy(
+      new iam.PolicyStatement({
+        sid: "RequireTLS",
+        actions: ["s3:*"],
+        effect: iam.Effect.DENY,
+        resources: [`${checkpointBucket.bucketArn}/*`],
+        principals: [new iam.AnyPrincipal()],
+        conditions: {
+          Bool: {
+            "aws:SecureTransport": false,
+          },
+        },
+      })
+    );
+
     const jobRole = new iam.Role(this, "JobRole", {
       description: "Role for job",
       assumedBy: new iam.ServicePrincipal("ecs-tasks.amazonaws.com"),
@@ -321,10 +483,28 @@ export class FixityStack extends cdk.Stack {
           effect: iam.Effect.ALLOW,
           actions: [
             "s3:PutObjectTagging",
+            // hash.sh tags the version it hashed
+            "s3:PutObjectVersionTagging",
             "s3:AbortMultipartUpload",
             "s3:ListMultipartUploadParts",
           ],
         }),
+        new iam.PolicyStatement({
+          resources: [`${checkpointBucket.bucketArn}/*`],
+          effect: iam.Effect.ALLOW,
+          actions: ["s3:PutObject", "s3:DeleteObject"],
+        }),
+        new iam.PolicyStatement({
+          // a missing checkpoint is NoSuchKey instead of AccessDenied
+          resources: [checkpointBucket.bucketArn],
+          effect: iam.Effect.ALLOW,
+          actions: ["s3:ListBucket"],
+        }),
+        new iam.PolicyStatement({
+          resources: [`${indexBucket.bucketArn}/*`],
+          effect: iam.Effect.ALLOW,
+          actions: ["s3:PutObject"],
+        }),
         new iam.PolicyStatement({
           resources: ["*"],
           effect: iam.Effect.ALLOW,
@@ -343,9 +523,12 @@ export class FixityStack extends cdk.Stack {
           image: imageName.valueAsString,
           vcpus: 1,
           memory: 2048,
-          command: ["Ref::Bucket", "Ref::Key", "2"],
+          command: ["Ref::Bucket", "Ref::Key", "2", "Ref::Region"],
           jobRoleArn: jobRole.roleArn,
+          environment: [{ name: "INDEX_BUCKET", value: indexBucket.bucketName }],
         },
+        // the region of the bucket, set by the driver
+        parameters: { Region: cdk.Aws.REGION },
         retryStrategy: {
           attempts: 3,
         },
@@ -361,9 +544,15 @@ export class FixityStack extends cdk.Stack {
           image: imageName.valueAsString,
           vcpus: 16,
           memory: 16384,
-          command: ["Ref::Bucket", "Ref::Key", "32"],
+          command: ["Ref::Bucket", "Ref::Key", "32", "Ref::Region"],
           jobRoleArn: jobRole.roleArn,
+          environment: [
+            { name: "CHECKPOINT_BUCKET", value: checkpointBucket.bucketName },
+            { name: "COMPOSITE_CHECKSUMS", value: "Yes" },
+            { name: "INDEX_BUCKET", value: indexBucket.bucketName },
+          ],
         },
+        parameters: { Region: cdk.Aws.REGION },
         retryStrategy: {
           attempts: 3,
         },
@@ -380,6 +569,11 @@ export class FixityStack extends cdk.Stack {
       )
     );
 
+    // Tuning of the driver functions, shared with tests/simulator so that a
+    // simulation runs with what is deployed. Objects of JOB_SIZE_THRESHOLD
+    // (10GB) and larger are hashed by the large job definition.
+    const driverSettings: Record<string, string> = JSON.parse(fs.readFileSync("lib/fixity/driver-settings.json", "utf8"));
+
     // Actual lambda driver function
 
     const driverFunction = new lambda.Function(this, "DriverFunction", {
@@ -388,15 +582,19 @@ export class FixityStack extends cdk.Stack {
       description: "Lambda function to be invoked by s3 batch",
       functionName: `mxc-${cdk.Aws.REGION}-${environment.valueAsString}-fixity`,
       role: customLambdaRole,
-      code: lambda.Code.fromAsset("lib/fixity/lambda/fixity_driver/"),
+      code: lambda.Code.fromAsset("lib/fixity/lambda/fixity_driver/", {
+        // index_record.py and preflight_cache.py are links
+        followSymlinks: cdk.SymlinkFollowMode.ALWAYS,
+      }),
       timeout: cdk.Duration.seconds(30),
       reservedConcurrentExecutions: 256,
       memorySize: 128,
       environment: {
         JOB_SIZE_SMALL: hashJobDefinitionSmall.ref,
         JOB_SIZE_LARGE: hashJobDefinitionLarge.ref,
-        JOB_SIZE_THRESHOLD: "10737418240",
+        ...driverSettings,
         JOB_QUEUE: jobQueue.attrJobQueueArn,
+        JOB_QUEUES: regionalJobQueues.valueAsString,
         LogLevel: "INFO",
         SOLUTION_IDENTIFIER: "AwsSolution/SO0133/__VERSION__-Fixity",
         SendAnonymizedMetric: cdk.Fn.findInMap('AnonymizedData', 'SendAnonymizedData', 'Data')
@@ -414,13 +612,56 @@ export class FixityStack extends cdk.Stack {
       }
     );
 
+    // Lambda event function, small objects are hashed in the function
+
+    const eventFunction = new lambda.Function(this, "EventFunction", {
+      runtime: lambda.Runtime.PYTHON_3_8,
+      handler: "app.event_handler",
+      description: "Lambda function to be invoked by object created events",
+      functionName: `mxc-${cdk.Aws.REGION}-${environment.valueAsString}-fixity-events`,
+      role: customLambdaRole,
+      code: lambda.Code.fromAsset("lib/fixity/lambda/fixity_driver/", {
+        // index_record.py and preflight_cache.py are links
+        followSymlinks: cdk.SymlinkFollowMode.ALWAYS,
+      }),
+      timeout: cdk.Duration.seconds(900),
+      memorySize: 1024,
+      environment: {
+        JOB_SIZE_SMALL: hashJobDefinitionSmall.ref,
+        JOB_SIZE_LARGE: hashJobDefinitionLarge.ref,
+        ...driverSettings,
+        JOB_QUEUE: jobQueue.attrJobQueueArn,
+        JOB_QUEUES: regionalJobQueues.valueAsString,
+        INLINE_HASH_THRESHOLD_IN_BYTES: "104857600", //100MB
+        INDEX_BUCKET: indexBucket.bucketName,
+        LogLevel: "INFO",
+        SOLUTION_IDENTIFIER: "AwsSolution/SO0133/__VERSION__-Fixity",
+        SendAnonymizedMetric: cdk.Fn.findInMap('AnonymizedData', 'SendAnonymizedData', 'Data')
+      },
+    });
+    eventFunction.node.addDependency(customLambdaRole);
+    eventFunction.node.addDependency(batchAccessPolicy);
+
+    const eventSource = new lambda.CfnEventSourceMapping(this, "EventFunctionEventSource", {
+      functionName: eventFunction.functionName,
+      eventSourceArn: eventQueue.attrArn,
+      batchSize: 10,
+      functionResponseTypes: ["ReportBatchItemFailures"],
+    });
+    eventSource.node.addDependency(batchAccessPolicy);
+
+    new logs.LogGroup(this, "EventFunctionLogGroup", { // NOSONAR
+      logGroupName: `/aws/lambda/${eventFunction.functionName}`,
+      retention: logs.RetentionDays.ONE_MONTH,
+    });
+
     const fixityApi = new apigateway.RestApi(this, "FixityApi", {
       defaultMethodOptions: {
         authorizationType: apigateway.AuthorizationType.IAM,
       },
       defaultCorsPreflightOptions: {
         allowOrigins: ["*"],
-        allowMethods: ["POST"],
+        allowMethods: ["POST", "GET"],
         allowHeaders: ["X-Forwarded-For"],
         maxAge: cdk.Duration.seconds(1200),
       },
@@ -440,15 +681,20 @@ export class FixityStack extends cdk.Stack {
       handler: "app.api_handler",
       description: "Lambda function to be invoked by api",
       role: customLambdaRole,
-      code: lambda.Code.fromAsset("lib/fixity/lambda/fixity_driver/"),
-      timeout: cdk.Duration.seconds(10),
+      code: lambda.Code.fromAsset("lib/fixity/lambda/fixity_driver/", {
+        // index_record.py and preflight_cache.py are links
+        followSymlinks: cdk.SymlinkFollowMode.ALWAYS,
+      }),
+      timeout: cdk.Duration.seconds(30),
       reservedConcurrentExecutions: 1,
       memorySize: 128,
       environment: {
         JOB_SIZE_SMALL: hashJobDefinitionSmall.ref,
         JOB_SIZE_LARGE: hashJobDefinitionLarge.ref,
-        JOB_SIZE_THRESHOLD: "10737418240",
+        ...driverSettings,
         JOB_QUEUE: jobQueue.attrJobQueueArn,
+        JOB_QUEUES: regionalJobQueues.valueAsString,
+        BULK_MAX_OBJECTS: "500",
         LogLevel: "INFO",
         SOLUTION_IDENTIFIER: "AwsSolution/SO0133/__VERSION__-Fixity",
         SendAnonymizedMetric: cdk.Fn.findInMap('AnonymizedData', 'SendAnonymizedData', 'Data')
@@ -456,6 +702,8 @@ export class FixityStack extends cdk.Stack {
     });
     const demo = fixityApi.root.addResource("run");
     demo.addMethod("POST", new apigateway.LambdaIntegration(apiFunction));
+    // status and checksums of objects and jobs
+    demo.addMethod("GET", new apigateway.LambdaIntegration(apiFunction));
 
     apiFunction.node.addDependency(customLambdaRole);
     apiFunction.node.addDependency(batchAccessPolicy);
@@ -527,6 +775,13 @@ export class FixityStack extends cdk.Stack {
       exportName: "FixtyS3BatchIAMRoleArn",
     });
     // Outputs
+    new cdk.CfnOutput(this, "FixityIndexBucketName", { // NOSONAR
+      // NOSONAR
+      description: "Fixity digest index Bucket Name",
+      value: indexBucket.bucketName,
+      exportName: "FixityIndexBucketName",
+    });
+    // Outputs
     new cdk.CfnOutput(this, "FlowLogBucketName", { // NOSONAR
       // NOSONAR
       description: "Flow log Bucket Name",
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+# usage: ./checkpoint_hash.py <bucket> <key> <no of workers> [<bucket region>]
+#
+# Computes the same md5, sha1 and xxhash (XXH64) checksums as hash.sh, but
+# saves the digest state and the byte offset to CHECKPOINT_BUCKET every
+# CHECKPOINT_INTERVAL_IN_SECONDS. When the job is retried (e.g. after an EC2
+# Spot interruption) hashing resumes from the last checkpoint instead of the
+# first byte.
+#
+# hashlib cannot export its state, so the digests are computed with the
+# libcrypto and libxxhash contexts. Checkpoints are taken at chunk boundaries,
+# where no input is buffered in the contexts, and keep the chaining values and
+# the length only. This does not depend on the ABI of the libraries; the layout
+# of the contexts is checked against a digest of known data before a job
+# starts.
+#
+# With COMPOSITE_CHECKSUMS=Yes every chunk is also hashed with sha256 and crc32c
+# in a process pool, and the checksums of the chunks are combined into the
+# checksum-of-checksums S3 reports for a multipart upload with the same part
+# size. Unlike md5 and sha1 these scale with the number of cores.
+
+import os
+import sys
+import json
+import time
+import base64
+import struct
+import hashlib
+import ctypes
+import ctypes.util
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import boto3
+from botocore import config
+from botocore.exceptions import ClientError
+from index_record import write_record
+
+logger = logging.getLogger()
+logger.setLevel(os.environ.get('LogLevel', 'INFO'))
+
+MB = 1024 * 1024
+
+# bumped whenever the layout of a checkpoint changes
+CHECKPOINT_VERSION = 3
+
+presetConfig = config.Config(retries={'max_attempts': 10, 'mode': 'standard'}, max_pool_connections=64)
+
+
+
+def load_library(name):
+
+    path = ctypes.util.find_library(name)
+    if path is None:
+        # CDLL(None) would load the main program
+        raise OSError('lib' + name + ' not found')
+
+    return ctypes.CDLL(path)
+
+
+libcrypto = load_library('crypto')
+libxxhash = load_library('xxhash')
+libxxhash.XXH64_digest.restype = ctypes.c_ulonglong
+
+try:
+    # optional, a lot faster than the fallback below
+    from crc32c import crc32c
+except ImportError:
+    CRC32C_TABLE = []
+    for n in range(256):
+        for _ in range(8):
+            n = (n >> 1) ^ 0x82F63B78 if n & 1 else n >> 1
+        CRC32C_TABLE.append(n)
+
+    def crc32c(data, value=0):
+        crc = value ^ 0xFFFFFFFF
+        for b in data:
+            crc = CRC32C_TABLE[(crc ^ b) & 0xFF] ^ (crc >> 8)
+        return crc ^ 0xFFFFFFFF
+
+
+class Digest:
+
+    # the C context, MD5_CTX / SHA_CTX / XXH64_state_t, is allocated with room
+    # to spare. layout is the struct format of the chaining values and the
+    # length at the start of the context, pending the offset of the number of
+    # buffered bytes.
+    buffer_size = 512
+    block_size = 64
+    layout = ''
+    pending = 0
+
+    def __init__(self, state=None):
+        self.context = ctypes.create_string_buffer(self.buffer_size)
+        if state is None:
+            self.reset()
+        else:
+            struct.pack_into(self.layout, self.context, 0, *self.to_fields(state))
+
+    def state(self):
+        if struct.unpack_from('=I', self.context, self.pending)[0]:
+            raise ValueError('input is buffered, the state is only saved at a multiple of ' + str(self.block_size) + ' bytes')
+        return self.from_fields(struct.unpack_from(self.layout, self.context, 0))
+
+    def to_fields(self, state):
+        raise NotImplementedError
+
+    def from_fields(self, fields):
+        raise NotImplementedError
+
+    def reset(self):
+        raise NotImplementedError
+
+    def update(self, data):
+        raise NotImplementedError
+
+    def hexdigest(self):
+        raise NotImplementedError
+
+    def copy_context(self):
+        # finalizing would modify the context
+        return ctypes.create_string_buffer(self.context.raw, self.buffer_size)
+
+
+class OpenSSLDigest(Digest):
+
+    # chaining values, then the length in bits as Nl and Nh
+    words = 0
+
+    def to_fields(self, state):
+        bits = state['Length'] * 8
+        return state['Words'] + [bits & 0xFFFFFFFF, bits >> 32]
+
+    def from_fields(self, fields):
+        return {'Words': list(fields[:self.words]), 'Length': (fields[self.words] | fields[self.words + 1] << 32) // 8}
+
+
+class MD5(OpenSSLDigest):
+
+    words = 4
+    layout = '=4I2I'
+    # A, B, C, D, Nl, Nh, data[16], num
+    pending = 88
+
+    def reset(self):
+        libcrypto.MD5_Init(self.context)
+
+    def update(self, data):
+        libcrypto.MD5_Update(self.context, data, ctypes.c_size_t(len(data)))
+
+    def hexdigest(self):
+        result = ctypes.create_string_buffer(16)
+        libcrypto.MD5_Final(result, self.copy_context())
+        return result.raw.hex()
+
+
+class SHA1(OpenSSLDigest):
+
+    words = 5
+    layout = '=5I2I'
+    # h0-h4, Nl, Nh, data[16], num
+    pending = 92
+
+    def reset(self):
+        libcrypto.SHA1_Init(self.context)
+
+    def update(self, data):
+        libcrypto.SHA1_Update(self.context, data, ctypes.c_size_t(len(data)))
+
+    def hexdigest(self):
+        result = ctypes.create_string_buffer(20)
+        libcrypto.SHA1_Final(result, self.copy_context())
+        return result.raw.hex()
+
+
+class XXHash(Digest):
+
+    block_size = 32
+    layout = '=5Q'
+    # total_len, v[4], mem64[4], memsize
+    pending = 72
+
+    def to_fields(self, state):
+        return [state['Length']] + state['Words']
+
+    def from_fields(self, fields):
+        return {'Words': list(fields[1:]), 'Length': fields[0]}
+
+    def reset(self):
+        libxxhash.XXH64_reset(self.context, ctypes.c_ulonglong(0))
+
+    def update(self, data):
+        libxxhash.XXH64_update(self.context, data, ctypes.c_size_t(len(data)))
+
+    def hexdigest(self):
+        return '{:016x}'.format(libxxhash.XXH64_digest(self.copy_context()))
+
+
+# tag name, digest
+DIGESTS = [('Content-MD5', MD5), ('Content-SHA1', SHA1), ('Content-XXHash', XXHash)]
+
+
+def check_state_layout():
+
+    # a state saved and restored half way must give the digest of the whole
+    # data, or the libraries have a layout this script does not know
+    data = bytes(range(256)) * 2
+    for name, digest in DIGESTS:
+        first = digest()
+        first.update(data[:256])
+        state = first.state()
+        second = digest(state)
+        second.update(data[256:])
+        whole = digest()
+        whole.update(data)
+        if state['Length'] != 256 or second.hexdigest() != whole.hexdigest():
+            raise RuntimeError('unsupported context layout of ' + name)
+
+
+def get_part_checksums(data):
+
+    return hashlib.sha256(data).digest(), struct.pack('>I', crc32c(data))
+
+
+def get_composite_checksums(parts):
+
+    # same format as ChecksumSHA256 / ChecksumCRC32C of a multipart upload
+    suffix = '-' + str(len(parts))
+    sha256 = hashlib.sha256(b''.join(part[0] for part in parts)).digest()
+    crc = struct.pack('>I', crc32c(b''.join(part[1] for part in parts)))
+
+    return {
+        'Content-SHA256-Composite': base64.b64encode(sha256).decode('ascii') + suffix,
+        'Content-CRC32C-Composite': base64.b64encode(crc).decode('ascii') + suffix
+    }
+
+
+# error codes of a checkpoint that does not exist. The job role can list the
+# checkpoint bucket, AccessDenied is a misconfiguration that fails the job
+# rather than hash from the first byte on every retry.
+NO_CHECKPOINT_ERRORS = ['NoSuchKey', '404']
+
+
+def get_checkpoint_key(bucket, key):
+
+    return 'checkpoints/' + bucket + '/' + key + '.json'
+
+
+def load_checkpoint(client, checkpoint_bucket, bucket, key, etag):
+
+    try:
+        checkpoint = json.loads(client.get_object(Bucket=checkpoint_bucket, Key=get_checkpoint_key(bucket, key))['Body'].read())
+    except ClientError as e:
+        if e.response['Error']['Code'] in NO_CHECKPOINT_ERRORS:
+            return None
+        raise
+
+    # the object was overwritten since the checkpoint was taken
+    if checkpoint.get('Version') != CHECKPOINT_VERSION or checkpoint.get('ETag') != etag:
+        logger.info('ignoring stale checkpoint')
+        return None
+
+    return checkpoint
+
+
+def save_checkpoint(client, checkpoint_bucket, bucket, key, etag, offset, digests, chunk_size, parts):
+
+    checkpoint = {
+        'Version': CHECKPOINT_VERSION,
+        'ETag': etag,
+        'Offset': offset,
+        'ChunkSize': chunk_size,
+        'State': {name: digest.state() for name, digest in digests.items()},
+        'Parts': [[base64.b64encode(checksum).decode('ascii') for checksum in part] for part in parts]
+    }
+    client.put_object(Bucket=checkpoint_bucket, Key=get_checkpoint_key(bucket, key), Body=json.dumps(checkpoint))
+    logger.info('checkpoint at ' + str(offset))
+
+
+def read_range(client, bucket, key, etag, start, end):
+
+    return client.get_object(Bucket=bucket, Key=key, Range='bytes={}-{}'.format(start, end), IfMatch=etag)['Body'].read()
+
+
+def hash_object(bucket, key, workers, region=None):
+
+    # the object is read from its region, checkpoints and index records are
+    # written in the region of the job
+    source_client = boto3.client('s3', region_name=region, config=presetConfig)
+    client = boto3.client('s3', config=presetConfig)
+    checkpoint_bucket = os.environ.get('CHECKPOINT_BUCKET')
+    chunk_size = int(os.environ.get('CHUNK_SIZE_IN_BYTES', str(64 * MB)))
+    interval = int(os.environ.get('CHECKPOINT_INTERVAL_IN_SECONDS', '60'))
+    composite = os.environ.get('COMPOSITE_CHECKSUMS', 'No') == 'Yes'
+    composite_workers = int(os.environ.get('COMPOSITE_WORKERS', str(os.cpu_count())))
+
+    if checkpoint_bucket:
+        check_state_layout()
+        if chunk_size % Digest.block_size:
+            raise ValueError('CHUNK_SIZE_IN_BYTES must be a multiple of ' + str(Digest.block_size))
+
+    head = source_client.head_object(Bucket=bucket, Key=key)
+    size = head['ContentLength']
+    etag = head['ETag']
+
+    checkpoint = load_checkpoint(client, checkpoint_bucket, bucket, key, etag) if checkpoint_bucket else None
+    if checkpoint is None:
+        offset = 0
+        digests = {name: digest() for name, digest in DIGESTS}
+        parts = []
+    else:
+        offset = checkpoint['Offset']
+        digests = {name: digest(checkpoint['State'][name]) for name, digest in DIGESTS}
+        # composite checksums depend on the chunk size of the first attempt
+        chunk_size = checkpoint['ChunkSize']
+        parts = [tuple(base64.b64decode(checksum) for checksum in part) for part in checkpoint['Parts']]
+        logger.info('resuming at ' + str(offset) + ' of ' + str(size))
+
+    # parts hashed before the checkpoint have no composite checksums
+    composite = composite and len(parts) == offset // chunk_size
+
+    checkpointed = time.monotonic()
+
+    # chunks are read ahead in parallel and hashed in order, one thread per
+    # digest. ctypes releases the GIL while the C code runs. Composite
+    # checksums of the chunks are independent and run in their own processes,
+    # at most two chunks per process are queued.
+    max_pending_parts = 2 * composite_workers
+    with ThreadPoolExecutor(max_workers=workers) as readers, ThreadPoolExecutor(max_workers=len(DIGESTS)) as hashers, ProcessPoolExecutor(max_workers=composite_workers) as composers:
+        pending = deque()
+        pending_parts = deque()
+        next_start = offset
+
+        while offset < size:
+            while next_start < size and len(pending) < workers:
+                end = min(next_start + chunk_size, size) - 1
+                pending.append(readers.submit(read_range, source_client, bucket, key, etag, next_start, end))
+                next_start = end + 1
+
+            data = pending.popleft().result()
+            if composite:
+                while len(pending_parts) >= max_pending_parts:
+                    parts.append(pending_parts.popleft().result())
+                pending_parts.append(composers.submit(get_part_checksums, data))
+            for future in [hashers.submit(digest.update, data) for digest in digests.values()]:
+                future.result()
+            offset += len(data)
+
+            if checkpoint_bucket and offset < size and time.monotonic() - checkpointed >= interval:
+                parts.extend(future.result() for future in pending_parts)
+                pending_parts.clear()
+                save_checkpoint(client, checkpoint_bucket, bucket, key, etag, offset, digests, chunk_size, parts if composite else [])
+                checkpointed = time.monotonic()
+
+        parts.extend(future.result() for future in pending_parts)
+
+    checksums = {name: digest.hexdigest() for name, digest in digests.items()}
+    if composite:
+        checksums.update(get_composite_checksums(parts))
+
+    source_client.put_object_tagging(
+        Bucket=bucket,
+        Key=key,
+        Tagging={'TagSet': [{'Key': name, 'Value': value} for name, value in checksums.items()]}
+    )
+
+    if os.environ.get('INDEX_BUCKET'):
+        write_record(client, os.environ['INDEX_BUCKET'], bucket, key, etag, size, checksums)
+
+    if checkpoint_bucket:
+        client.delete_object(Bucket=checkpoint_bucket, Key=get_checkpoint_key(bucket, key))
+
+    logger.info(json.dumps(checksums))
+
+    return checksums
+
+
+def main(argv):
+
+    if len(argv) < 4:
+        print('usage: checkpoint_hash.py <bucket> <key> <no of workers> [<bucket region>]')
+        return 1
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s')
+    hash_object(argv[1], argv[2], int(argv[3]), argv[4] if len(argv) > 4 else None)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
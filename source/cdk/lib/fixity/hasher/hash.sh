@@ -3,7 +3,7 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: Apache-2.0
 
-# usage: ./hash.sh <bucket> <key> <no of workers>
+# usage: ./hash.sh <bucket> <key> <no of workers> [<bucket region>]
 
 [[ -z $1 ]] && { echo "Error: <bucket> is required"; exit 1; }
 [[ -z $2 ]] && { echo "Error: <key> is required"; exit 1; }
@@ -12,7 +12,31 @@
 BUCKET=$1
 KEY=$2
 WORKERS=$3
+# the object is read from its own region, the job runs in the same region when
+# the fixity driver has a job queue there
+REGION=${4:-${AWS_REGION:-$AWS_DEFAULT_REGION}}
 
-AWS_REGION=us-west-2 s3pcat --bucket $BUCKET --key $KEY --workers $WORKERS | tee >(md5sum | cut -d ' ' -f1 > /tmp/MD5.result) >(sha1sum | cut -d ' ' -f1 > /tmp/SHA1.result) >(xxhsum | cut -d ' ' -f1 > /tmp/xxhsum.result) > /dev/null
+# large objects are hashed with checkpoints, a retried job resumes where the last attempt stopped
+if [[ -n $CHECKPOINT_BUCKET ]]; then
+    exec python3 /usr/local/bin/checkpoint_hash.py "$BUCKET" "$KEY" $WORKERS $REGION
+fi
 
-aws s3api put-object-tagging --bucket $BUCKET --key $KEY --tagging "TagSet=[{Key=Content-MD5,Value=$(cat /tmp/MD5.result)},{Key=Content-SHA1,Value=$(cat /tmp/SHA1.result)},{Key=Content-XXHash,Value=$(cat /tmp/xxhsum.result)}]"
+# the version that is hashed, the tags and the index record are for this version
+read ETAG SIZE VERSION_ID <<< $(aws s3api head-object --region $REGION --bucket $BUCKET --key $KEY --query '[ETag,ContentLength,VersionId]' --output text)
+
+AWS_REGION=$REGION s3pcat --bucket $BUCKET --key $KEY --workers $WORKERS | tee >(md5sum | cut -d ' ' -f1 > /tmp/MD5.result) >(sha1sum | cut -d ' ' -f1 > /tmp/SHA1.result) >(xxhsum | cut -d ' ' -f1 > /tmp/xxhsum.result) > /dev/null
+
+# s3pcat cannot pin the version, an object overwritten while it was read fails the job
+if [[ $(aws s3api head-object --region $REGION --bucket $BUCKET --key $KEY --query ETag --output text) != "$ETAG" ]]; then
+    echo "Error: $KEY was overwritten while it was hashed"
+    exit 1
+fi
+
+VERSION_OPTION=""
+[[ $VERSION_ID != "None" ]] && VERSION_OPTION="--version-id $VERSION_ID"
+
+aws s3api put-object-tagging --region $REGION --bucket $BUCKET --key $KEY $VERSION_OPTION --tagging "TagSet=[{Key=Content-MD5,Value=$(cat /tmp/MD5.result)},{Key=Content-SHA1,Value=$(cat /tmp/SHA1.result)},{Key=Content-XXHash,Value=$(cat /tmp/xxhsum.result)}]"
+
+if [[ -n $INDEX_BUCKET ]]; then
+    python3 /usr/local/bin/index_record.py "$BUCKET" "$KEY" "$ETAG" $SIZE Content-MD5=$(cat /tmp/MD5.result) Content-SHA1=$(cat /tmp/SHA1.result) Content-XXHash=$(cat /tmp/xxhsum.result)
+fi
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+# usage: ./index_record.py <bucket> <key> <etag> <size> <tag>=<checksum> ...
+#
+# Writes the checksums of an object as a record to INDEX_BUCKET. Records are
+# compacted into queryable shards by scripts/digest_index.py. The fixity driver
+# links to this file to write the records of the objects it hashes itself.
+#
+# A records object holds one JSON record per line. The driver writes the
+# records of a whole batch of events as one object, so compaction reads one
+# object per batch rather than one per hashed object.
+
+import os
+import sys
+import json
+import uuid
+from datetime import datetime, timezone
+import boto3
+
+
+def get_record(bucket, key, etag, size, checksums):
+
+    return {
+        'Bucket': bucket,
+        'Key': key,
+        'ETag': etag.strip('"'),
+        'Size': size,
+        'Checksums': checksums,
+        'HashedAt': datetime.now(timezone.utc).isoformat()
+    }
+
+
+def write_records(client, index_bucket, records):
+
+    client.put_object(
+        Bucket=index_bucket,
+        Key='records/' + datetime.now(timezone.utc).strftime('%Y-%m-%d') + '/' + str(uuid.uuid4()) + '.jsonl',
+        Body='\n'.join(json.dumps(record) for record in records)
+    )
+
+
+def write_record(client, index_bucket, bucket, key, etag, size, checksums):
+
+    write_records(client, index_bucket, [get_record(bucket, key, etag, size, checksums)])
+
+
+def main(argv):
+
+    if len(argv) < 6 or not os.environ.get('INDEX_BUCKET'):
+        print('usage: INDEX_BUCKET=<bucket> index_record.py <bucket> <key> <etag> <size> <tag>=<checksum> ...')
+        return 1
+
+    # the ETag and size of the version that was hashed, not of a new HEAD
+    # that could see an overwrite
+    checksums = dict(argument.split('=', 1) for argument in argv[5:])
+    write_record(boto3.client('s3'), os.environ['INDEX_BUCKET'], argv[1], argv[2], argv[3], int(argv[4]), checksums)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,174 @@
+#######################################################################################################################
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.                                                 #
+#                                                                                                                     #
+#  Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance     #
+#  with the License. A copy of the License is located at                                                              #
+#                                                                                                                     #
+#      http://www.apache.org/licenses/LICENSE-2.0                                                                     #
+#                                                                                                                     #
+#  or in the 'license' file accompanying this file. This file is distributed on an 'AS IS' BASIS, WITHOUT WARRANTIES  #
+#  OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions     #
+#  and limitations under the License.                                                                                 #
+#######################################################################################################################
+import base64
+import hashlib
+import json
+import os
+import unittest
+import boto3
+import mock
+from moto import mock_s3
+
+S3_BUCKET_NAME = 'buckettestname'
+CHECKPOINT_BUCKET_NAME = 'checkpointbucketname'
+INDEX_BUCKET_NAME = 'indexbucketname'
+DEFAULT_REGION = 'us-east-1'
+S3_TEST_FILE_KEY = 'media/BigBunnySample.mp4'
+CHUNK_SIZE = 1024 * 1024
+S3_TEST_FILE_CONTENT = os.urandom(CHUNK_SIZE * 3 + 1024)
+
+@mock_s3
+class TestCheckpointHash(unittest.TestCase):
+    def setUp(self):
+        # moto does not decode aws-chunked uploads
+        environ = mock.patch.dict(os.environ, {'CHECKPOINT_BUCKET': CHECKPOINT_BUCKET_NAME, 'CHUNK_SIZE_IN_BYTES': str(CHUNK_SIZE), 'AWS_DEFAULT_REGION': DEFAULT_REGION, 'AWS_REQUEST_CHECKSUM_CALCULATION': 'when_required'})
+        environ.start()
+        self.addCleanup(environ.stop)
+        boto3.setup_default_session()
+        self.s3 = boto3.client('s3', region_name=DEFAULT_REGION)
+        self.s3.create_bucket(Bucket=S3_BUCKET_NAME)
+        self.s3.create_bucket(Bucket=CHECKPOINT_BUCKET_NAME)
+        self.s3.put_object(Bucket=S3_BUCKET_NAME, Key=S3_TEST_FILE_KEY, Body=S3_TEST_FILE_CONTENT)
+
+    def tags(self):
+        return {t['Key']: t['Value'] for t in self.s3.get_object_tagging(Bucket=S3_BUCKET_NAME, Key=S3_TEST_FILE_KEY)['TagSet']}
+
+    def test_digest_state_success(self):
+        from checkpoint_hash import MD5, SHA1, XXHash
+        for digest, expected in [(MD5, hashlib.md5), (SHA1, hashlib.sha1)]:
+            first = digest()
+            first.update(S3_TEST_FILE_CONTENT[:1024])
+            # a digest restored from the state carries on where the first stopped
+            second = digest(json.loads(json.dumps(first.state())))
+            second.update(S3_TEST_FILE_CONTENT[1024:])
+            self.assertEqual(second.hexdigest(), expected(S3_TEST_FILE_CONTENT).hexdigest())
+            # the state is only saved at a block boundary
+            first.update(S3_TEST_FILE_CONTENT[:1000])
+            self.assertRaises(ValueError, first.state)
+        self.assertEqual(XXHash().hexdigest(), 'ef46db3751d8e999')
+
+    def test_check_state_layout_error(self):
+        import checkpoint_hash
+        checkpoint_hash.check_state_layout()
+        # a library with another layout of the context
+        with mock.patch.object(checkpoint_hash.SHA1, 'layout', '=4x5I2I'):
+            self.assertRaises(RuntimeError, checkpoint_hash.check_state_layout)
+        self.assertRaises(OSError, checkpoint_hash.load_library, 'nonexistentlibrary')
+
+    def test_hash_object_success(self):
+        from checkpoint_hash import hash_object, get_checkpoint_key
+        hash_object(S3_BUCKET_NAME, S3_TEST_FILE_KEY, 2)
+        tags = self.tags()
+        self.assertEqual(tags['Content-MD5'], hashlib.md5(S3_TEST_FILE_CONTENT).hexdigest())
+        self.assertEqual(tags['Content-SHA1'], hashlib.sha1(S3_TEST_FILE_CONTENT).hexdigest())
+        self.assertEqual(len(tags['Content-XXHash']), 16)
+        self.assertNotIn('Contents', self.s3.list_objects_v2(Bucket=CHECKPOINT_BUCKET_NAME, Prefix=get_checkpoint_key(S3_BUCKET_NAME, '')))
+
+    def test_hash_object_resume_success(self):
+        import checkpoint_hash
+        # an interrupted attempt that hashed the first two chunks
+        offset = CHUNK_SIZE * 2
+        digests = {name: digest() for name, digest in checkpoint_hash.DIGESTS}
+        for digest in digests.values():
+            digest.update(S3_TEST_FILE_CONTENT[:offset])
+        etag = self.s3.head_object(Bucket=S3_BUCKET_NAME, Key=S3_TEST_FILE_KEY)['ETag']
+        checkpoint_hash.save_checkpoint(self.s3, CHECKPOINT_BUCKET_NAME, S3_BUCKET_NAME, S3_TEST_FILE_KEY, etag, offset, digests, CHUNK_SIZE, [])
+
+        with mock.patch.object(checkpoint_hash, 'read_range', wraps=checkpoint_hash.read_range) as read_range:
+            checkpoint_hash.hash_object(S3_BUCKET_NAME, S3_TEST_FILE_KEY, 2)
+            self.assertEqual(sorted(c.args[4] for c in read_range.call_args_list), [CHUNK_SIZE * 2, CHUNK_SIZE * 3])
+
+        self.assertEqual(self.tags()['Content-MD5'], hashlib.md5(S3_TEST_FILE_CONTENT).hexdigest())
+
+    def test_load_checkpoint_stale(self):
+        from checkpoint_hash import load_checkpoint, get_checkpoint_key, CHECKPOINT_VERSION
+        checkpoint = {'Version': CHECKPOINT_VERSION, 'ETag': '"previous"', 'Offset': CHUNK_SIZE, 'ChunkSize': CHUNK_SIZE, 'State': {}, 'Parts': []}
+        self.s3.put_object(Bucket=CHECKPOINT_BUCKET_NAME, Key=get_checkpoint_key(S3_BUCKET_NAME, S3_TEST_FILE_KEY), Body=json.dumps(checkpoint))
+        etag = self.s3.head_object(Bucket=S3_BUCKET_NAME, Key=S3_TEST_FILE_KEY)['ETag']
+        self.assertIsNone(load_checkpoint(self.s3, CHECKPOINT_BUCKET_NAME, S3_BUCKET_NAME, S3_TEST_FILE_KEY, etag))
+        self.assertIsNone(load_checkpoint(self.s3, CHECKPOINT_BUCKET_NAME, S3_BUCKET_NAME, S3_TEST_FILE_KEY + '.missing', etag))
+
+    def test_load_checkpoint_access_denied(self):
+        from botocore.exceptions import ClientError
+        from checkpoint_hash import load_checkpoint
+        client = mock.Mock()
+        # a policy that denies the checkpoint fails the job
+        client.get_object.side_effect = ClientError({'Error': {'Code': 'AccessDenied', 'Message': 'Access Denied'}}, 'GetObject')
+        self.assertRaises(ClientError, load_checkpoint, client, CHECKPOINT_BUCKET_NAME, S3_BUCKET_NAME, S3_TEST_FILE_KEY, '"etag"')
+        client.get_object.side_effect = ClientError({'Error': {'Code': 'SlowDown', 'Message': 'Slow Down'}}, 'GetObject')
+        self.assertRaises(ClientError, load_checkpoint, client, CHECKPOINT_BUCKET_NAME, S3_BUCKET_NAME, S3_TEST_FILE_KEY, '"etag"')
+
+    def test_save_checkpoint_success(self):
+        import checkpoint_hash
+        # checkpoint after every chunk
+        with mock.patch.dict(os.environ, {'CHECKPOINT_INTERVAL_IN_SECONDS': '0'}), mock.patch.object(checkpoint_hash, 'save_checkpoint') as save_checkpoint:
+            checkpoint_hash.hash_object(S3_BUCKET_NAME, S3_TEST_FILE_KEY, 1)
+            self.assertEqual([c.args[5] for c in save_checkpoint.call_args_list], [CHUNK_SIZE, CHUNK_SIZE * 2, CHUNK_SIZE * 3])
+            state = save_checkpoint.call_args.args[6]['Content-MD5'].state()
+            self.assertEqual(state['Length'], len(S3_TEST_FILE_CONTENT))
+            self.assertEqual(len(state['Words']), 4)
+
+    def test_get_composite_checksums_success(self):
+        from checkpoint_hash import crc32c, get_part_checksums, get_composite_checksums
+        self.assertEqual(crc32c(b'123456789'), 0xE3069283)
+        parts = [get_part_checksums(S3_TEST_FILE_CONTENT[i:i + CHUNK_SIZE]) for i in range(0, len(S3_TEST_FILE_CONTENT), CHUNK_SIZE)]
+        checksums = get_composite_checksums(parts)
+        sha256 = hashlib.sha256(b''.join(hashlib.sha256(S3_TEST_FILE_CONTENT[i:i + CHUNK_SIZE]).digest() for i in range(0, len(S3_TEST_FILE_CONTENT), CHUNK_SIZE))).digest()
+        self.assertEqual(checksums['Content-SHA256-Composite'], base64.b64encode(sha256).decode('ascii') + '-4')
+        self.assertTrue(checksums['Content-CRC32C-Composite'].endswith('-4'))
+
+    def test_hash_object_composite_resume_success(self):
+        import checkpoint_hash
+        with mock.patch.dict(os.environ, {'COMPOSITE_CHECKSUMS': 'Yes', 'COMPOSITE_WORKERS': '2'}):
+            expected = checkpoint_hash.hash_object(S3_BUCKET_NAME, S3_TEST_FILE_KEY, 2)
+
+            # an interrupted attempt that hashed the first chunk
+            digests = {name: digest() for name, digest in checkpoint_hash.DIGESTS}
+            for digest in digests.values():
+                digest.update(S3_TEST_FILE_CONTENT[:CHUNK_SIZE])
+            parts = [checkpoint_hash.get_part_checksums(S3_TEST_FILE_CONTENT[:CHUNK_SIZE])]
+            etag = self.s3.head_object(Bucket=S3_BUCKET_NAME, Key=S3_TEST_FILE_KEY)['ETag']
+            checkpoint_hash.save_checkpoint(self.s3, CHECKPOINT_BUCKET_NAME, S3_BUCKET_NAME, S3_TEST_FILE_KEY, etag, CHUNK_SIZE, digests, CHUNK_SIZE, parts)
+
+            self.assertEqual(checkpoint_hash.hash_object(S3_BUCKET_NAME, S3_TEST_FILE_KEY, 2), expected)
+        self.assertEqual(self.tags()['Content-SHA256-Composite'], expected['Content-SHA256-Composite'])
+
+    def test_hash_object_composite_bounded_success(self):
+        import checkpoint_hash
+        with mock.patch.dict(os.environ, {'COMPOSITE_CHECKSUMS': 'Yes', 'COMPOSITE_WORKERS': '2'}):
+            expected = checkpoint_hash.hash_object(S3_BUCKET_NAME, S3_TEST_FILE_KEY, 2)
+        # two chunks in flight for one process, the checksums are collected in order
+        with mock.patch.dict(os.environ, {'COMPOSITE_CHECKSUMS': 'Yes', 'COMPOSITE_WORKERS': '1'}):
+            self.assertEqual(checkpoint_hash.hash_object(S3_BUCKET_NAME, S3_TEST_FILE_KEY, 2), expected)
+
+    def test_hash_object_index_success(self):
+        from checkpoint_hash import hash_object
+        self.s3.create_bucket(Bucket=INDEX_BUCKET_NAME)
+        with mock.patch.dict(os.environ, {'INDEX_BUCKET': INDEX_BUCKET_NAME}):
+            checksums = hash_object(S3_BUCKET_NAME, S3_TEST_FILE_KEY, 2)
+        records = self.s3.list_objects_v2(Bucket=INDEX_BUCKET_NAME, Prefix='records/')['Contents']
+        self.assertEqual(len(records), 1)
+        record = json.loads(self.s3.get_object(Bucket=INDEX_BUCKET_NAME, Key=records[0]['Key'])['Body'].read())
+        self.assertEqual(record['Key'], S3_TEST_FILE_KEY)
+        self.assertEqual(record['Size'], len(S3_TEST_FILE_CONTENT))
+        self.assertEqual(record['Checksums'], checksums)
+
+    def test_main_region_success(self):
+        import checkpoint_hash
+        with mock.patch.object(checkpoint_hash, 'hash_object') as hash_object:
+            self.assertEqual(checkpoint_hash.main(['checkpoint_hash.py', S3_BUCKET_NAME, S3_TEST_FILE_KEY, '2', 'eu-west-1']), 0)
+            hash_object.assert_called_with(S3_BUCKET_NAME, S3_TEST_FILE_KEY, 2, 'eu-west-1')
+
+    def test_main_error(self):
+        from checkpoint_hash import main
+        self.assertEqual(main(['checkpoint_hash.py']), 1)
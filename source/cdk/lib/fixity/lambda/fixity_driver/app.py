@@ -3,21 +3,44 @@
 
 import os
 import logging
+import hashlib
 import boto3
 import json
 import urllib
 import jsonpickle
 from botocore.exceptions import ClientError
 import unicodedata
+import time
+from concurrent.futures import ThreadPoolExecutor
 from botocore import config
 
+try:
+    # optional, Content-XXHash is skipped when it is not installed
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:
+    # links to hasher/index_record.py, the records of the function and the job
+    # are the same, and to lib/common/preflight_cache.py
+    from index_record import get_record, write_record, write_records
+    from preflight_cache import PreflightCache
+except ImportError:
+    # imported as a package by the unit tests
+    from .index_record import get_record, write_record, write_records
+    from .preflight_cache import PreflightCache
+
 solution_identifier= os.environ['SOLUTION_IDENTIFIER']
 
 user_agent_extra_param = {"user_agent_extra":solution_identifier}
 
-presetConfig = config.Config()
+# objects of a bulk request are checked and submitted in parallel, the
+# clients have a pooled connection for every thread
+BULK_CONCURRENCY = int(os.environ.get('BULK_CONCURRENCY', '32'))
+
+presetConfig = config.Config(max_pool_connections=BULK_CONCURRENCY)
 if os.environ['SendAnonymizedMetric'] == 'Yes':
-    presetConfig = config.Config(**user_agent_extra_param)
+    presetConfig = config.Config(max_pool_connections=BULK_CONCURRENCY, **user_agent_extra_param)
 
 logger = logging.getLogger()
 logger.setLevel(os.environ['LogLevel'])
@@ -25,6 +48,22 @@ logger.setLevel(os.environ['LogLevel'])
 batchclient = boto3.client('batch', config=presetConfig)
 s3client = boto3.client('s3', config=presetConfig)
 
+# checksums of recently hashed objects, by bucket, key and ETag
+CHECKSUM_CACHE_SIZE = 4096
+checksum_cache = {}
+
+# the region of a bucket does not change
+bucket_regions = {}
+batch_clients = {}
+s3_clients = {}
+
+# HEAD responses of the preflight check, by bucket and key. S3 Batch invokes
+# the function again for every task that returned TemporaryFailure, a warm
+# function answers those retries without another HEAD. Permanent errors are
+# kept as well, for S3 Batch and events only: an API request after a missing
+# object was uploaded must not get the cached error.
+preflight_cache = None
+
 class ObjectDeletedError(Exception):
     pass
 
@@ -44,18 +83,52 @@ def api_handler(event, _):
     try:
         logger.debug('## EVENT\r' + jsonpickle.encode(dict(**event)))
 
-        if event['queryStringParameters'] and 'bucket' in event['queryStringParameters'] and 'key' in event['queryStringParameters']:
+        parameters = event.get('queryStringParameters') or {}
+
+        if event.get('httpMethod') == 'GET':
+
+            if 'jobId' in parameters or ('bucket' in parameters and 'key' in parameters):
+                status = 200
+                body = _get_status(parameters.get('bucket'), parameters.get('key'), parameters.get('jobId'))
+            else:
+                status = 400
+                body = {"Error": {"Code": 400, "Message": ' \'bucket\' and \'key\' or \'jobId\' are required query parameters'}}
+
+        elif event.get('body'):
 
-            source_bucket = event['queryStringParameters']['bucket']
-            source_key=  event['queryStringParameters']['key']
+            request = json.loads(event['body'])
+            objects = request.get('Objects') if isinstance(request, dict) else None
 
-            batch_job_id = _submit_job(source_bucket, source_key)
+            if not isinstance(objects, list) or not objects or not all(isinstance(o, dict) and 'Bucket' in o and 'Key' in o for o in objects):
+                status = 400
+                body = {"Error": {"Code": 400, "Message": ' \'Objects\' is required, a list of \'Bucket\' and \'Key\''}}
+            elif len(objects) > int(os.environ.get('BULK_MAX_OBJECTS', '500')):
+                status = 400
+                body = {"Error": {"Code": 400, "Message": 'at most ' + os.environ.get('BULK_MAX_OBJECTS', '500') + ' objects per request'}}
+            else:
+                force = request.get('Force', False) is True
+                with ThreadPoolExecutor(max_workers=BULK_CONCURRENCY) as executor:
+                    results = list(executor.map(lambda o: _submit_bulk_object(o['Bucket'], o['Key'], force), objects))
+                status = 200
+                body = {"Results": results}
+
+        elif 'bucket' in parameters and 'key' in parameters:
+
+            source_bucket = parameters['bucket']
+            source_key=  parameters['key']
+
+            batch_job_id = _submit_job(source_bucket, source_key, cache_errors=False)
             body = {"JobId" : batch_job_id }
 
         else:
             status = 400
             body = {"Error": {"Code": 400, "Message": ' \'bucket\' and \'key\' are required query parameters'}}
 
+    except json.JSONDecodeError as e:
+        logger.debug(e)
+
+        body = {"Error": {"Code": 400, "Message": "request body is not valid JSON"}}
+        status = 400
 
     except ClientError as e:
         error_code = e.response['Error']['Code']
@@ -77,9 +150,111 @@ def api_handler(event, _):
     }
 
 
+def _submit_bulk_object(source_bucket, source_key, force):
+
+    result = {'Bucket': source_bucket, 'Key': source_key}
+
+    try:
+        # objects with current checksums are not hashed again
+        checksums = None if force else _get_current_checksums(source_bucket, source_key)
+        if checksums:
+            result.update({'Status': 'Hashed', 'Checksums': checksums})
+        else:
+            result.update({'Status': 'Submitted', 'JobId': _submit_job(source_bucket, source_key, cache_errors=False)})
+
+    except ClientError as e:
+        result.update({'Status': 'Error', 'Error': {'Code': e.response['Error']['Code'], 'Message': e.response['Error']['Message']}})
+
+    except (ObjectDeletedError, UnsupportedStorageClassError, UnsupportedTextFormatError) as e:
+        result.update({'Status': 'Error', 'Error': {'Code': type(e).__name__, 'Message': str(e)}})
+
+    return result
+
+
+def _get_status(source_bucket, source_key, job_id):
+
+    body = {}
+
+    if source_bucket and source_key:
+        checksums = _get_current_checksums(source_bucket, source_key)
+        body.update({'Bucket': source_bucket, 'Key': source_key, 'Status': 'Hashed' if checksums else 'NotHashed'})
+        if checksums:
+            body['Checksums'] = checksums
+
+    if job_id:
+        jobs = _describe_job(job_id)
+        body['Job'] = {'JobId': job_id, 'Status': jobs[0]['status'], 'StatusReason': jobs[0].get('statusReason', '')} if jobs else {'JobId': job_id, 'Status': 'NotFound'}
+
+    return body
+
+
+def _describe_job(job_id):
+
+    # jobs are submitted in the region of the bucket
+    for region in [None] + list(_get_job_routes()):
+        jobs = _get_batch_client(region).describe_jobs(jobs=[job_id])['jobs']
+        if jobs:
+            return jobs
+
+    return []
+
+
+def _get_current_checksums(source_bucket, source_key):
+
+    head = _get_s3_client(source_bucket).head_object(
+        Bucket=source_bucket,
+        Key=source_key
+    )
+    etag = head['ETag'].strip('"')
+
+    cached = checksum_cache.get((source_bucket, source_key, etag))
+    if cached:
+        return cached
+
+    tags = _get_s3_client(source_bucket).get_object_tagging(
+        Bucket=source_bucket,
+        Key=source_key
+    )['TagSet']
+    checksums = {tag['Key']: tag['Value'] for tag in tags if tag['Key'].startswith('Content-')}
+
+    if 'Content-MD5' not in checksums or 'Content-SHA1' not in checksums:
+        return None
+
+    # the ETag of a single part upload without SSE-KMS is the md5 of the
+    # content, tags that do not match it belong to a previous version
+    if '-' not in etag and 'SSEKMSKeyId' not in head and 'SSECustomerAlgorithm' not in head and checksums['Content-MD5'] != etag:
+        logger.info('stale checksums # ' + source_key)
+        return None
+
+    _cache_checksums(source_bucket, source_key, etag, checksums)
+
+    return checksums
+
+
+def _cache_checksums(source_bucket, source_key, etag, checksums):
+
+    # keyed by ETag, an overwritten object is a cache miss
+    if len(checksum_cache) >= CHECKSUM_CACHE_SIZE:
+        del checksum_cache[next(iter(checksum_cache))]
+    checksum_cache[(source_bucket, source_key, etag)] = checksums
+
+
+# S3 Batch writes the result string of every task to the completion report.
+# It is a json object with the job size, the size of the object and the time of
+# the invocation, so that reports can be aggregated (see
+# mediasync/scripts/analyze_report.py).
+def _get_result_string(message, **fields):
+
+    result = {'Message': message}
+    result.update({name: value for name, value in fields.items() if value is not None})
+
+    return json.dumps(result, separators=(',', ':'))
+
+
 def s3_batch_handler(event, _):
 
     logger.debug('## EVENT\r' + jsonpickle.encode(dict(**event)))
+    started = time.time()
 
     invocation_id = event['invocationId']
     invocation_schema_version = event['invocationSchemaVersion']
@@ -93,11 +268,20 @@ def s3_batch_handler(event, _):
     # Prepare result code and string
     result_code = None
     result_string = None
+    size = None
+    job_size = None
+    error_code = None
+    batch_job_id = None
+    url = None
 
     try:
         batch_job_id = _submit_job(source_bucket, source_key)
+        # the preflight response is still cached
+        size = _head_object_cached(source_bucket, source_key)['ContentLength']
+        job_size = _get_job_size(size)
         result_code = 'Succeeded'
-        result_string =  'https://console.aws.amazon.com/batch/v2/home?region=' + os.environ['AWS_REGION'] + '#jobs/detail/'+ batch_job_id
+        result_string = 'Hash job submitted.'
+        url = 'https://console.aws.amazon.com/batch/v2/home?region=' + _get_job_route(_get_bucket_region(source_bucket))[0] + '#jobs/detail/'+ batch_job_id
 
     except ClientError as e:
         # If request timed out, mark as a temp failure
@@ -122,14 +306,21 @@ def s3_batch_handler(event, _):
             result_string = 'Retry request to s3 due to throttling.'
         else:
             result_code = 'PermanentFailure'
-            result_string = '{}: {}'.format(error_code, error_message)
+            result_string = error_message
 
     except Exception as e:
         # Catch all exceptions to permanently fail the task
         result_code = 'PermanentFailure'
-        result_string = 'Exception: {}'.format(e)
+        result_string = str(e)
+        error_code = type(e).__name__
 
     finally:
+        # only retries use the cached preflight response
+        if result_code == 'Succeeded':
+            _get_preflight_cache().discard((source_bucket, source_key))
+
+        result_string = _get_result_string(result_string, Path=job_size, Bytes=size, Seconds=round(time.time() - started, 3),
+                                           Code=error_code, JobId=batch_job_id, Url=url)
         results.append({
             'taskId': task_id,
             'resultCode': result_code,
@@ -145,16 +336,220 @@ def s3_batch_handler(event, _):
     }
 
 
-def _submit_job(source_bucket, source_key):
+def event_handler(event, _):
 
-    logger.debug("preflight check start")
+    logger.debug('## EVENT\r' + jsonpickle.encode(dict(**event)))
 
-    #preflight checks _read_
-    pre_flight_response = s3client.head_object(
+    # the queue delays every message, so an object that is written several
+    # times in a row arrives as several events in the same or in consecutive
+    # batches. Only the last event of an object in a batch is processed, and
+    # events for an ETag that has been overwritten since are skipped.
+    objects = {}
+    for record in event['Records']:
+        try:
+            for bucket, key, etag in _get_created_objects(record['body']):
+                objects[(bucket, key)] = (record['messageId'], etag)
+        except Exception as e:
+            logger.error('unsupported message ' + record['messageId'] + ': {}'.format(e))
+
+    failures = []
+    records = []
+    for (bucket, key), (message_id, etag) in objects.items():
+        try:
+            batch = []
+            result_string = _hash_created_object(bucket, key, etag, batch)
+            records.extend((message_id, record) for record in batch)
+            logger.info(result_string + " # " + key)
+
+        except ClientError as e:
+            error_code = e.response['Error']['Code']
+            error_message = e.response['Error']['Message']
+
+            if error_code in ['404', 'NoSuchKey', 'PreconditionFailed']:
+                logger.info('object changed since the event: {}: {} # {}'.format(error_code, error_message, key))
+            else:
+                logger.warning('{}: {} # {}'.format(error_code, error_message, key))
+                failures.append(message_id)
+
+        except (UnsupportedStorageClassError, UnsupportedTextFormatError) as e:
+            logger.info('{} # {}'.format(e, key))
+
+        except Exception as e:
+            logger.error('Exception: {} # {}'.format(e, key))
+            failures.append(message_id)
+
+    # the records of the batch are one object in the index bucket
+    if records and os.environ.get('INDEX_BUCKET'):
+        try:
+            write_records(s3client, os.environ['INDEX_BUCKET'], [record for _, record in records])
+        except Exception as e:
+            logger.error('Exception writing {} index records: {}'.format(len(records), e))
+            failures.extend(message_id for message_id, _ in records)
+
+    # only the failed messages are returned to the queue
+    return {
+        'batchItemFailures': [{'itemIdentifier': message_id} for message_id in sorted(set(failures))]
+    }
+
+
+def _get_created_objects(body):
+
+    message = json.loads(body)
+
+    # SNS subscriptions wrap the notification
+    if 'Message' in message and 'TopicArn' in message:
+        message = json.loads(message['Message'])
+
+    # EventBridge
+    if 'detail' in message:
+        if message.get('detail-type') == 'Object Created':
+            yield message['detail']['bucket']['name'], message['detail']['object']['key'], message['detail']['object'].get('etag')
+        return
+
+    # S3 event notifications, keys are url encoded
+    for record in message.get('Records', []):
+        if record.get('eventName', '').startswith('ObjectCreated:'):
+            yield record['s3']['bucket']['name'], urllib.parse.unquote_plus(record['s3']['object']['key']), record['s3']['object'].get('eTag')
+
+
+def _hash_created_object(source_bucket, source_key, etag, records=None):
+
+    head = _get_s3_client(source_bucket).head_object(
         Bucket=source_bucket,
         Key=source_key
     )
 
+    if etag and head['ETag'].strip('"') != etag.strip('"'):
+        return 'Skipped, overwritten since the event'
+
+    if 'StorageClass' in head and head['StorageClass'] in ['GLACIER', 'DEEP_ARCHIVE']:
+        raise UnsupportedStorageClassError( source_key + ' is in unsupported StorageClass '  + head['StorageClass'])
+
+    # small objects are hashed right here
+    if head['ContentLength'] <= int(os.environ.get('INLINE_HASH_THRESHOLD_IN_BYTES', '104857600')):
+        checksums = _hash_inline(source_bucket, source_key, head['ETag'])
+        _cache_checksums(source_bucket, source_key, head['ETag'].strip('"'), checksums)
+        # the index record is written right away unless the caller collects
+        # the records of a batch
+        if records is not None:
+            records.append(get_record(source_bucket, source_key, head['ETag'], head['ContentLength'], checksums))
+        elif os.environ.get('INDEX_BUCKET'):
+            write_record(s3client, os.environ['INDEX_BUCKET'], source_bucket, source_key, head['ETag'], head['ContentLength'], checksums)
+        return 'Hashed ' + json.dumps(checksums)
+
+    return 'Submitted ' + _submit_job(source_bucket, source_key)
+
+
+def _hash_inline(source_bucket, source_key, etag):
+
+    digests = {'Content-MD5': hashlib.md5(), 'Content-SHA1': hashlib.sha1()}
+    if xxhash:
+        digests['Content-XXHash'] = xxhash.xxh64()
+
+    body = _get_s3_client(source_bucket).get_object(
+        Bucket=source_bucket,
+        Key=source_key,
+        IfMatch=etag
+    )['Body']
+
+    for chunk in body.iter_chunks(chunk_size=1024 * 1024):
+        for digest in digests.values():
+            digest.update(chunk)
+
+    checksums = {name: digest.hexdigest() for name, digest in digests.items()}
+
+    # same tags as hash.sh
+    _get_s3_client(source_bucket).put_object_tagging(
+        Bucket=source_bucket,
+        Key=source_key,
+        Tagging={'TagSet': [{'Key': name, 'Value': value} for name, value in checksums.items()]}
+    )
+
+    return checksums
+
+
+def _get_bucket_region(bucket):
+
+    if bucket not in bucket_regions:
+        region = s3client.get_bucket_location(Bucket=bucket)['LocationConstraint']
+        # buckets in us-east-1 have no location constraint, EU is eu-west-1
+        bucket_regions[bucket] = {None: 'us-east-1', '': 'us-east-1', 'EU': 'eu-west-1'}.get(region, region)
+
+    return bucket_regions[bucket]
+
+
+# JOB_QUEUES is a json map of the job queues and job definitions in other
+# regions, e.g. {"eu-west-1": {"jobQueue": "<arn>", "jobSizeSmall": "<arn>", "jobSizeLarge": "<arn>"}}
+# buckets in other regions are hashed with JOB_QUEUE, JOB_SIZE_SMALL and JOB_SIZE_LARGE.
+def _get_job_routes():
+
+    return json.loads(os.environ.get('JOB_QUEUES') or '{}')
+
+
+def _get_job_route(region):
+
+    route = _get_job_routes().get(region)
+    if route:
+        return region, route['jobQueue'], route['jobSizeSmall'], route['jobSizeLarge']
+
+    return batchclient.meta.region_name, os.environ['JOB_QUEUE'], os.environ['JOB_SIZE_SMALL'], os.environ['JOB_SIZE_LARGE']
+
+
+def _get_batch_client(region):
+
+    if region is None or region == batchclient.meta.region_name:
+        return batchclient
+
+    if region not in batch_clients:
+        batch_clients[region] = boto3.client('batch', region_name=region, config=presetConfig)
+
+    return batch_clients[region]
+
+
+# requests to a bucket in another region than s3client are redirected by S3,
+# objects are read and tagged by a client of the region of their bucket
+def _get_s3_client(bucket):
+
+    region = _get_bucket_region(bucket)
+    if region == s3client.meta.region_name:
+        return s3client
+
+    if region not in s3_clients:
+        s3_clients[region] = boto3.client('s3', region_name=region, config=presetConfig)
+
+    return s3_clients[region]
+
+
+def _get_preflight_cache():
+    global preflight_cache
+
+    if preflight_cache is None:
+        preflight_cache = PreflightCache(int(os.environ.get('PREFLIGHT_CACHE_SIZE', '4096')), float(os.environ.get('PREFLIGHT_CACHE_TTL_IN_SECONDS', '300')))
+
+    return preflight_cache
+
+
+def _head_object_cached(source_bucket, source_key, cache_errors=True):
+
+    return _get_preflight_cache().get(
+        (source_bucket, source_key),
+        lambda: _get_s3_client(source_bucket).head_object(Bucket=source_bucket, Key=source_key),
+        errors=cache_errors
+    )
+
+
+def _get_job_size(size):
+
+    return 'small' if size < int(os.environ['JOB_SIZE_THRESHOLD']) else 'large'
+
+
+def _submit_job(source_bucket, source_key, cache_errors=True):
+
+    logger.debug("preflight check start")
+
+    #preflight checks _read_
+    pre_flight_response = _head_object_cached(source_bucket, source_key, cache_errors)
+
     logger.debug('## PREFLIGHT_RESPONSE\r' + jsonpickle.encode(dict(**pre_flight_response)))
 
     if 'DeleteMarker' in pre_flight_response and pre_flight_response['pre_flight_response'] == True:
@@ -183,21 +578,26 @@ def _submit_job(source_bucket, source_key):
     if unicodedata.is_normalized('NFC', source_key) == False:
         raise UnsupportedTextFormatError( source_key + ' is not in Normalized Form C' )
 
+    # hashed in the region of the bucket when there is a job queue there
+    source_bucket_region = _get_bucket_region(source_bucket)
+    job_region, job_queue, job_size_small, job_size_large = _get_job_route(source_bucket_region)
+
     # use bigger containers for 10GB+
     logger.debug("job submission start")
-    job_definition = os.environ['JOB_SIZE_SMALL'] if pre_flight_response['ContentLength'] < int(os.environ['JOB_SIZE_THRESHOLD']) else os.environ['JOB_SIZE_LARGE']
-    logger.debug("job definition is " + job_definition)
+    job_definition = job_size_small if _get_job_size(pre_flight_response['ContentLength']) == 'small' else job_size_large
+    logger.debug("job definition is " + job_definition + " in " + job_region)
 
     logger.debug("job submission start")
 
     #submit job
-    response = batchclient.submit_job(
+    response = _get_batch_client(job_region).submit_job(
         jobName="Fixity",
-        jobQueue=os.environ['JOB_QUEUE'],
+        jobQueue=job_queue,
         jobDefinition=job_definition,
         parameters={
             'Bucket': source_bucket,
-            'Key': source_key
+            'Key': source_key,
+            'Region': source_bucket_region
         },
         propagateTags=True,
         tags={
@@ -0,0 +1 @@
+../../hasher/index_record.py
\ No newline at end of file
@@ -10,6 +10,7 @@
 #  OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions     #
 #  and limitations under the License.                                                                                 #
 #######################################################################################################################
+import hashlib
 import json
 import os
 import unittest
@@ -106,19 +107,80 @@ class TestFixityLambdaFunction(unittest.TestCase):
             from fixity_driver.app import _submit_job
             self.assertRaises(ClientError, _submit_job, S3_TEST_FILE_KEY, S3_BUCKET_NAME)
 
+    def test_submit_job_preflight_cache(self):
+        with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No', "JOB_QUEUE": self.job_q_arn, "JOB_SIZE_SMALL": self.job_definition_arn, "JOB_SIZE_LARGE": self.job_definition_arn, 'JOB_SIZE_THRESHOLD': '10737418240', 'LogLevel': 'INFO', 'SOLUTION_IDENTIFIER': awsSolutionId}):
+            from fixity_driver import app
+            app.preflight_cache = None
+            with mock.patch.object(app.s3client, 'head_object', wraps=app.s3client.head_object) as head_object:
+                app._submit_job(S3_BUCKET_NAME, S3_TEST_FILE_KEY)
+                app._submit_job(S3_BUCKET_NAME, S3_TEST_FILE_KEY)
+                # missing objects are cached as well
+                self.assertRaises(ClientError, app._submit_job, S3_BUCKET_NAME, 'missing.mp4')
+                self.assertRaises(ClientError, app._submit_job, S3_BUCKET_NAME, 'missing.mp4')
+                self.assertEqual(head_object.call_count, 2)
+
+                # but not for the API, the object may have been uploaded since
+                self.s3.Bucket(S3_BUCKET_NAME).put_object(Key='missing.mp4', Body=b'fixity')
+                app.api_handler({'httpMethod': 'POST', 'queryStringParameters': {'bucket': S3_BUCKET_NAME, 'key': 'missing.mp4'}}, None)
+                self.assertEqual(head_object.call_count, 3)
+                self.assertTrue(app._submit_job(S3_BUCKET_NAME, 'missing.mp4'))
+                self.assertEqual(head_object.call_count, 3)
+
+                with mock.patch.dict(os.environ, {'PREFLIGHT_CACHE_TTL_IN_SECONDS': '0'}):
+                    app.preflight_cache = None
+                    app._submit_job(S3_BUCKET_NAME, S3_TEST_FILE_KEY)
+                    app._submit_job(S3_BUCKET_NAME, S3_TEST_FILE_KEY)
+                    self.assertEqual(head_object.call_count, 5)
+                app.preflight_cache = None
+
+    def test_submit_job_region_success(self):
+        routes = '{"eu-west-1": {"jobQueue": "euqueue", "jobSizeSmall": "eusmall", "jobSizeLarge": "eularge"}}'
+        with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No', "JOB_QUEUE": self.job_q_arn, "JOB_SIZE_SMALL": self.job_definition_arn, "JOB_SIZE_LARGE": self.job_definition_arn, 'JOB_SIZE_THRESHOLD': '10737418240', 'JOB_QUEUES': routes, 'LogLevel': 'INFO', 'SOLUTION_IDENTIFIER': awsSolutionId}):
+            from fixity_driver import app
+            self.s3.create_bucket(Bucket='eubucketname', CreateBucketConfiguration={'LocationConstraint': 'eu-west-1'})
+            self.s3.Bucket('eubucketname').put_object(Key=S3_TEST_FILE_KEY, Body=b'fixity')
+            self.assertEqual(app._get_bucket_region(S3_BUCKET_NAME), 'us-east-1')
+
+            with mock.patch.object(app, '_get_batch_client') as get_batch_client:
+                get_batch_client.return_value.submit_job.return_value = {'jobId': 'eujob'}
+                self.assertEqual(app._submit_job('eubucketname', S3_TEST_FILE_KEY), 'eujob')
+                get_batch_client.assert_called_with('eu-west-1')
+                kwargs = get_batch_client.return_value.submit_job.call_args.kwargs
+                self.assertEqual((kwargs['jobQueue'], kwargs['jobDefinition'], kwargs['parameters']['Region']), ('euqueue', 'eusmall', 'eu-west-1'))
+
+    def test_get_s3_client_success(self):
+        with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No', "JOB_QUEUE": self.job_q_arn, "JOB_SIZE_SMALL": self.job_definition_arn, "JOB_SIZE_LARGE": self.job_definition_arn, 'JOB_SIZE_THRESHOLD': '10737418240', 'LogLevel': 'INFO', 'SOLUTION_IDENTIFIER': awsSolutionId}):
+            from fixity_driver import app
+            app.preflight_cache = None
+            self.s3.create_bucket(Bucket='eubucketname', CreateBucketConfiguration={'LocationConstraint': 'eu-west-1'})
+            self.s3.Bucket('eubucketname').put_object(Key=S3_TEST_FILE_KEY, Body=b'fixity')
+
+            with mock.patch.object(app, 's3_clients', {}):
+                self.assertIs(app._get_s3_client(S3_BUCKET_NAME), app.s3client)
+                # objects in other regions are read by a client of their region, created once
+                with mock.patch.object(app.s3client, 'head_object') as head_object:
+                    self.assertEqual(app._head_object_cached('eubucketname', S3_TEST_FILE_KEY)['ContentLength'], 6)
+                    head_object.assert_not_called()
+                self.assertEqual(app._get_s3_client('eubucketname').meta.region_name, 'eu-west-1')
+                self.assertEqual(list(app.s3_clients), ['eu-west-1'])
+
     def test_s3_batch_handler_success(self):
         with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No', "JOB_QUEUE": self.job_q_arn, "JOB_SIZE_SMALL": self.job_definition_arn, "JOB_SIZE_LARGE": self.job_definition_arn, 'JOB_SIZE_THRESHOLD': '10737418240', 'LogLevel': 'INFO', 'SOLUTION_IDENTIFIER': awsSolutionId, 'AWS_REGION': 'us-east-1'}):
             from fixity_driver.app import s3_batch_handler
             event = {'invocationId': invocationId, 'job': {'id': '9357a3a7-5e34-4fa9-a1df-e1a4299b90b7'}, 'tasks': [{'taskId': 'taskId', 's3BucketArn': 'arn:aws:s3:::buckettestname', 's3Key': S3_TEST_FILE_KEY, 's3VersionId': None}], 'invocationSchemaVersion': '1.0'}
             file_content = s3_batch_handler(event, '_')
             self.assertEqual(file_content.get('results')[0].get('resultCode'), 'Succeeded')
+            result_string = json.loads(file_content['results'][0]['resultString'])
+            self.assertEqual((result_string['Message'], result_string['Path'], result_string['Bytes']), ('Hash job submitted.', 'small', self.s3.Object(S3_BUCKET_NAME, S3_TEST_FILE_KEY).content_length))
 
     def test_s3_batch_handler_error(self):
         with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No', "JOB_QUEUE": self.job_q_arn, "JOB_SIZE_SMALL": self.job_definition_arn, "JOB_SIZE_LARGE": self.job_definition_arn, 'JOB_SIZE_THRESHOLD': '10737418240', 'LogLevel': 'INFO', 'SOLUTION_IDENTIFIER': awsSolutionId, 'AWS_REGION': 'us-east-1'}):
             from fixity_driver.app import s3_batch_handler
             event = {'invocationId': invocationId, 'job': {'id': '9357a3a7-5e34-4fa9-a1df-e1a4299b90b7'}, 'tasks': [{'taskId': 'taskId', 's3BucketArn': 'arn:aws:s3:::buckettestname', 's3Key': 'BigBunnySamp.mp4', 's3VersionId': None}], 'invocationSchemaVersion': '1.0'}
             file_content = s3_batch_handler(event, '_')
-            self.assertEqual(file_content, {'invocationSchemaVersion': '1.0', 'treatMissingKeysAs': 'PermanentFailure', 'invocationId': invocationId, 'results': [{'taskId': 'taskId', 'resultCode': 'PermanentFailure', 'resultString': '404: Not Found'}]})
+            result_string = json.loads(file_content['results'][0].pop('resultString'))
+            self.assertEqual(file_content, {'invocationSchemaVersion': '1.0', 'treatMissingKeysAs': 'PermanentFailure', 'invocationId': invocationId, 'results': [{'taskId': 'taskId', 'resultCode': 'PermanentFailure'}]})
+            self.assertEqual({name: result_string[name] for name in ['Message', 'Code']}, {'Message': 'Not Found', 'Code': '404'})
 
     def test_s3_api_handler_success(self):
         with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No', "JOB_QUEUE": self.job_q_arn, "JOB_SIZE_SMALL": self.job_definition_arn, "JOB_SIZE_LARGE": self.job_definition_arn, 'JOB_SIZE_THRESHOLD': '10737418240', 'LogLevel': 'INFO', 'SOLUTION_IDENTIFIER': awsSolutionId, 'AWS_REGION': 'us-east-1'}):
@@ -135,3 +197,120 @@ class TestFixityLambdaFunction(unittest.TestCase):
             self.assertEqual(file_content, {'statusCode': 500, 'body': '{"Error": {"Code": "404", "Message": "Not Found"}}'})
             
 
+    def tag_checksums(self, md5):
+        content = json.dumps(S3_TEST_FILE_CONTENT).encode()
+        tags = [{'Key': 'Content-MD5', 'Value': md5}, {'Key': 'Content-SHA1', 'Value': hashlib.sha1(content).hexdigest()}]
+        boto3.client('s3', region_name=DEFAULT_REGION).put_object_tagging(Bucket=S3_BUCKET_NAME, Key=S3_TEST_FILE_KEY, Tagging={'TagSet': tags})
+
+    def test_s3_api_handler_bulk_success(self):
+        with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No', "JOB_QUEUE": self.job_q_arn, "JOB_SIZE_SMALL": self.job_definition_arn, "JOB_SIZE_LARGE": self.job_definition_arn, 'JOB_SIZE_THRESHOLD': '10737418240', 'LogLevel': 'INFO', 'SOLUTION_IDENTIFIER': awsSolutionId, 'AWS_REGION': 'us-east-1'}):
+            from fixity_driver import app
+            app.checksum_cache.clear()
+            self.tag_checksums(hashlib.md5(json.dumps(S3_TEST_FILE_CONTENT).encode()).hexdigest())
+            self.s3_bucket.put_object(Key='unhashed.mp4', Body=b'unhashed')
+            objects = [{'Bucket': S3_BUCKET_NAME, 'Key': S3_TEST_FILE_KEY}, {'Bucket': S3_BUCKET_NAME, 'Key': 'unhashed.mp4'}, {'Bucket': S3_BUCKET_NAME, 'Key': 'BigBunnySamp.mp4'}]
+            response = app.api_handler({'httpMethod': 'POST', 'queryStringParameters': None, 'body': json.dumps({'Objects': objects})}, '_')
+            self.assertEqual(response['statusCode'], 200)
+            results = json.loads(response['body'])['Results']
+            self.assertEqual([r['Status'] for r in results], ['Hashed', 'Submitted', 'Error'])
+            self.assertEqual(results[0]['Checksums']['Content-MD5'], hashlib.md5(json.dumps(S3_TEST_FILE_CONTENT).encode()).hexdigest())
+            self.assertIn('JobId', results[1])
+            self.assertEqual(results[2]['Error']['Code'], '404')
+
+            # Force hashes objects with checksums again
+            response = app.api_handler({'httpMethod': 'POST', 'queryStringParameters': None, 'body': json.dumps({'Objects': objects[:1], 'Force': True})}, '_')
+            self.assertEqual(json.loads(response['body'])['Results'][0]['Status'], 'Submitted')
+            # a pooled connection for every thread of a bulk request
+            self.assertEqual(app._get_s3_client(S3_BUCKET_NAME).meta.config.max_pool_connections, app.BULK_CONCURRENCY)
+
+    def test_s3_api_handler_bulk_error(self):
+        with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No', "JOB_QUEUE": self.job_q_arn, "JOB_SIZE_SMALL": self.job_definition_arn, "JOB_SIZE_LARGE": self.job_definition_arn, 'JOB_SIZE_THRESHOLD': '10737418240', 'BULK_MAX_OBJECTS': '1', 'LogLevel': 'INFO', 'SOLUTION_IDENTIFIER': awsSolutionId, 'AWS_REGION': 'us-east-1'}):
+            from fixity_driver.app import api_handler
+            objects = [{'Bucket': S3_BUCKET_NAME, 'Key': S3_TEST_FILE_KEY}] * 2
+            self.assertEqual(api_handler({'httpMethod': 'POST', 'queryStringParameters': None, 'body': json.dumps({'Objects': objects})}, '_')['statusCode'], 400)
+            self.assertEqual(api_handler({'httpMethod': 'POST', 'queryStringParameters': None, 'body': json.dumps({'Objects': [{'Key': S3_TEST_FILE_KEY}]})}, '_')['statusCode'], 400)
+            self.assertEqual(api_handler({'httpMethod': 'POST', 'queryStringParameters': None, 'body': '{"Objects": '}, '_')['statusCode'], 400)
+
+    def test_s3_api_handler_status_success(self):
+        with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No', "JOB_QUEUE": self.job_q_arn, "JOB_SIZE_SMALL": self.job_definition_arn, "JOB_SIZE_LARGE": self.job_definition_arn, 'JOB_SIZE_THRESHOLD': '10737418240', 'LogLevel': 'INFO', 'SOLUTION_IDENTIFIER': awsSolutionId, 'AWS_REGION': 'us-east-1'}):
+            from fixity_driver import app
+            app.checksum_cache.clear()
+            event = {'httpMethod': 'GET', 'queryStringParameters': {'bucket': S3_BUCKET_NAME, 'key': S3_TEST_FILE_KEY}}
+            self.assertEqual(json.loads(app.api_handler(event, '_')['body'])['Status'], 'NotHashed')
+
+            # checksums of a previous version of the object are not current
+            self.tag_checksums('0' * 32)
+            self.assertEqual(json.loads(app.api_handler(event, '_')['body'])['Status'], 'NotHashed')
+
+            self.tag_checksums(hashlib.md5(json.dumps(S3_TEST_FILE_CONTENT).encode()).hexdigest())
+            response = app.api_handler(event, '_')
+            self.assertEqual(response['statusCode'], 200)
+            self.assertEqual(json.loads(response['body'])['Status'], 'Hashed')
+
+            job_id = app._submit_job(S3_BUCKET_NAME, S3_TEST_FILE_KEY)
+            body = json.loads(app.api_handler({'httpMethod': 'GET', 'queryStringParameters': {'jobId': job_id}}, '_')['body'])
+            self.assertEqual(body['Job']['JobId'], job_id)
+            self.assertNotIn('Status', body)
+
+    def test_s3_api_handler_status_error(self):
+        with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No', "JOB_QUEUE": self.job_q_arn, "JOB_SIZE_SMALL": self.job_definition_arn, "JOB_SIZE_LARGE": self.job_definition_arn, 'JOB_SIZE_THRESHOLD': '10737418240', 'LogLevel': 'INFO', 'SOLUTION_IDENTIFIER': awsSolutionId, 'AWS_REGION': 'us-east-1'}):
+            from fixity_driver.app import api_handler
+            self.assertEqual(api_handler({'httpMethod': 'GET', 'queryStringParameters': {'bucket': S3_BUCKET_NAME}}, '_')['statusCode'], 400)
+            response = api_handler({'httpMethod': 'GET', 'queryStringParameters': {'bucket': S3_BUCKET_NAME, 'key': 'BigBunnySamp.mp4'}}, '_')
+            self.assertEqual(response, {'statusCode': 500, 'body': '{"Error": {"Code": "404", "Message": "Not Found"}}'})
+
+    def event_bridge_record(self, message_id, key, etag):
+        detail = {'version': '0', 'bucket': {'name': S3_BUCKET_NAME}, 'object': {'key': key, 'size': 55, 'etag': etag}, 'reason': 'PutObject'}
+        return {'messageId': message_id, 'body': json.dumps({'source': 'aws.s3', 'detail-type': 'Object Created', 'detail': detail})}
+
+    def test_event_handler_success(self):
+        with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No', "JOB_QUEUE": self.job_q_arn, "JOB_SIZE_SMALL": self.job_definition_arn, "JOB_SIZE_LARGE": self.job_definition_arn, 'JOB_SIZE_THRESHOLD': '10737418240', 'LogLevel': 'INFO', 'SOLUTION_IDENTIFIER': awsSolutionId}):
+            from fixity_driver.app import event_handler
+            etag = self.s3.Object(S3_BUCKET_NAME, S3_TEST_FILE_KEY).e_tag.strip('"')
+            event = {'Records': [self.event_bridge_record('1', S3_TEST_FILE_KEY, etag), self.event_bridge_record('2', 'BigBunnySamp.mp4', etag)]}
+            # the object that no longer exists is not retried
+            self.assertEqual(event_handler(event, '_'), {'batchItemFailures': []})
+            tags = {t['Key']: t['Value'] for t in boto3.client('s3', region_name=DEFAULT_REGION).get_object_tagging(Bucket=S3_BUCKET_NAME, Key=S3_TEST_FILE_KEY)['TagSet']}
+            self.assertEqual(tags['Content-MD5'], hashlib.md5(json.dumps(S3_TEST_FILE_CONTENT).encode()).hexdigest())
+            self.assertEqual(tags['Content-SHA1'], hashlib.sha1(json.dumps(S3_TEST_FILE_CONTENT).encode()).hexdigest())
+
+    def test_event_handler_debounce(self):
+        with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No', "JOB_QUEUE": self.job_q_arn, "JOB_SIZE_SMALL": self.job_definition_arn, "JOB_SIZE_LARGE": self.job_definition_arn, 'JOB_SIZE_THRESHOLD': '10737418240', 'LogLevel': 'INFO', 'SOLUTION_IDENTIFIER': awsSolutionId}):
+            from fixity_driver.app import _hash_created_object
+            self.assertEqual(_hash_created_object(S3_BUCKET_NAME, S3_TEST_FILE_KEY, 'overwritten'), 'Skipped, overwritten since the event')
+
+    def test_event_handler_index_record(self):
+        with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No', "JOB_QUEUE": self.job_q_arn, "JOB_SIZE_SMALL": self.job_definition_arn, "JOB_SIZE_LARGE": self.job_definition_arn, 'JOB_SIZE_THRESHOLD': '10737418240', 'INDEX_BUCKET': 'indexbucketname', 'LogLevel': 'INFO', 'SOLUTION_IDENTIFIER': awsSolutionId}):
+            from fixity_driver.app import _hash_created_object
+            self.s3.create_bucket(Bucket='indexbucketname')
+            self.assertTrue(_hash_created_object(S3_BUCKET_NAME, S3_TEST_FILE_KEY, None).startswith('Hashed '))
+            records = list(self.s3.Bucket('indexbucketname').objects.filter(Prefix='records/'))
+            self.assertEqual(len(records), 1)
+            record = json.loads(records[0].get()['Body'].read())
+            self.assertEqual(record['Key'], S3_TEST_FILE_KEY)
+            self.assertEqual(record['Checksums']['Content-MD5'], hashlib.md5(json.dumps(S3_TEST_FILE_CONTENT).encode()).hexdigest())
+
+    def test_event_handler_index_batch(self):
+        with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No', "JOB_QUEUE": self.job_q_arn, "JOB_SIZE_SMALL": self.job_definition_arn, "JOB_SIZE_LARGE": self.job_definition_arn, 'JOB_SIZE_THRESHOLD': '10737418240', 'INDEX_BUCKET': 'indexbucketname', 'LogLevel': 'INFO', 'SOLUTION_IDENTIFIER': awsSolutionId}):
+            from fixity_driver.app import event_handler
+            self.s3.create_bucket(Bucket='indexbucketname')
+            self.s3.Object(S3_BUCKET_NAME, 'copy.mp4').put(Body=json.dumps(S3_TEST_FILE_CONTENT))
+            event = {'Records': [self.event_bridge_record('1', S3_TEST_FILE_KEY, None), self.event_bridge_record('2', 'copy.mp4', None)]}
+            self.assertEqual(event_handler(event, '_'), {'batchItemFailures': []})
+            # one records object for the batch
+            records = list(self.s3.Bucket('indexbucketname').objects.filter(Prefix='records/'))
+            self.assertEqual(len(records), 1)
+            lines = records[0].get()['Body'].read().decode('utf-8').splitlines()
+            self.assertEqual(sorted(json.loads(line)['Key'] for line in lines), sorted([S3_TEST_FILE_KEY, 'copy.mp4']))
+
+    def test_event_handler_submit_job(self):
+        with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No', "JOB_QUEUE": self.job_q_arn, "JOB_SIZE_SMALL": self.job_definition_arn, "JOB_SIZE_LARGE": self.job_definition_arn, 'JOB_SIZE_THRESHOLD': '10737418240', 'INLINE_HASH_THRESHOLD_IN_BYTES': '0', 'LogLevel': 'INFO', 'SOLUTION_IDENTIFIER': awsSolutionId}):
+            from fixity_driver.app import _hash_created_object
+            self.assertTrue(_hash_created_object(S3_BUCKET_NAME, S3_TEST_FILE_KEY, None).startswith('Submitted '))
+
+    def test_get_created_objects_success(self):
+        with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No', 'LogLevel': 'INFO', 'SOLUTION_IDENTIFIER': awsSolutionId}):
+            from fixity_driver.app import _get_created_objects
+            notification = {'Records': [{'eventName': 'ObjectCreated:Copy', 's3': {'bucket': {'name': S3_BUCKET_NAME}, 'object': {'key': 'media/Big+Bunny.mp4', 'eTag': 'abc'}}}, {'eventName': 'ObjectRemoved:Delete', 's3': {'bucket': {'name': S3_BUCKET_NAME}, 'object': {'key': 'deleted.mp4'}}}]}
+            self.assertEqual(list(_get_created_objects(json.dumps(notification))), [(S3_BUCKET_NAME, 'media/Big Bunny.mp4', 'abc')])
+            self.assertEqual(list(_get_created_objects(json.dumps({'Type': 'Notification', 'TopicArn': 'arn', 'Message': json.dumps(notification)}))), [(S3_BUCKET_NAME, 'media/Big Bunny.mp4', 'abc')])
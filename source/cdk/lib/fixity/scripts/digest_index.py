@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+# usage: ./digest_index.py <index bucket> compact
+#        ./digest_index.py <index bucket> lookup <checksum>
+#        ./digest_index.py <index bucket> duplicates [md5|sha1|xxhash]
+#        ./digest_index.py <index bucket> changed <since, e.g. 2024-01-31>
+#
+# Fixity jobs write a small record per hashed object to records/ in the index
+# bucket, the fixity events function writes the records of a batch of events
+# as one object of JSON lines. compact merges the records into an append-only
+# SQLite shard in shards/ and removes them. It costs a LIST per 1000 and a GET
+# per records object, about the price of the PUTs that wrote them. The other commands download the shards that are
+# new since the last run into a local database (--database) and query it, so
+# reports over millions of objects do not need an API call per object.
+
+import os
+import sys
+import json
+import uuid
+import sqlite3
+import argparse
+import tempfile
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+
+# tag, column
+CHECKSUM_COLUMNS = [
+    ('Content-MD5', 'md5'),
+    ('Content-SHA1', 'sha1'),
+    ('Content-XXHash', 'xxhash'),
+    ('Content-SHA256-Composite', 'sha256_composite'),
+    ('Content-CRC32C-Composite', 'crc32c_composite')
+]
+
+COLUMNS = ['bucket', 'key', 'etag', 'size', 'hashed_at'] + [column for _, column in CHECKSUM_COLUMNS]
+
+# records objects per shard
+MAX_RECORDS = 1000000
+
+
+def create_tables(db):
+
+    columns = ', '.join(column + (' INTEGER' if column == 'size' else ' TEXT') for column in COLUMNS)
+    # every record
+    db.execute('CREATE TABLE IF NOT EXISTS history (' + columns + ')')
+    db.execute('CREATE INDEX IF NOT EXISTS history_object ON history (bucket, key, hashed_at)')
+    # the latest record of every object
+    db.execute('CREATE TABLE IF NOT EXISTS current (' + columns + ', PRIMARY KEY (bucket, key))')
+    for _, column in CHECKSUM_COLUMNS:
+        db.execute('CREATE INDEX IF NOT EXISTS current_' + column + ' ON current (' + column + ')')
+    db.execute('CREATE TABLE IF NOT EXISTS shards (name TEXT PRIMARY KEY)')
+
+
+def to_row(record):
+
+    checksums = record.get('Checksums', {})
+    return [record['Bucket'], record['Key'], record['ETag'], record['Size'], record['HashedAt']] + [checksums.get(tag) for tag, _ in CHECKSUM_COLUMNS]
+
+
+def list_keys(client, bucket, prefix):
+
+    for page in client.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+        for item in page.get('Contents', []):
+            yield item['Key']
+
+
+def read_records(client, index_bucket, key):
+
+    body = client.get_object(Bucket=index_bucket, Key=key)['Body'].read().decode('utf-8')
+    return [json.loads(line) for line in body.splitlines() if line.strip()]
+
+
+def compact(client, index_bucket):
+
+    keys = []
+    for key in list_keys(client, index_bucket, 'records/'):
+        keys.append(key)
+        if len(keys) == MAX_RECORDS:
+            break
+
+    if not keys:
+        return 0
+
+    with ThreadPoolExecutor(max_workers=64) as executor:
+        records = [record for batch in executor.map(lambda key: read_records(client, index_bucket, key), keys) for record in batch]
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'shard.sqlite')
+        shard = sqlite3.connect(path)
+        shard.execute('CREATE TABLE records (' + ', '.join(COLUMNS) + ')')
+        shard.executemany('INSERT INTO records VALUES (' + ', '.join('?' * len(COLUMNS)) + ')', [to_row(record) for record in records])
+        shard.commit()
+        shard.close()
+
+        name = 'shards/' + datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S') + '-' + str(uuid.uuid4()) + '.sqlite'
+        client.upload_file(path, index_bucket, name)
+
+    # the records are in the shard now
+    for i in range(0, len(keys), 1000):
+        client.delete_objects(Bucket=index_bucket, Delete={'Objects': [{'Key': key} for key in keys[i:i + 1000]], 'Quiet': True})
+
+    return len(records)
+
+
+def sync(client, index_bucket, db):
+
+    create_tables(db)
+    known = set(row[0] for row in db.execute('SELECT name FROM shards'))
+    columns = ', '.join(COLUMNS)
+    added = 0
+
+    for name in sorted(list_keys(client, index_bucket, 'shards/')):
+        if name in known:
+            continue
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'shard.sqlite')
+            client.download_file(index_bucket, name, path)
+
+            db.execute('ATTACH DATABASE ? AS shard', (path,))
+            db.execute('INSERT INTO history SELECT ' + columns + ' FROM shard.records')
+            # WHERE true disambiguates the upsert from a join
+            db.execute('INSERT INTO current SELECT ' + columns + ' FROM shard.records WHERE true ORDER BY hashed_at '
+                       'ON CONFLICT (bucket, key) DO UPDATE SET ' + ', '.join(column + ' = excluded.' + column for column in COLUMNS[2:]) + ' '
+                       'WHERE excluded.hashed_at >= current.hashed_at')
+            db.execute('INSERT INTO shards VALUES (?)', (name,))
+            db.commit()
+            db.execute('DETACH DATABASE shard')
+
+        added += 1
+
+    return added
+
+
+def lookup(db, checksum):
+
+    condition = ' OR '.join(column + ' = ?' for _, column in CHECKSUM_COLUMNS)
+    return db.execute('SELECT bucket, key, etag, size FROM current WHERE ' + condition + ' ORDER BY bucket, key', [checksum] * len(CHECKSUM_COLUMNS)).fetchall()
+
+
+def duplicates(db, column='sha1'):
+
+    if column not in ['md5', 'sha1', 'xxhash']:
+        raise ValueError('unsupported checksum ' + column)
+
+    # clusters of objects with the same content, the most wasted bytes first
+    clusters = db.execute(
+        'SELECT ' + column + ', COUNT(*), SUM(size) - MAX(size) FROM current WHERE ' + column + ' IS NOT NULL '
+        'GROUP BY ' + column + ' HAVING COUNT(*) > 1 ORDER BY 3 DESC'
+    ).fetchall()
+
+    return [
+        {
+            'Checksum': checksum,
+            'Count': count,
+            'RedundantBytes': redundant,
+            'Objects': db.execute('SELECT bucket, key FROM current WHERE ' + column + ' = ? ORDER BY bucket, key', (checksum,)).fetchall()
+        }
+        for checksum, count, redundant in clusters
+    ]
+
+
+def changed(db, since):
+
+    # objects hashed since the date whose checksums differ from the record before
+    rows = db.execute(
+        "SELECT h.bucket, h.key, h.etag, COALESCE(h.md5, '') || '/' || COALESCE(h.sha1, ''), "
+        "(SELECT COALESCE(p.md5, '') || '/' || COALESCE(p.sha1, '') FROM history p WHERE p.bucket = h.bucket AND p.key = h.key AND p.hashed_at < h.hashed_at ORDER BY p.hashed_at DESC LIMIT 1) "
+        "FROM history h WHERE h.hashed_at >= ? ORDER BY h.bucket, h.key, h.hashed_at",
+        (since,)
+    ).fetchall()
+
+    result = []
+    for bucket, key, etag, checksums, previous in rows:
+        if previous is None:
+            result.append({'Bucket': bucket, 'Key': key, 'ETag': etag, 'Change': 'new'})
+        elif previous != checksums:
+            result.append({'Bucket': bucket, 'Key': key, 'ETag': etag, 'Change': 'changed'})
+
+    return result
+
+
+def main(argv):
+
+    parser = argparse.ArgumentParser(prog='digest_index.py')
+    parser.add_argument('index_bucket')
+    parser.add_argument('--database', default='fixity-index.sqlite')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('compact')
+    commands.add_parser('lookup').add_argument('checksum')
+    commands.add_parser('duplicates').add_argument('algorithm', nargs='?', default='sha1')
+    commands.add_parser('changed').add_argument('since')
+    args = parser.parse_args(argv[1:])
+
+    client = boto3.client('s3')
+
+    if args.command == 'compact':
+        print('compacted {} records'.format(compact(client, args.index_bucket)))
+        return 0
+
+    db = sqlite3.connect(args.database)
+    sync(client, args.index_bucket, db)
+
+    if args.command == 'lookup':
+        result = [{'Bucket': bucket, 'Key': key, 'ETag': etag, 'Size': size} for bucket, key, etag, size in lookup(db, args.checksum)]
+    elif args.command == 'duplicates':
+        result = duplicates(db, args.algorithm)
+    else:
+        result = changed(db, args.since)
+
+    print(json.dumps(result, indent=2))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1 @@
+../../common/manifests.py
\ No newline at end of file
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+# usage: ./plan_hash_job.py <manifest csv or s3 uri of inventory manifest.json> [--max-vcpus 1024]
+#            [--concurrency 256] [--job-size-threshold 10737418240] [--throughput '{"hash-small": 150}']
+#            [--cost-per-second '{"hash-small": 0.0000047}']
+#
+# Estimates a fixity run before run_hash_job.sh is started. The manifest
+# (bucket,key[,size], as for run_hash_job.sh, HEAD for rows without a size) or
+# the inventory is read as a stream and every object is routed as the driver
+# does: objects below JOB_SIZE_THRESHOLD are hashed by HashJobDefinitionSmall
+# (1 vCPU), larger ones by HashJobDefinitionLarge (16 vCPUs).
+#
+# Jobs take --batch-overhead-seconds to be queued and started and then size /
+# throughput of their job definition (--throughput). The driver invocations
+# run --concurrency at a time and the jobs run first in, first out on
+# --max-vcpus. The report has the makespan, the split between the job
+# definitions, the number of requests and the cost.
+
+import sys
+import json
+import argparse
+import boto3
+from job_schedule import Schedule
+from manifests import read_manifest, read_inventory, with_sizes
+
+MB = 1024 * 1024
+
+# MB/s of a job of each job definition
+THROUGHPUT = {'hash-small': 150, 'hash-large': 500}
+
+# vCPUs of the job definitions
+VCPUS = {'hash-small': 1, 'hash-large': 16}
+
+# $ per second of a job on EC2 Spot, and of a driver invocation (128MB)
+COST_PER_SECOND = {'lambda': 0.0000021, 'hash-small': 0.0000047, 'hash-large': 0.000075}
+
+# $ per request
+PRICES = {
+    'S3PutRequest': 0.000005,
+    'S3GetRequest': 0.0000004,
+    'LambdaRequest': 0.0000002,
+    'S3BatchJob': 0.25,
+    'S3BatchTask': 0.000001
+}
+
+# requests to S3 that are charged as PUT
+PUT_REQUESTS = ['PutObjectTagging', 'PutObject']
+
+
+def plan(objects, max_vcpus=1024, concurrency=256, job_size_threshold=10737418240, chunk_size=64 * MB, checkpoint_interval=60,
+         throughput=None, cost_per_second=None, prices=None, batch_overhead=60, invocation_seconds=0.2):
+
+    throughput = {**THROUGHPUT, **(throughput or {})}
+    cost_per_second = {**COST_PER_SECOND, **(cost_per_second or {})}
+    prices = {**PRICES, **(prices or {})}
+
+    schedule = Schedule(concurrency, max_vcpus)
+    jobs = {job_definition: {'Objects': 0, 'Bytes': 0, 'Seconds': 0.0} for job_definition in THROUGHPUT}
+    requests = {}
+
+    def count(request, n=1):
+        requests[request] = requests.get(request, 0) + n
+
+    for _, _, size in objects:
+        count('S3BatchTask')
+        count('LambdaInvocation')
+        count('SubmitJob')
+
+        # the routing of _submit_job
+        job_definition = 'hash-small' if size < job_size_threshold else 'hash-large'
+
+        seconds = size / (throughput[job_definition] * MB)
+        jobs[job_definition]['Objects'] += 1
+        jobs[job_definition]['Bytes'] += size
+        jobs[job_definition]['Seconds'] += seconds
+
+        # the driver and the job HEAD the object, the job reads it in chunks, tags it and writes an index record
+        count('HeadObject', 2)
+        count('GetObject', max(1, -(-size // chunk_size)))
+        count('PutObjectTagging')
+        count('PutObject')
+        if job_definition == 'hash-large':
+            # checkpoints
+            count('PutObject', int(seconds // checkpoint_interval))
+
+        schedule.run_job(schedule.invoke(invocation_seconds), VCPUS[job_definition], batch_overhead + seconds)
+
+    objects_count = requests.get('S3BatchTask', 0)
+
+    cost = {
+        'Lambda': round((cost_per_second['lambda'] * invocation_seconds + prices['LambdaRequest']) * requests.get('LambdaInvocation', 0), 2),
+        'Batch': round(sum(cost_per_second[job_definition] * (v['Seconds'] + batch_overhead * v['Objects']) for job_definition, v in jobs.items()), 2),
+        'S3Requests': round(prices['S3PutRequest'] * sum(requests.get(r, 0) for r in PUT_REQUESTS)
+                            + prices['S3GetRequest'] * (requests.get('HeadObject', 0) + requests.get('GetObject', 0)), 2),
+        'S3Batch': round(prices['S3BatchJob'] + prices['S3BatchTask'] * objects_count, 2) if objects_count else 0
+    }
+    cost['Total'] = round(sum(cost.values()), 2)
+
+    return {
+        'Objects': objects_count,
+        'Bytes': sum(v['Bytes'] for v in jobs.values()),
+        'Makespan': round(schedule.makespan, 1),
+        'MakespanHours': round(schedule.makespan / 3600, 2),
+        'Jobs': {job_definition: {'Objects': v['Objects'], 'Bytes': v['Bytes'], 'Seconds': round(v['Seconds'], 1)} for job_definition, v in jobs.items() if v['Objects']},
+        'Requests': requests,
+        'Cost': cost
+    }
+
+
+def main(argv):
+
+    parser = argparse.ArgumentParser(prog='plan_hash_job.py')
+    parser.add_argument('manifest', help='csv manifest (file or s3 uri) or s3 uri of an inventory manifest.json')
+    parser.add_argument('--max-vcpus', type=int, default=1024, help='maxvCpus of the compute environment')
+    parser.add_argument('--concurrency', type=int, default=256, help='reservedConcurrentExecutions of the driver')
+    parser.add_argument('--job-size-threshold', type=int, default=10737418240, help='JOB_SIZE_THRESHOLD')
+    parser.add_argument('--chunk-size', type=int, default=64 * MB, help='CHUNK_SIZE_IN_BYTES of the hasher')
+    parser.add_argument('--batch-overhead-seconds', type=float, default=60)
+    parser.add_argument('--throughput', default='{}', help='json object of MB/s by job definition (hash-small, hash-large)')
+    parser.add_argument('--cost-per-second', default='{}', help='json object of $ per second by job definition')
+    parser.add_argument('--prices', default='{}', help='json object of prices, see PRICES')
+    args = parser.parse_args(argv[1:])
+
+    client = boto3.client('s3')
+    objects = read_inventory(client, args.manifest) if args.manifest.endswith('manifest.json') else with_sizes(client, read_manifest(client, args.manifest))
+
+    report = plan(objects, args.max_vcpus, args.concurrency, args.job_size_threshold, args.chunk_size,
+                  throughput=json.loads(args.throughput), cost_per_second=json.loads(args.cost_per_second),
+                  prices=json.loads(args.prices), batch_overhead=args.batch_overhead_seconds)
+
+    print(json.dumps(report, indent=2))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,105 @@
+#######################################################################################################################
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.                                                 #
+#                                                                                                                     #
+#  Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance     #
+#  with the License. A copy of the License is located at                                                              #
+#                                                                                                                     #
+#      http://www.apache.org/licenses/LICENSE-2.0                                                                     #
+#                                                                                                                     #
+#  or in the 'license' file accompanying this file. This file is distributed on an 'AS IS' BASIS, WITHOUT WARRANTIES  #
+#  OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions     #
+#  and limitations under the License.                                                                                 #
+#######################################################################################################################
+import json
+import os
+import sqlite3
+import unittest
+import boto3
+import mock
+from moto import mock_s3
+
+INDEX_BUCKET_NAME = 'indexbucketname'
+DEFAULT_REGION = 'us-east-1'
+
+
+def record(key, md5, sha1, size, hashed_at):
+    return {'Bucket': 'media', 'Key': key, 'ETag': md5, 'Size': size, 'Checksums': {'Content-MD5': md5, 'Content-SHA1': sha1}, 'HashedAt': hashed_at}
+
+
+@mock_s3
+class TestDigestIndex(unittest.TestCase):
+    def setUp(self):
+        # moto does not decode aws-chunked uploads
+        environ = mock.patch.dict(os.environ, {'AWS_DEFAULT_REGION': DEFAULT_REGION, 'AWS_REQUEST_CHECKSUM_CALCULATION': 'when_required'})
+        environ.start()
+        self.addCleanup(environ.stop)
+        boto3.setup_default_session()
+        self.s3 = boto3.client('s3', region_name=DEFAULT_REGION)
+        self.s3.create_bucket(Bucket=INDEX_BUCKET_NAME)
+        self.db = sqlite3.connect(':memory:')
+
+    def put_records(self, *records):
+        for i, r in enumerate(records):
+            self.s3.put_object(Bucket=INDEX_BUCKET_NAME, Key='records/' + r['HashedAt'][:10] + '/' + str(i) + '.json', Body=json.dumps(r))
+
+    def test_compact_sync_success(self):
+        from digest_index import compact, sync, lookup
+        self.put_records(record('a.mp4', 'aaa', '111', 10, '2024-01-01T00:00:00+00:00'))
+        self.assertEqual(compact(self.s3, INDEX_BUCKET_NAME), 1)
+        self.put_records(record('a.mp4', 'bbb', '222', 10, '2024-02-01T00:00:00+00:00'))
+        self.assertEqual(compact(self.s3, INDEX_BUCKET_NAME), 1)
+        self.assertNotIn('Contents', self.s3.list_objects_v2(Bucket=INDEX_BUCKET_NAME, Prefix='records/'))
+        self.assertEqual(compact(self.s3, INDEX_BUCKET_NAME), 0)
+
+        self.assertEqual(sync(self.s3, INDEX_BUCKET_NAME, self.db), 2)
+        # shards are only read once
+        self.assertEqual(sync(self.s3, INDEX_BUCKET_NAME, self.db), 0)
+        self.assertEqual(lookup(self.db, 'bbb'), [('media', 'a.mp4', 'bbb', 10)])
+        self.assertEqual(lookup(self.db, 'aaa'), [])
+        self.assertEqual(self.db.execute('SELECT COUNT(*) FROM history').fetchone()[0], 2)
+
+    def test_compact_batch_success(self):
+        from digest_index import compact, sync, lookup
+        # a batch of the fixity events function
+        batch = [record('a.mp4', 'aaa', '111', 10, '2024-01-01T00:00:00+00:00'), record('b.mp4', 'bbb', '222', 20, '2024-01-01T00:00:00+00:00')]
+        self.s3.put_object(Bucket=INDEX_BUCKET_NAME, Key='records/2024-01-01/batch.jsonl', Body='\n'.join(json.dumps(r) for r in batch))
+        self.put_records(record('c.mp4', 'ccc', '333', 30, '2024-01-01T00:00:00+00:00'))
+        self.assertEqual(compact(self.s3, INDEX_BUCKET_NAME), 3)
+        self.assertEqual(sync(self.s3, INDEX_BUCKET_NAME, self.db), 1)
+        self.assertEqual(lookup(self.db, 'bbb'), [('media', 'b.mp4', 'bbb', 20)])
+        self.assertEqual(lookup(self.db, 'ccc'), [('media', 'c.mp4', 'ccc', 30)])
+
+    def test_duplicates_success(self):
+        from digest_index import compact, sync, duplicates
+        self.put_records(
+            record('a.mp4', 'aaa', '111', 10, '2024-01-01T00:00:00+00:00'),
+            record('b.mp4', 'aaa', '111', 10, '2024-01-01T00:00:00+00:00'),
+            record('c.mp4', 'aaa', '111', 10, '2024-01-01T00:00:00+00:00'),
+            record('d.mp4', 'ccc', '333', 5, '2024-01-01T00:00:00+00:00')
+        )
+        compact(self.s3, INDEX_BUCKET_NAME)
+        sync(self.s3, INDEX_BUCKET_NAME, self.db)
+        result = duplicates(self.db, 'md5')
+        self.assertEqual(len(result), 1)
+        self.assertEqual(result[0]['Count'], 3)
+        self.assertEqual(result[0]['RedundantBytes'], 20)
+        self.assertRaises(ValueError, duplicates, self.db, 'etag')
+
+    def test_changed_success(self):
+        from digest_index import compact, sync, changed
+        self.put_records(
+            record('a.mp4', 'aaa', '111', 10, '2024-01-01T00:00:00+00:00'),
+            record('b.mp4', 'bbb', '222', 10, '2024-01-01T00:00:00+00:00'),
+            record('a.mp4', 'xxx', '999', 10, '2024-02-01T00:00:00+00:00'),
+            record('b.mp4', 'bbb', '222', 10, '2024-02-01T00:00:00+00:00'),
+            record('c.mp4', 'ccc', '333', 10, '2024-02-01T00:00:00+00:00')
+        )
+        compact(self.s3, INDEX_BUCKET_NAME)
+        sync(self.s3, INDEX_BUCKET_NAME, self.db)
+        result = changed(self.db, '2024-01-15')
+        self.assertEqual([(r['Key'], r['Change']) for r in result], [('a.mp4', 'changed'), ('c.mp4', 'new')])
+
+    def test_main_error(self):
+        from digest_index import main
+        with self.assertRaises(SystemExit):
+            main(['digest_index.py'])
@@ -0,0 +1,68 @@
+#######################################################################################################################
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.                                                 #
+#                                                                                                                     #
+#  Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance     #
+#  with the License. A copy of the License is located at                                                              #
+#                                                                                                                     #
+#      http://www.apache.org/licenses/LICENSE-2.0                                                                     #
+#                                                                                                                     #
+#  or in the 'license' file accompanying this file. This file is distributed on an 'AS IS' BASIS, WITHOUT WARRANTIES  #
+#  OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions     #
+#  and limitations under the License.                                                                                 #
+#######################################################################################################################
+import gzip
+import io
+import json
+import os
+import unittest
+import boto3
+import mock
+from moto import mock_s3
+
+S3_BUCKET_NAME = 'buckettestname'
+DEFAULT_REGION = 'us-east-1'
+
+MB = 1024 * 1024
+GB = 1024 * MB
+
+
+@mock_s3
+class TestPlanHashJob(unittest.TestCase):
+    def setUp(self):
+        # moto does not decode aws-chunked uploads
+        environ = mock.patch.dict(os.environ, {'AWS_DEFAULT_REGION': DEFAULT_REGION, 'AWS_REQUEST_CHECKSUM_CALCULATION': 'when_required'})
+        environ.start()
+        self.addCleanup(environ.stop)
+        boto3.setup_default_session()
+        self.s3 = boto3.client('s3', region_name=DEFAULT_REGION)
+        self.s3.create_bucket(Bucket=S3_BUCKET_NAME)
+
+    def test_plan_success(self):
+        from plan_hash_job import plan
+        objects = [(S3_BUCKET_NAME, str(i) + '.mp4', 150 * MB) for i in range(4)] + [(S3_BUCKET_NAME, 'large.mxf', 10 * GB)]
+        report = plan(iter(objects), max_vcpus=16, throughput={'hash-small': 150, 'hash-large': 512}, invocation_seconds=0)
+        self.assertEqual(report['Jobs'], {'hash-small': {'Objects': 4, 'Bytes': 600 * MB, 'Seconds': 4.0}, 'hash-large': {'Objects': 1, 'Bytes': 10 * GB, 'Seconds': 20.0}})
+        # the large job waits for the small ones to free the vCPUs
+        self.assertEqual(report['Makespan'], 61 + 80)
+        self.assertEqual(report['Requests']['GetObject'], 4 * 3 + 160)
+        self.assertEqual(report['Requests']['HeadObject'], 10)
+
+    def test_plan_checkpoint_success(self):
+        from plan_hash_job import plan
+        report = plan(iter([(S3_BUCKET_NAME, 'large.mxf', 100 * GB)]), throughput={'hash-large': 512})
+        # an index record and a checkpoint a minute
+        self.assertEqual(report['Requests']['PutObject'], 1 + 3)
+
+    def test_main_success(self):
+        from plan_hash_job import main
+        self.s3.put_object(Bucket=S3_BUCKET_NAME, Key='a b.mp4', Body=b'abc')
+        self.s3.put_object(Bucket=S3_BUCKET_NAME, Key='inventory/data/0.csv.gz', Body=gzip.compress(b'buckettestname,a+b.mp4,3\nbuckettestname,c.mp4,20\n'))
+        manifest = {'fileFormat': 'CSV', 'fileSchema': 'Bucket, Key, Size', 'destinationBucket': 'arn:aws:s3:::' + S3_BUCKET_NAME, 'files': [{'key': 'inventory/data/0.csv.gz'}]}
+        self.s3.put_object(Bucket=S3_BUCKET_NAME, Key='inventory/manifest.json', Body=json.dumps(manifest))
+        self.s3.put_object(Bucket=S3_BUCKET_NAME, Key='manifest.csv', Body=b'buckettestname,a+b.mp4\n')
+
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            self.assertEqual(main(['plan_hash_job.py', 's3://' + S3_BUCKET_NAME + '/inventory/manifest.json']), 0)
+            self.assertEqual(main(['plan_hash_job.py', 's3://' + S3_BUCKET_NAME + '/manifest.csv']), 0)
+        reports = [json.loads(report) for report in stdout.getvalue().replace('}\n{', '}\0{').split('\0')]
+        self.assertEqual([report['Bytes'] for report in reports], [23, 3])
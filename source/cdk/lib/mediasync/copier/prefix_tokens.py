@@ -0,0 +1,56 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+# Shared by the copier and the MediaSync driver, the driver directory links to
+# this file (the copier directory is the docker build context).
+#
+# The tokens of a destination prefix are counted in windows of capacity / rate
+# seconds, capacity tokens per window. A window is split into shards, items of
+# capacity / shards tokens each, so that no single item takes more than a
+# fraction of the writes of a prefix. Tokens are taken with one conditional
+# UpdateItem, there is no read and no retry on contention.
+
+import random
+from botocore.exceptions import ClientError
+
+
+def get_window(now, rate, capacity):
+
+    seconds = capacity / rate
+    window = int(now // seconds)
+
+    return window, (window + 1) * seconds
+
+
+def take_tokens(client, table_name, partition, tokens, rate, capacity, shards, now):
+
+    # returns True when the tokens were taken from a shard of the current window
+    if rate <= 0 or capacity <= 0:
+        return False
+
+    limit = capacity // shards
+    if tokens > limit:
+        return False
+
+    window, ends = get_window(now, rate, capacity)
+    shard = random.randrange(shards)
+
+    try:
+        client.update_item(
+            TableName=table_name,
+            Key={'Partition': {'S': '{}#{}#{}'.format(partition, window, shard)}},
+            UpdateExpression='ADD #t :tokens SET #e = if_not_exists(#e, :expires)',
+            ConditionExpression='attribute_not_exists(#t) OR #t <= :max',
+            ExpressionAttributeNames={'#t': 'Tokens', '#e': 'ExpiresAt'},
+            ExpressionAttributeValues={
+                ':tokens': {'N': str(tokens)},
+                ':max': {'N': str(int(limit - tokens))},
+                ':expires': {'N': str(int(ends) + 3600)}
+            }
+        )
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+
+    return False
@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+# usage: ./resumable_copy.py <source s3 uri> <destination s3 uri> <size> <source bucket region> [stream]
+#
+# Copies an object with a multipart upload. The parts that are already in S3 are
+# the checkpoint: when the job is retried (e.g. after a Fargate Spot interruption)
+# the in-progress upload is found again, ListParts tells which parts are complete
+# and only the missing parts are copied.
+#
+# By default parts are copied server side (UploadPartCopy). With "stream" the
+# bytes are read from the source region and uploaded to the destination, and
+# the CHECKSUMS (md5, sha1, xxhash, sha256) are computed on the way and tagged
+# on the destination object with the same tags as the fixity utility. Parts
+# copied by a previous attempt are read again for the checksums. The metadata
+# and the tags of the source object are carried over, as by aws s3 cp. Objects
+# of at most one part are copied with a single CopyObject or PutObject.
+#
+# With COPY_STATS_TABLE_NAME and COPY_STATS_PARTITION set (by the MediaSync
+# driver) the bytes copied and the time it took are added to the throughput
+# stats the driver chooses the copy mode from.
+#
+# With RATE_LIMIT_TABLE_NAME and RATE_LIMIT_PARTITION set (by the MediaSync
+# driver) every part takes a token from the token bucket of its destination
+# prefix, the same bucket the driver admits copies through. Tokens are leased
+# RATE_LIMIT_LEASE at a time. A part waits while the prefix is over
+# RATE_LIMIT_REQUESTS_PER_SECOND, the copy fails after
+# RATE_LIMIT_MAX_WAIT_SECONDS and is retried by AWS Batch.
+
+import os
+import sys
+import time
+import random
+import hashlib
+import logging
+import threading
+import urllib.parse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+from botocore import config
+from botocore.exceptions import ClientError
+from prefix_tokens import get_window, take_tokens
+
+logger = logging.getLogger()
+logger.setLevel(os.environ.get('LogLevel', 'INFO'))
+
+MAX_PARTS = 10000
+MAX_TAGS = 10
+MB = 1024 * 1024
+
+# metadata that is carried over from the source object
+COPIED_HEADERS = ['CacheControl', 'ContentDisposition', 'ContentEncoding', 'ContentLanguage', 'ContentType', 'Expires', 'Metadata']
+
+presetConfig = config.Config(retries={'max_attempts': 10, 'mode': 'standard'}, max_pool_connections=64)
+
+# checksum name, (tag, digest)
+DIGESTS = {
+    'md5': ('Content-MD5', hashlib.md5),
+    'sha1': ('Content-SHA1', hashlib.sha1),
+    'sha256': ('Content-SHA256', hashlib.sha256)
+}
+
+try:
+    # optional, xxhash is skipped when it is not installed
+    import xxhash
+    DIGESTS['xxhash'] = ('Content-XXHash', xxhash.xxh64)
+except ImportError:
+    pass
+
+
+def parse_s3_uri(uri):
+
+    # keys are not url encoded, so they are split off as-is
+    bucket, _, key = uri[len('s3://'):].partition('/')
+    return bucket, key
+
+
+def get_part_size(size):
+
+    part_size = int(os.environ.get('PART_SIZE_IN_BYTES', str(64 * MB)))
+
+    # stay under 10,000 parts, in whole MBs
+    min_part_size = -(-size // MAX_PARTS)
+    min_part_size = -(-min_part_size // MB) * MB
+
+    return max(part_size, min_part_size)
+
+
+def find_upload(client, bucket, key, not_before):
+
+    # the most recent upload of this key that was started after the source was
+    # last modified. Older uploads may hold parts of a previous version.
+    upload = None
+
+    for page in client.get_paginator('list_multipart_uploads').paginate(Bucket=bucket, Prefix=key):
+        for candidate in page.get('Uploads', []):
+            if candidate['Key'] != key:
+                continue
+            if candidate['Initiated'] < not_before:
+                logger.info('aborting stale upload ' + candidate['UploadId'])
+                client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=candidate['UploadId'])
+            elif upload is None or candidate['Initiated'] > upload['Initiated']:
+                upload = candidate
+
+    return None if upload is None else upload['UploadId']
+
+
+def get_digests():
+
+    digests = {}
+    for name in os.environ.get('CHECKSUMS', '').split(','):
+        name = name.strip().lower()
+        if name in DIGESTS:
+            tag, digest = DIGESTS[name]
+            digests[tag] = digest()
+        elif name:
+            logger.warning('skipping unsupported checksum ' + name)
+
+    return digests
+
+
+def get_tags(client, bucket, key):
+
+    return {tag['Key']: tag['Value'] for tag in client.get_object_tagging(Bucket=bucket, Key=key)['TagSet']}
+
+
+def merge_tags(tags, checksums):
+
+    # the checksums replace tags of the same name. An object has at most 10
+    # tags, the checksums are kept over the other tags.
+    merged = {**{tag: value for tag, value in tags.items() if tag not in checksums}, **checksums}
+    if len(merged) > MAX_TAGS:
+        dropped = list(merged)[:len(merged) - MAX_TAGS]
+        logger.warning('dropping tags ' + ','.join(dropped) + ' to keep the checksums')
+        merged = {tag: value for tag, value in merged.items() if tag not in dropped}
+
+    return merged
+
+
+def encode_tags(tags):
+
+    return urllib.parse.urlencode(tags)
+
+
+def list_completed_parts(client, bucket, key, upload_id):
+
+    parts = {}
+    for page in client.get_paginator('list_parts').paginate(Bucket=bucket, Key=key, UploadId=upload_id):
+        for part in page.get('Parts', []):
+            parts[part['PartNumber']] = {'ETag': part['ETag'], 'Size': part['Size']}
+
+    return parts
+
+
+def get_ranges(size, part_size):
+
+    return [(part_number, start, min(start + part_size, size) - 1) for part_number, start in enumerate(range(0, size, part_size), start=1)]
+
+
+def copy_part_server_side(client, source_bucket, source_key, source_etag, bucket, key, upload_id, part_number, start, end):
+
+    response = client.upload_part_copy(
+        Bucket=bucket,
+        Key=key,
+        UploadId=upload_id,
+        PartNumber=part_number,
+        CopySource={'Bucket': source_bucket, 'Key': source_key},
+        CopySourceRange='bytes={}-{}'.format(start, end),
+        CopySourceIfMatch=source_etag
+    )
+
+    return response['CopyPartResult']['ETag']
+
+
+def read_part(source_client, source_bucket, source_key, source_etag, start, end):
+
+    return source_client.get_object(
+        Bucket=source_bucket,
+        Key=source_key,
+        Range='bytes={}-{}'.format(start, end),
+        IfMatch=source_etag
+    )['Body'].read()
+
+
+def upload_part(client, bucket, key, upload_id, part_number, body):
+
+    response = client.upload_part(
+        Bucket=bucket,
+        Key=key,
+        UploadId=upload_id,
+        PartNumber=part_number,
+        Body=body
+    )
+
+    return response['ETag']
+
+
+class RateLimitTimeoutError(Exception):
+    pass
+
+
+class PrefixRateLimiter:
+
+    MIN_SLEEP_SECONDS = 0.05
+    MAX_SLEEP_SECONDS = 5
+
+    def __init__(self, table_name, partition, rate, capacity, shards=1, lease=1, max_wait=900):
+        self.table_name = table_name
+        self.partition = partition
+        self.rate = rate
+        self.capacity = capacity
+        self.shards = shards
+        self.lease = lease
+        self.max_wait = max_wait
+        self.leased = 0
+        self.leased_window = None
+        self.lock = threading.Lock()
+        self.client = boto3.client('dynamodb', config=presetConfig)
+
+    def take(self, now=None):
+        # returns 0 when a token is taken, otherwise the seconds to wait. Tokens
+        # are leased lease at a time from the window of the prefix and spent by
+        # the parts of this copy until the window ends.
+        now = time.time() if now is None else now
+        window, ends = get_window(now, self.rate, self.capacity)
+
+        with self.lock:
+            if self.leased and self.leased_window == window:
+                self.leased -= 1
+                return 0
+
+            for tokens in sorted(set([self.lease, 1]), reverse=True):
+                if take_tokens(self.client, self.table_name, self.partition, tokens, self.rate, self.capacity, self.shards, now):
+                    self.leased, self.leased_window = tokens - 1, window
+                    return 0
+
+        return ends - now
+
+    def acquire(self):
+        # the parts in flight back off with jitter so that they do not retry
+        # together, and give up after max_wait seconds
+        deadline = time.time() + self.max_wait
+        sleep = self.MIN_SLEEP_SECONDS
+        while True:
+            wait = self.take()
+            if not wait:
+                return
+            wait = max(wait, sleep) * random.uniform(1, 2)
+            if time.time() + wait > deadline:
+                raise RateLimitTimeoutError('prefix ' + self.partition + ' is over its request rate for ' + str(self.max_wait) + ' seconds')
+            time.sleep(wait)
+            sleep = min(sleep * 2, self.MAX_SLEEP_SECONDS)
+
+
+def get_rate_limiter():
+
+    table_name = os.environ.get('RATE_LIMIT_TABLE_NAME')
+    partition = os.environ.get('RATE_LIMIT_PARTITION')
+    rate = float(os.environ.get('RATE_LIMIT_REQUESTS_PER_SECOND', '3500'))
+    if not table_name or not partition or rate <= 0:
+        return None
+
+    return PrefixRateLimiter(
+        table_name,
+        partition,
+        rate,
+        float(os.environ.get('RATE_LIMIT_BURST', str(rate))),
+        int(os.environ.get('RATE_LIMIT_SHARDS', '4')),
+        int(os.environ.get('RATE_LIMIT_LEASE', '8')),
+        float(os.environ.get('RATE_LIMIT_MAX_WAIT_SECONDS', '900'))
+    )
+
+
+def record_throughput(size, seconds):
+
+    table_name = os.environ.get('COPY_STATS_TABLE_NAME')
+    partition = os.environ.get('COPY_STATS_PARTITION')
+    if not table_name or not partition or size == 0:
+        return
+
+    # same item as DynamoDBCopyStatsBackend in the MediaSync driver
+    try:
+        boto3.client('dynamodb', config=presetConfig).update_item(
+            TableName=table_name,
+            Key={'Partition': {'S': partition}},
+            UpdateExpression='ADD #c :one, #b :bytes, #s :seconds SET #e = if_not_exists(#e, :expires)',
+            ExpressionAttributeNames={'#c': 'Count', '#b': 'Bytes', '#s': 'Seconds', '#e': 'ExpiresAt'},
+            ExpressionAttributeValues={
+                ':one': {'N': '1'},
+                ':bytes': {'N': str(size)},
+                ':seconds': {'N': str(seconds)},
+                ':expires': {'N': str(int(time.time()) + 7 * 24 * 3600)}
+            }
+        )
+    except ClientError as e:
+        logger.warning('throughput not recorded: ' + str(e))
+
+
+def copy_single(client, source_client, source, source_bucket, source_key, bucket, key, size, stream, rate_limiter):
+
+    # a single request, a multipart upload needs at least one part
+    if rate_limiter:
+        rate_limiter.acquire()
+    started = time.time()
+
+    if not stream:
+        # the metadata and the tags are copied along
+        response = client.copy_object(
+            Bucket=bucket,
+            Key=key,
+            CopySource={'Bucket': source_bucket, 'Key': source_key},
+            CopySourceIfMatch=source['ETag']
+        )
+        record_throughput(size, time.time() - started)
+        logger.info('copy complete ' + response['CopyObjectResult']['ETag'])
+        return response
+
+    digests = get_digests()
+    body = read_part(source_client, source_bucket, source_key, source['ETag'], 0, size - 1) if size else b''
+    for digest in digests.values():
+        digest.update(body)
+    checksums = {tag: digest.hexdigest() for tag, digest in digests.items()}
+
+    tags = merge_tags(get_tags(source_client, source_bucket, source_key), checksums)
+    response = client.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body=body,
+        **({'Tagging': encode_tags(tags)} if tags else {}),
+        **{header: source[header] for header in COPIED_HEADERS if header in source}
+    )
+    record_throughput(size, time.time() - started)
+    logger.info('copy complete ' + response['ETag'])
+    if checksums:
+        logger.info(str(checksums))
+
+    return response
+
+
+def copy(source_uri, destination_uri, size, source_region, stream=False):
+
+    source_bucket, source_key = parse_s3_uri(source_uri)
+    bucket, key = parse_s3_uri(destination_uri)
+
+    source_client = boto3.client('s3', region_name=source_region, config=presetConfig)
+    client = boto3.client('s3', config=presetConfig)
+
+    source = source_client.head_object(Bucket=source_bucket, Key=source_key)
+    if source['ContentLength'] != size:
+        logger.warning('size of the source object changed to ' + str(source['ContentLength']))
+        size = source['ContentLength']
+
+    rate_limiter = get_rate_limiter()
+    if size <= get_part_size(size):
+        return copy_single(client, source_client, source, source_bucket, source_key, bucket, key, size, stream, rate_limiter)
+
+    upload_id = find_upload(client, bucket, key, source['LastModified'])
+    completed = {}
+
+    if upload_id is None:
+        tags = get_tags(source_client, source_bucket, source_key)
+        upload_id = client.create_multipart_upload(
+            Bucket=bucket,
+            Key=key,
+            **({'Tagging': encode_tags(tags)} if tags else {}),
+            **{header: source[header] for header in COPIED_HEADERS if header in source}
+        )['UploadId']
+        logger.info('started upload ' + upload_id)
+    else:
+        completed = list_completed_parts(client, bucket, key, upload_id)
+        logger.info('resuming upload ' + upload_id + ' with ' + str(len(completed)) + ' completed parts')
+
+    # keep the part size of the previous attempt
+    part_size = get_part_size(size)
+    if 1 in completed and completed[1]['Size'] < size:
+        part_size = completed[1]['Size']
+
+    ranges = get_ranges(size, part_size)
+
+    pending = [r for r in ranges if r[0] not in completed or completed[r[0]]['Size'] != r[2] - r[1] + 1]
+    logger.info(str(len(pending)) + ' of ' + str(len(ranges)) + ' parts to copy')
+
+    digests = get_digests() if stream else {}
+    to_copy = set(r[0] for r in pending)
+    started = time.time()
+
+    def copy_part(r):
+        part_number, start, end = r
+        if not stream:
+            if rate_limiter:
+                rate_limiter.acquire()
+            return part_number, copy_part_server_side(client, source_bucket, source_key, source['ETag'], bucket, key, upload_id, part_number, start, end), None
+        body = read_part(source_client, source_bucket, source_key, source['ETag'], start, end)
+        if part_number not in to_copy:
+            # only read for the checksums
+            return part_number, completed[part_number]['ETag'], body
+        if rate_limiter:
+            rate_limiter.acquire()
+        return part_number, upload_part(client, bucket, key, upload_id, part_number, body), body
+
+    workers = int(os.environ.get('CONCURRENCY', '16' if stream else '64'))
+    if stream:
+        # each streamed part is buffered in memory
+        workers = max(1, min(workers, int(os.environ.get('STREAM_BUFFER_IN_BYTES', str(4096 * MB))) // part_size))
+
+    # parts are copied in parallel and hashed in order, one thread per digest.
+    # Only a window of parts is in flight so that streamed parts fit in memory.
+    with ThreadPoolExecutor(max_workers=workers) as executor, ThreadPoolExecutor(max_workers=max(1, len(digests))) as hashers:
+
+        def finish(future):
+            part_number, etag, body = future.result()
+            completed[part_number] = {'ETag': etag, 'Size': None}
+            for update in [hashers.submit(digest.update, body) for digest in digests.values()]:
+                update.result()
+
+        window = deque()
+        for r in (ranges if digests else pending):
+            if len(window) >= workers:
+                finish(window.popleft())
+            window.append(executor.submit(copy_part, r))
+        while window:
+            finish(window.popleft())
+
+    response = client.complete_multipart_upload(
+        Bucket=bucket,
+        Key=key,
+        UploadId=upload_id,
+        MultipartUpload={'Parts': [{'ETag': completed[r[0]]['ETag'], 'PartNumber': r[0]} for r in ranges]}
+    )
+    logger.info('copy complete ' + response['ETag'])
+
+    # parts that are only read for the checksums count as well
+    record_throughput(sum(end - start + 1 for _, start, end in (ranges if digests else pending)), time.time() - started)
+
+    if digests:
+        # added to the tags of the source that the upload was created with
+        checksums = {tag: digest.hexdigest() for tag, digest in digests.items()}
+        tags = merge_tags(get_tags(client, bucket, key), checksums)
+        client.put_object_tagging(
+            Bucket=bucket,
+            Key=key,
+            Tagging={'TagSet': [{'Key': tag, 'Value': value} for tag, value in tags.items()]}
+        )
+        logger.info(str(checksums))
+
+    return response
+
+
+def main(argv):
+
+    if len(argv) < 5:
+        print('usage: resumable_copy.py <source s3 uri> <destination s3 uri> <size> <source bucket region> [stream]')
+        return 1
+
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s')
+    copy(argv[1], argv[2], int(argv[3]), argv[4], len(argv) > 5 and argv[5] == 'stream')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -1,2 +1,2 @@
 #/bin/bash
-aws s3 cp $1 $2 --expected-size $3 --source-region $4
+python3 /usr/local/bin/resumable_copy.py $1 $2 $3 $4
@@ -0,0 +1,217 @@
+#######################################################################################################################
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.                                                 #
+#                                                                                                                     #
+#  Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance     #
+#  with the License. A copy of the License is located at                                                              #
+#                                                                                                                     #
+#      http://www.apache.org/licenses/LICENSE-2.0                                                                     #
+#                                                                                                                     #
+#  or in the 'license' file accompanying this file. This file is distributed on an 'AS IS' BASIS, WITHOUT WARRANTIES  #
+#  OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions     #
+#  and limitations under the License.                                                                                 #
+#######################################################################################################################
+import hashlib
+import os
+import unittest
+from datetime import datetime, timezone
+import boto3
+import mock
+from moto import mock_s3, mock_dynamodb
+
+S3_BUCKET_NAME = 'buckettestname'
+DESTINATION_S3_BUCKET_NAME = 'actualtestbucketname'
+DEFAULT_REGION = 'us-east-1'
+S3_TEST_FILE_KEY = 'media/Big Bunny?Sample.mp4'
+PART_SIZE = 5 * 1024 * 1024
+S3_TEST_FILE_CONTENT = os.urandom(PART_SIZE * 2 + 1024)
+
+@mock_s3
+class TestResumableCopy(unittest.TestCase):
+    def setUp(self):
+        # moto does not decode aws-chunked uploads
+        environ = mock.patch.dict(os.environ, {'PART_SIZE_IN_BYTES': str(PART_SIZE), 'CONCURRENCY': '2', 'AWS_DEFAULT_REGION': DEFAULT_REGION, 'AWS_REQUEST_CHECKSUM_CALCULATION': 'when_required'})
+        environ.start()
+        self.addCleanup(environ.stop)
+        boto3.setup_default_session()
+        self.s3 = boto3.client('s3', region_name=DEFAULT_REGION)
+        self.s3.create_bucket(Bucket=S3_BUCKET_NAME)
+        self.s3.create_bucket(Bucket=DESTINATION_S3_BUCKET_NAME)
+        self.s3.put_object(Bucket=S3_BUCKET_NAME, Key=S3_TEST_FILE_KEY, Body=S3_TEST_FILE_CONTENT, ContentType='video/mp4')
+
+    def copied_content(self):
+        return self.s3.get_object(Bucket=DESTINATION_S3_BUCKET_NAME, Key=S3_TEST_FILE_KEY)
+
+    def test_parse_s3_uri_success(self):
+        from resumable_copy import parse_s3_uri
+        self.assertEqual(parse_s3_uri('s3://' + S3_BUCKET_NAME + '/' + S3_TEST_FILE_KEY), (S3_BUCKET_NAME, S3_TEST_FILE_KEY))
+
+    def test_get_part_size_success(self):
+        from resumable_copy import get_part_size
+        self.assertEqual(get_part_size(1024), PART_SIZE)
+        # 5TB needs bigger parts to stay under 10,000
+        self.assertEqual(get_part_size(5 * 1024 ** 4), 525 * 1024 * 1024)
+
+    def test_copy_server_side_success(self):
+        from resumable_copy import copy
+        copy('s3://' + S3_BUCKET_NAME + '/' + S3_TEST_FILE_KEY, 's3://' + DESTINATION_S3_BUCKET_NAME + '/' + S3_TEST_FILE_KEY, len(S3_TEST_FILE_CONTENT), DEFAULT_REGION)
+        copied = self.copied_content()
+        self.assertEqual(copied['Body'].read(), S3_TEST_FILE_CONTENT)
+        self.assertEqual(copied['ContentType'], 'video/mp4')
+
+    def test_copy_stream_success(self):
+        from resumable_copy import copy
+        copy('s3://' + S3_BUCKET_NAME + '/' + S3_TEST_FILE_KEY, 's3://' + DESTINATION_S3_BUCKET_NAME + '/' + S3_TEST_FILE_KEY, len(S3_TEST_FILE_CONTENT), DEFAULT_REGION, stream=True)
+        self.assertEqual(self.copied_content()['Body'].read(), S3_TEST_FILE_CONTENT)
+
+    def test_copy_resume_success(self):
+        import resumable_copy
+        # an interrupted attempt that completed the first part
+        upload_id = self.s3.create_multipart_upload(Bucket=DESTINATION_S3_BUCKET_NAME, Key=S3_TEST_FILE_KEY)['UploadId']
+        self.s3.upload_part(Bucket=DESTINATION_S3_BUCKET_NAME, Key=S3_TEST_FILE_KEY, UploadId=upload_id, PartNumber=1, Body=S3_TEST_FILE_CONTENT[:PART_SIZE])
+
+        # moto does not keep the time an upload was initiated
+        with mock.patch.object(resumable_copy, 'find_upload', return_value=upload_id), mock.patch.object(resumable_copy, 'copy_part_server_side', wraps=resumable_copy.copy_part_server_side) as copy_part:
+            resumable_copy.copy('s3://' + S3_BUCKET_NAME + '/' + S3_TEST_FILE_KEY, 's3://' + DESTINATION_S3_BUCKET_NAME + '/' + S3_TEST_FILE_KEY, len(S3_TEST_FILE_CONTENT), DEFAULT_REGION)
+            self.assertEqual(sorted(c.args[7] for c in copy_part.call_args_list), [2, 3])
+
+        self.assertEqual(self.copied_content()['Body'].read(), S3_TEST_FILE_CONTENT)
+        self.assertEqual(self.s3.list_multipart_uploads(Bucket=DESTINATION_S3_BUCKET_NAME).get('Uploads', []), [])
+
+    def test_copy_stream_checksums_success(self):
+        from resumable_copy import copy
+        with mock.patch.dict(os.environ, {'CHECKSUMS': 'md5,sha1,sha256,unknown'}):
+            copy('s3://' + S3_BUCKET_NAME + '/' + S3_TEST_FILE_KEY, 's3://' + DESTINATION_S3_BUCKET_NAME + '/' + S3_TEST_FILE_KEY, len(S3_TEST_FILE_CONTENT), DEFAULT_REGION, stream=True)
+        tags = {t['Key']: t['Value'] for t in self.s3.get_object_tagging(Bucket=DESTINATION_S3_BUCKET_NAME, Key=S3_TEST_FILE_KEY)['TagSet']}
+        self.assertEqual(tags, {
+            'Content-MD5': hashlib.md5(S3_TEST_FILE_CONTENT).hexdigest(),
+            'Content-SHA1': hashlib.sha1(S3_TEST_FILE_CONTENT).hexdigest(),
+            'Content-SHA256': hashlib.sha256(S3_TEST_FILE_CONTENT).hexdigest()
+        })
+
+    def test_copy_stream_checksums_resume_success(self):
+        import resumable_copy
+        upload_id = self.s3.create_multipart_upload(Bucket=DESTINATION_S3_BUCKET_NAME, Key=S3_TEST_FILE_KEY)['UploadId']
+        self.s3.upload_part(Bucket=DESTINATION_S3_BUCKET_NAME, Key=S3_TEST_FILE_KEY, UploadId=upload_id, PartNumber=1, Body=S3_TEST_FILE_CONTENT[:PART_SIZE])
+
+        # the completed part is read again for the checksum, but not uploaded
+        with mock.patch.dict(os.environ, {'CHECKSUMS': 'md5'}), mock.patch.object(resumable_copy, 'find_upload', return_value=upload_id), mock.patch.object(resumable_copy, 'upload_part', wraps=resumable_copy.upload_part) as upload_part:
+            resumable_copy.copy('s3://' + S3_BUCKET_NAME + '/' + S3_TEST_FILE_KEY, 's3://' + DESTINATION_S3_BUCKET_NAME + '/' + S3_TEST_FILE_KEY, len(S3_TEST_FILE_CONTENT), DEFAULT_REGION, stream=True)
+            self.assertEqual(sorted(c.args[4] for c in upload_part.call_args_list), [2, 3])
+
+        self.assertEqual(self.copied_content()['Body'].read(), S3_TEST_FILE_CONTENT)
+        tags = self.s3.get_object_tagging(Bucket=DESTINATION_S3_BUCKET_NAME, Key=S3_TEST_FILE_KEY)['TagSet']
+        self.assertEqual(tags, [{'Key': 'Content-MD5', 'Value': hashlib.md5(S3_TEST_FILE_CONTENT).hexdigest()}])
+
+    def test_copy_tags_success(self):
+        from resumable_copy import copy
+        self.s3.put_object_tagging(Bucket=S3_BUCKET_NAME, Key=S3_TEST_FILE_KEY, Tagging={'TagSet': [{'Key': 'Project', 'Value': 'a b+c'}, {'Key': 'Content-MD5', 'Value': 'stale'}]})
+        copy('s3://' + S3_BUCKET_NAME + '/' + S3_TEST_FILE_KEY, 's3://' + DESTINATION_S3_BUCKET_NAME + '/' + S3_TEST_FILE_KEY, len(S3_TEST_FILE_CONTENT), DEFAULT_REGION)
+        tags = {t['Key']: t['Value'] for t in self.s3.get_object_tagging(Bucket=DESTINATION_S3_BUCKET_NAME, Key=S3_TEST_FILE_KEY)['TagSet']}
+        self.assertEqual(tags, {'Project': 'a b+c', 'Content-MD5': 'stale'})
+
+        # the checksums of a streaming copy are added to the tags of the source
+        with mock.patch.dict(os.environ, {'CHECKSUMS': 'md5'}):
+            copy('s3://' + S3_BUCKET_NAME + '/' + S3_TEST_FILE_KEY, 's3://' + DESTINATION_S3_BUCKET_NAME + '/' + S3_TEST_FILE_KEY, len(S3_TEST_FILE_CONTENT), DEFAULT_REGION, stream=True)
+        tags = {t['Key']: t['Value'] for t in self.s3.get_object_tagging(Bucket=DESTINATION_S3_BUCKET_NAME, Key=S3_TEST_FILE_KEY)['TagSet']}
+        self.assertEqual(tags, {'Project': 'a b+c', 'Content-MD5': hashlib.md5(S3_TEST_FILE_CONTENT).hexdigest()})
+
+    def test_merge_tags_success(self):
+        from resumable_copy import merge_tags
+        tags = {'Tag' + str(i): str(i) for i in range(10)}
+        # the checksums are kept over the other tags
+        merged = merge_tags(tags, {'Content-MD5': 'md5', 'Content-SHA1': 'sha1'})
+        self.assertEqual(len(merged), 10)
+        self.assertEqual(list(merged)[-2:], ['Content-MD5', 'Content-SHA1'])
+        self.assertNotIn('Tag0', merged)
+
+    def test_copy_single_part_success(self):
+        from resumable_copy import copy
+        for content in [b'', b'small']:
+            self.s3.put_object(Bucket=S3_BUCKET_NAME, Key='small.txt', Body=content, ContentType='text/plain', Tagging='Project=a')
+            copy('s3://' + S3_BUCKET_NAME + '/small.txt', 's3://' + DESTINATION_S3_BUCKET_NAME + '/small.txt', len(content), DEFAULT_REGION)
+            copied = self.s3.get_object(Bucket=DESTINATION_S3_BUCKET_NAME, Key='small.txt')
+            self.assertEqual((copied['Body'].read(), copied['ContentType']), (content, 'text/plain'))
+
+            with mock.patch.dict(os.environ, {'CHECKSUMS': 'md5'}):
+                copy('s3://' + S3_BUCKET_NAME + '/small.txt', 's3://' + DESTINATION_S3_BUCKET_NAME + '/streamed.txt', len(content), DEFAULT_REGION, stream=True)
+            copied = self.s3.get_object(Bucket=DESTINATION_S3_BUCKET_NAME, Key='streamed.txt')
+            self.assertEqual((copied['Body'].read(), copied['ContentType']), (content, 'text/plain'))
+            tags = {t['Key']: t['Value'] for t in self.s3.get_object_tagging(Bucket=DESTINATION_S3_BUCKET_NAME, Key='streamed.txt')['TagSet']}
+            self.assertEqual(tags, {'Project': 'a', 'Content-MD5': hashlib.md5(content).hexdigest()})
+
+        self.assertEqual(self.s3.list_multipart_uploads(Bucket=DESTINATION_S3_BUCKET_NAME).get('Uploads', []), [])
+
+    @mock_dynamodb
+    def test_copy_records_throughput_success(self):
+        from resumable_copy import copy
+        dynamodb = boto3.client('dynamodb', region_name=DEFAULT_REGION)
+        dynamodb.create_table(
+            TableName='copystats',
+            KeySchema=[{'AttributeName': 'Partition', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'Partition', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        with mock.patch.dict(os.environ, {'COPY_STATS_TABLE_NAME': 'copystats', 'COPY_STATS_PARTITION': 'a>b#server#12#0'}):
+            copy('s3://' + S3_BUCKET_NAME + '/' + S3_TEST_FILE_KEY, 's3://' + DESTINATION_S3_BUCKET_NAME + '/' + S3_TEST_FILE_KEY, len(S3_TEST_FILE_CONTENT), DEFAULT_REGION)
+        item = dynamodb.get_item(TableName='copystats', Key={'Partition': {'S': 'a>b#server#12#0'}})['Item']
+        self.assertEqual(item['Count'], {'N': '1'})
+        self.assertEqual(item['Bytes'], {'N': str(len(S3_TEST_FILE_CONTENT))})
+
+    @mock_dynamodb
+    def test_copy_rate_limited_success(self):
+        import resumable_copy
+        boto3.client('dynamodb', region_name=DEFAULT_REGION).create_table(
+            TableName='ratelimit',
+            KeySchema=[{'AttributeName': 'Partition', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'Partition', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        limiter = resumable_copy.PrefixRateLimiter('ratelimit', DESTINATION_S3_BUCKET_NAME + '/media', 2, 2)
+        self.assertEqual(limiter.take(now=0), 0)
+        self.assertEqual(limiter.take(now=0), 0)
+        # the prefix is over its rate until the next window
+        self.assertEqual(limiter.take(now=0.5), 0.5)
+        self.assertEqual(limiter.take(now=1), 0)
+
+        # tokens are leased with one write and spent locally
+        limiter = resumable_copy.PrefixRateLimiter('ratelimit', DESTINATION_S3_BUCKET_NAME + '/other', 4, 4, lease=3)
+        self.assertEqual([limiter.take(now=0) for _ in range(4)], [0, 0, 0, 0])
+        self.assertEqual(limiter.take(now=0), 1)
+        item = boto3.client('dynamodb', region_name=DEFAULT_REGION).get_item(TableName='ratelimit', Key={'Partition': {'S': DESTINATION_S3_BUCKET_NAME + '/other#0#0'}})['Item']
+        self.assertEqual(item['Tokens'], {'N': '4'})
+
+        # a part gives up when the prefix stays over its rate
+        limiter = resumable_copy.PrefixRateLimiter('ratelimit', DESTINATION_S3_BUCKET_NAME + '/media', 2, 2, max_wait=0)
+        with mock.patch.object(limiter, 'take', return_value=1), mock.patch('time.sleep') as sleep:
+            self.assertRaises(resumable_copy.RateLimitTimeoutError, limiter.acquire)
+            sleep.assert_not_called()
+
+        # every part takes a token
+        with mock.patch.dict(os.environ, {'RATE_LIMIT_TABLE_NAME': 'ratelimit', 'RATE_LIMIT_PARTITION': DESTINATION_S3_BUCKET_NAME + '/media', 'RATE_LIMIT_REQUESTS_PER_SECOND': '1000'}), \
+                mock.patch.object(resumable_copy.PrefixRateLimiter, 'acquire') as acquire:
+            resumable_copy.copy('s3://' + S3_BUCKET_NAME + '/' + S3_TEST_FILE_KEY, 's3://' + DESTINATION_S3_BUCKET_NAME + '/' + S3_TEST_FILE_KEY, len(S3_TEST_FILE_CONTENT), DEFAULT_REGION)
+            self.assertEqual(acquire.call_count, 3)
+        self.assertEqual(self.copied_content()['Body'].read(), S3_TEST_FILE_CONTENT)
+
+    def test_prefix_tokens_link_success(self):
+        # the driver takes its tokens from the same items
+        copier = os.path.dirname(os.path.realpath(__file__))
+        path = os.path.join(copier, '..', 'lambda', 'mediasync_driver', 'prefix_tokens.py')
+        self.assertEqual(os.path.realpath(path), os.path.join(copier, 'prefix_tokens.py'))
+
+    def test_find_upload_success(self):
+        from resumable_copy import find_upload
+        upload_id = self.s3.create_multipart_upload(Bucket=DESTINATION_S3_BUCKET_NAME, Key=S3_TEST_FILE_KEY)['UploadId']
+        self.s3.create_multipart_upload(Bucket=DESTINATION_S3_BUCKET_NAME, Key=S3_TEST_FILE_KEY + '.other')
+        self.assertEqual(find_upload(self.s3, DESTINATION_S3_BUCKET_NAME, S3_TEST_FILE_KEY, datetime(2000, 1, 1, tzinfo=timezone.utc)), upload_id)
+
+    def test_find_upload_stale(self):
+        from resumable_copy import find_upload
+        self.s3.create_multipart_upload(Bucket=DESTINATION_S3_BUCKET_NAME, Key=S3_TEST_FILE_KEY)
+        # the source changed after the upload was started
+        self.assertIsNone(find_upload(self.s3, DESTINATION_S3_BUCKET_NAME, S3_TEST_FILE_KEY, datetime.now(timezone.utc)))
+        self.assertEqual(self.s3.list_multipart_uploads(Bucket=DESTINATION_S3_BUCKET_NAME).get('Uploads', []), [])
+
+    def test_main_error(self):
+        from resumable_copy import main
+        self.assertEqual(main(['resumable_copy.py']), 1)
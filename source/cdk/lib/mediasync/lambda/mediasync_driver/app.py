@@ -5,12 +5,26 @@ import os
 import logging
 import boto3
 import json
+import re
 import urllib
 import jsonpickle
-from botocore.exceptions import ClientError
+from botocore.exceptions import BotoCoreError, ClientError
 import unicodedata
+import threading
+import time
+import random
 from botocore import config
 
+try:
+    from checksums import ChecksumMismatchError, verify_checksum
+    from preflight_cache import PreflightCache
+    from prefix_tokens import take_tokens
+except ImportError:
+    # imported as a package by the unit tests
+    from .checksums import ChecksumMismatchError, verify_checksum
+    from .preflight_cache import PreflightCache
+    from .prefix_tokens import take_tokens
+
 solution_identifier= os.environ['SOLUTION_IDENTIFIER']
 
 user_agent_extra_param = {"user_agent_extra":solution_identifier}
@@ -34,26 +48,229 @@ class UnsupportedStorageClassError(Exception):
 class UnsupportedTextFormatError(Exception):
     pass
 
+# S3 scales request rates per partitioned prefix (~3,500 PUT/s each). Every PUT
+# takes a token from the bucket of its destination prefix: the driver for a
+# Lambda copy and the CreateMultipartUpload of a copy job, the copier for every
+# part (RATE_LIMIT_PARTITION). Overall concurrency grows with the spread of
+# prefixes instead of being clamped for the whole bucket.
+class InMemoryTokenBucketBackend:
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, partition, tokens, rate, capacity, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            available, updated = self._buckets.get(partition, (capacity, now))
+            available = min(capacity, available + (now - updated) * rate)
+            granted = available >= tokens
+            if granted:
+                available = available - tokens
+            self._buckets[partition] = (available, now)
+        return granted
+
+# shares the buckets between concurrent lambdas and the copy jobs, see
+# prefix_tokens. endpoint_url allows a local stand-in such as DynamoDB local.
+class DynamoDBTokenBucketBackend:
+
+    def __init__(self, table_name, endpoint_url=None, shards=1):
+        self.table_name = table_name
+        self.shards = shards
+        self.client = boto3.client('dynamodb', endpoint_url=endpoint_url, config=presetConfig)
+
+    def take(self, partition, tokens, rate, capacity, now=None):
+        now = time.time() if now is None else now
+
+        return take_tokens(self.client, self.table_name, partition, tokens, rate, capacity, self.shards, now)
+
+rate_limit_backend = None
+
+def get_rate_limit_shards():
+    return int(os.environ.get('RATE_LIMIT_SHARDS', '4'))
+
+def get_rate_limit_backend():
+    global rate_limit_backend
+
+    if rate_limit_backend is None:
+        table_name = os.environ.get('RATE_LIMIT_TABLE_NAME', '')
+        if table_name:
+            rate_limit_backend = DynamoDBTokenBucketBackend(table_name, os.environ.get('RATE_LIMIT_ENDPOINT_URL') or None, get_rate_limit_shards())
+        else:
+            rate_limit_backend = InMemoryTokenBucketBackend()
+
+    return rate_limit_backend
+
+def get_rate_limit_partition(bucket, key):
+
+    depth = int(os.environ.get('RATE_LIMIT_PREFIX_DEPTH', '1'))
+    parts = key.split('/')[:-1]
+
+    return bucket + '/' + '/'.join(parts[:depth])
+
+def acquire_prefix_tokens(destination_bucket, destination_key):
+
+    rate = float(os.environ.get('RATE_LIMIT_REQUESTS_PER_SECOND', '3500'))
+    if rate <= 0:
+        return True
+
+    capacity = float(os.environ.get('RATE_LIMIT_BURST', str(rate)))
+    partition = get_rate_limit_partition(destination_bucket, destination_key)
+
+    granted = get_rate_limit_backend().take(partition, 1, rate, capacity)
+    if not granted:
+        logger.info('prefix ' + partition + ' is over its request rate')
+
+    return granted
+
+# Achieved copy throughput, summed per route (source and destination bucket),
+# copy mode, size band and part size. The driver records lambda copies and the
+# copier records batch copies, the sums give the average bytes per second.
+class InMemoryCopyStatsBackend:
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, partition, size, seconds):
+        with self._lock:
+            count, total, elapsed = self._stats.get(partition, (0, 0, 0.0))
+            self._stats[partition] = (count + 1, total + size, elapsed + seconds)
+
+    def get(self, partitions):
+        with self._lock:
+            return {partition: self._stats[partition] for partition in partitions if partition in self._stats}
+
+class DynamoDBCopyStatsBackend:
+
+    # stats start over a week after the first sample, so they follow changes
+    # in throughput
+    TTL_IN_SECONDS = 7 * 24 * 3600
+
+    def __init__(self, table_name, endpoint_url=None):
+        self.table_name = table_name
+        self.client = boto3.client('dynamodb', endpoint_url=endpoint_url, config=presetConfig)
+
+    def record(self, partition, size, seconds):
+        self.client.update_item(
+            TableName=self.table_name,
+            Key={'Partition': {'S': partition}},
+            UpdateExpression='ADD #c :one, #b :bytes, #s :seconds SET #e = if_not_exists(#e, :expires)',
+            ExpressionAttributeNames={'#c': 'Count', '#b': 'Bytes', '#s': 'Seconds', '#e': 'ExpiresAt'},
+            ExpressionAttributeValues={
+                ':one': {'N': '1'},
+                ':bytes': {'N': str(size)},
+                ':seconds': {'N': str(seconds)},
+                ':expires': {'N': str(int(time.time()) + self.TTL_IN_SECONDS)}
+            }
+        )
+
+    def get(self, partitions):
+        if not partitions:
+            return {}
+
+        # unprocessed keys are treated as not sampled yet
+        items = self.client.batch_get_item(
+            RequestItems={self.table_name: {'Keys': [{'Partition': {'S': partition}} for partition in set(partitions)]}}
+        )['Responses'].get(self.table_name, [])
+
+        return {item['Partition']['S']: (int(item['Count']['N']), int(item['Bytes']['N']), float(item['Seconds']['N'])) for item in items}
+
+copy_stats_backend = None
+
+def get_copy_stats_backend():
+    global copy_stats_backend
+
+    if copy_stats_backend is None:
+        table_name = os.environ.get('COPY_STATS_TABLE_NAME', '')
+        if table_name:
+            copy_stats_backend = DynamoDBCopyStatsBackend(table_name, os.environ.get('COPY_STATS_ENDPOINT_URL') or None)
+        else:
+            copy_stats_backend = InMemoryCopyStatsBackend()
+
+    return copy_stats_backend
+
+def get_size_band(size):
+
+    # bands grow by a factor of 4
+    return size.bit_length() // 2
+
+def get_copy_stats_partition(source_bucket, destination_bucket, size, mode, part_size):
+
+    return source_bucket + '>' + destination_bucket + '#' + mode + '#' + str(get_size_band(size)) + '#' + str(part_size or 0)
+
+def record_copy_stats(source_bucket, destination_bucket, size, mode, part_size, seconds):
+
+    try:
+        get_copy_stats_backend().record(get_copy_stats_partition(source_bucket, destination_bucket, size, mode, part_size), size, seconds)
+    except ClientError as e:
+        logger.warning('copy stats not recorded: ' + str(e))
+
+# the region of a bucket does not change
+bucket_regions = {}
+
 def get_bucket_region(bucket):
 
+    if bucket in bucket_regions:
+        return bucket_regions[bucket]
+
     bucket_location_resp = s3client.get_bucket_location(
         Bucket=bucket
     )
-    bucket_region=bucket_location_resp['LocationConstraint']
+    # buckets in us-east-1 have no location constraint, EU is eu-west-1
+    bucket_region = {None: 'us-east-1', '': 'us-east-1', 'EU': 'eu-west-1'}.get(bucket_location_resp['LocationConstraint'], bucket_location_resp['LocationConstraint'])
 
     logger.info("bucket_name="+ bucket +",bucket_region=" + bucket_region)
 
+    bucket_regions[bucket] = bucket_region
     return bucket_region
 
+# requests to a bucket in another region than s3client are redirected by S3,
+# every call would take extra round trips. They are sent by a client of the
+# region of the bucket, with the same config.
+s3_clients = {}
+
+def get_s3_client(bucket):
+
+    region = get_bucket_region(bucket)
+    if region == s3client.meta.region_name:
+        return s3client
+
+    if region not in s3_clients:
+        s3_clients[region] = boto3.client('s3', region_name=region, config=presetConfig)
+
+    return s3_clients[region]
+
+# S3 Batch invokes the function again for every task that returned a
+# TemporaryFailure, e.g. while too many jobs are pending. Recent preflight
+# responses are kept by a warm function, so that the retries of a task do not
+# HEAD the object again. Permanent errors (the object or bucket is missing or
+# not readable) are cached as well. The storage class and NFC checks run on the
+# cached response.
+preflight_cache = None
+
+def get_preflight_cache():
+    global preflight_cache
+
+    if preflight_cache is None:
+        preflight_cache = PreflightCache(int(os.environ.get('PREFLIGHT_CACHE_SIZE', '4096')), float(os.environ.get('PREFLIGHT_CACHE_TTL_IN_SECONDS', '300')))
+
+    return preflight_cache
+
 def pre_flight_check(source_bucket, source_key):
     #preflight checks _read_
     logger.debug("preflight check start")
 
-    pre_flight_response = s3client.head_object(
-        Bucket=source_bucket,
-        Key=source_key
-    )
-    logger.debug('## PREFLIGHT_RESPONSE\r' + jsonpickle.encode(dict(**pre_flight_response)))
+    def head():
+        response = get_s3_client(source_bucket).head_object(
+            Bucket=source_bucket,
+            Key=source_key,
+            ChecksumMode='ENABLED'
+        )
+        logger.debug('## PREFLIGHT_RESPONSE\r' + jsonpickle.encode(dict(**response)))
+        return response
+
+    pre_flight_response = get_preflight_cache().get((source_bucket, source_key), head)
     logger.debug("preflight check end")
     return pre_flight_response
 
@@ -87,18 +304,187 @@ def check_if_supported_storage_class(source_key, pre_flight_response):
     if unicodedata.is_normalized('NFC', source_key) == False:
         raise UnsupportedTextFormatError( source_key + ' is not in Normalized Form C' )
 
-def submit_job(s3_batch_job_id, source_bucket, source_key, destination_bucket, size):
+# SIZE_CLASSES is a json list of bands, e.g.
+# [{"name": "small", "maxSizeInBytes": 5368709120, "shareIdentifierPrefix": "small"}, {"name": "large", "jobQueue": "<arn>"}]
+# the band without maxSizeInBytes takes everything above the others. jobQueue
+# defaults to JOB_QUEUE. Jobs sent to a job queue with a fair share scheduling
+# policy get a share identifier that starts with shareIdentifierPrefix, or the
+# name, the split between size classes is set by the weight factors of the
+# policy.
+def get_size_classes():
+
+    size_classes = json.loads(os.environ.get('SIZE_CLASSES') or '[]')
+    if not size_classes:
+        size_classes = [{'name': 'default'}]
+
+    return sorted(size_classes, key=lambda x: int(x['maxSizeInBytes']) if 'maxSizeInBytes' in x else float('inf'))
+
+def get_size_class(size):
+
+    size_classes = get_size_classes()
+    for size_class in size_classes:
+        if 'maxSizeInBytes' not in size_class or size <= int(size_class['maxSizeInBytes']):
+            return size_class
+
+    return size_classes[-1]
+
+def get_job_queue(size_class):
+    return size_class.get('jobQueue', os.environ['JOB_QUEUE'])
+
+# whether a job queue has a scheduling policy, by job queue. A fair share
+# queue rejects jobs without a share identifier.
+job_queue_policies = {}
+
+def has_scheduling_policy(job_queue):
+
+    if job_queue not in job_queue_policies:
+        job_queues = batchclient.describe_job_queues(jobQueues=[job_queue])['jobQueues']
+        job_queue_policies[job_queue] = bool(job_queues and job_queues[0].get('schedulingPolicyArn'))
+
+    return job_queue_policies[job_queue]
+
+def get_share_identifier(size_class, s3_batch_job_id):
+
+    # one share per S3 batch job in each size class, so that concurrent
+    # S3 batch jobs get a fair split of the queue. The prefix defaults to the
+    # name of the size class.
+    prefix = size_class.get('shareIdentifierPrefix') or size_class['name']
+    return re.sub('[^A-Za-z0-9]', '', prefix) + re.sub('[^A-Za-z0-9]', '', s3_batch_job_id)[:8]
+
+# Copy modes: 'lambda' is a CopyObject from the driver (up to 5GB), 'server' a
+# batch job with UploadPartCopy (JOB_DEFINITION) and 'stream' a batch job that
+# reads and uploads the bytes (JOB_DEFINITION_X_REGION).
+MAX_COPY_OBJECT_SIZE_IN_BYTES = 5 * 1024 ** 3
+
+def get_default_part_size():
+    return int(os.environ.get('COPY_PART_SIZE_IN_BYTES', '67108864'))
+
+def get_part_sizes():
+
+    part_sizes = [int(part_size) for part_size in os.environ.get('COPY_PART_SIZES_IN_BYTES', '').split(',') if part_size.strip()]
+    return part_sizes or [get_default_part_size()]
+
+def get_static_copy_mode(source_bucket, destination_bucket, size):
+
+    if size <= int(os.environ['MN_SIZE_FOR_BATCH_IN_BYTES']):
+        return 'lambda', None
+
+    mode = 'server' if get_bucket_region(destination_bucket) == get_bucket_region(source_bucket) else 'stream'
+    return mode, get_default_part_size()
+
+def get_copy_candidates(size):
+
+    # CopyObject copies up to 5GB, and a copy job for an object that fits in
+    # one part is all overhead
+    candidates = [('lambda', None)] if size <= MAX_COPY_OBJECT_SIZE_IN_BYTES else []
+    return candidates + [(mode, part_size) for mode in ['server', 'stream'] for part_size in get_part_sizes() if size > part_size]
+
+def can_explore(candidate, size):
+
+    # without samples a lambda copy is only tried when it finishes within the
+    # function timeout at LAMBDA_COPY_MIN_BYTES_PER_SECOND
+    if candidate[0] == 'lambda':
+        return size / float(os.environ.get('LAMBDA_COPY_MIN_BYTES_PER_SECOND', '10485760')) <= float(os.environ.get('LAMBDA_COPY_MAX_SECONDS', '240'))
+
+    return True
+
+# COPY_COST_PER_SECOND is a json object of the cost of each mode in $ per second
+# of copying, the defaults are a 128MB lambda and the Fargate Spot sizes of the
+# job definitions.
+def get_copy_costs():
+
+    costs = {'lambda': 0.0000021, 'server': 0.0000041, 'stream': 0.0000164}
+    costs.update({mode: float(cost) for mode, cost in json.loads(os.environ.get('COPY_COST_PER_SECOND') or '{}').items()})
+    return costs
+
+def estimate_copy(mode, size, stats):
+
+    _, total, seconds = stats
+    copy_seconds = size / (total / max(seconds, 0.001))
+
+    # lambda copies have to complete within the function timeout
+    if mode == 'lambda' and copy_seconds > float(os.environ.get('LAMBDA_COPY_MAX_SECONDS', '240')):
+        return None
+
+    # batch jobs are queued and a container is started before the copy
+    overhead = 0 if mode == 'lambda' else float(os.environ.get('COPY_BATCH_OVERHEAD_IN_SECONDS', '60'))
+
+    return copy_seconds + overhead, copy_seconds * get_copy_costs()[mode]
+
+# With COPY_MODE_SELECTION=adaptive the mode and part size are chosen from the
+# throughput observed for the route and size band. COPY_OBJECTIVE_WEIGHT goes
+# from 0 (fastest) to 1 (cheapest). Until COPY_STATS_MIN_SAMPLES copies of a
+# candidate were recorded the static rule is used, and COPY_EXPLORATION_RATE
+# of the copies try a feasible candidate without enough samples. The static
+# rule is also used when the stats cannot be read.
+def choose_copy_mode(source_bucket, destination_bucket, size):
+
+    if os.environ.get('COPY_MODE_SELECTION', 'static') != 'adaptive':
+        return get_static_copy_mode(source_bucket, destination_bucket, size)
+
+    candidates = get_copy_candidates(size)
+    partitions = {candidate: get_copy_stats_partition(source_bucket, destination_bucket, size, *candidate) for candidate in candidates}
+    try:
+        stats = get_copy_stats_backend().get(list(partitions.values()))
+    except (BotoCoreError, ClientError) as e:
+        logger.warning('copy stats not available: ' + str(e))
+        return get_static_copy_mode(source_bucket, destination_bucket, size)
+
+    min_samples = int(os.environ.get('COPY_STATS_MIN_SAMPLES', '5'))
+    sampled = {candidate: stats[partition] for candidate, partition in partitions.items() if partition in stats and stats[partition][0] >= min_samples}
+
+    unsampled = [candidate for candidate in candidates if candidate not in sampled and can_explore(candidate, size)]
+    if unsampled and random.random() < float(os.environ.get('COPY_EXPLORATION_RATE', '0.05')):
+        candidate = random.choice(unsampled)
+        logger.info('exploring copy mode ' + candidate[0] + ' part size ' + str(candidate[1]))
+        return candidate
+
+    estimates = {candidate: estimate_copy(candidate[0], size, s) for candidate, s in sampled.items()}
+    estimates = {candidate: estimate for candidate, estimate in estimates.items() if estimate is not None}
+    if not estimates:
+        return get_static_copy_mode(source_bucket, destination_bucket, size)
+
+    weight = float(os.environ.get('COPY_OBJECTIVE_WEIGHT', '0.5'))
+    fastest = max(min(estimate[0] for estimate in estimates.values()), 0.001)
+    cheapest = max(min(estimate[1] for estimate in estimates.values()), 0.000000001)
+
+    return min(estimates, key=lambda candidate: (1 - weight) * estimates[candidate][0] / fastest + weight * estimates[candidate][1] / cheapest)
+
+def submit_job(s3_batch_job_id, source_bucket, source_key, destination_bucket, size, mode=None, part_size=None):
 
     source_bucket_region = get_bucket_region(source_bucket)
 
-    job_definition = os.environ['JOB_DEFINITION'] if get_bucket_region(destination_bucket) == source_bucket_region else  os.environ['JOB_DEFINITION_X_REGION']
+    if mode is None:
+        mode = 'server' if get_bucket_region(destination_bucket) == source_bucket_region else 'stream'
+    job_definition = os.environ['JOB_DEFINITION'] if mode == 'server' else os.environ['JOB_DEFINITION_X_REGION']
+
+    environment = []
+    if part_size:
+        # the copier records its throughput under the same partition
+        environment.append({'name': 'PART_SIZE_IN_BYTES', 'value': str(part_size)})
+        environment.append({'name': 'COPY_STATS_PARTITION', 'value': get_copy_stats_partition(source_bucket, destination_bucket, size, mode, part_size)})
+    if os.environ.get('RATE_LIMIT_TABLE_NAME'):
+        # the copier takes a token for every part from the bucket of the prefix
+        rate = os.environ.get('RATE_LIMIT_REQUESTS_PER_SECOND', '3500')
+        environment.append({'name': 'RATE_LIMIT_PARTITION', 'value': get_rate_limit_partition(destination_bucket, source_key)})
+        environment.append({'name': 'RATE_LIMIT_REQUESTS_PER_SECOND', 'value': rate})
+        environment.append({'name': 'RATE_LIMIT_BURST', 'value': os.environ.get('RATE_LIMIT_BURST', rate)})
+        environment.append({'name': 'RATE_LIMIT_SHARDS', 'value': str(get_rate_limit_shards())})
+
+    overrides = {'containerOverrides': {'environment': environment}} if environment else {}
+
+    size_class = get_size_class(size)
+    scheduling = {}
+    if has_scheduling_policy(get_job_queue(size_class)):
+        scheduling['shareIdentifier'] = get_share_identifier(size_class, s3_batch_job_id)
 
     logger.debug("job submission start")
+    logger.debug("size class is " + size_class['name'])
 
     #submit job
     response = batchclient.submit_job(
         jobName="MediaSyncJob",
-        jobQueue=os.environ['JOB_QUEUE'],
+        jobQueue=get_job_queue(size_class),
         jobDefinition=job_definition,
         parameters={
             'SourceS3Uri': 's3://' + source_bucket + '/' + source_key,
@@ -111,8 +497,12 @@ def submit_job(s3_batch_job_id, source_bucket, source_key, destination_bucket, s
             'SourceBucket': source_bucket,
             'DestinationBucket': destination_bucket,
             'Key': source_key,
-            'Size': str(size)
-        }
+            'Size': str(size),
+            'SizeClass': size_class['name'],
+            'CopyMode': mode
+        },
+        **scheduling,
+        **overrides
     )
 
     logger.debug('## BATCH_RESPONSE\r' + jsonpickle.encode(dict(**response)))
@@ -123,18 +513,27 @@ def submit_job(s3_batch_job_id, source_bucket, source_key, destination_bucket, s
     return job_id
 
 
-def in_place_copy(source_bucket, source_key, destination_bucket):
+def get_checksum_algorithm():
+
+    return os.environ.get('CHECKSUM_ALGORITHM', 'SHA256')
+
+def in_place_copy(source_bucket, source_key, destination_bucket, source_checksum=None):
+
+    algorithm = get_checksum_algorithm()
 
     copy_response= {}
-    copy_response = s3client.copy_object(
+    copy_response = get_s3_client(destination_bucket).copy_object(
         Bucket=destination_bucket,
         CopySource={'Bucket': source_bucket,'Key': source_key},
-        Key=source_key
+        Key=source_key,
+        ChecksumAlgorithm=algorithm
     )
 
     logger.debug('## COPY_RESPONSE\r' + jsonpickle.encode(dict(**copy_response)))
 
-def is_can_submit_jobs():
+    return verify_checksum(algorithm, source_checksum, copy_response['CopyObjectResult'].get('Checksum' + algorithm))
+
+def is_can_submit_jobs(job_queue=None):
 
     # we don't have a good way of checking how many pending jobs as yet
     # without having to build an API
@@ -144,7 +543,7 @@ def is_can_submit_jobs():
     if (disable_pending_jobs_test == 'False'):
         ##check how many jobs are pending
         listjobs = batchclient.list_jobs(
-            jobQueue=os.environ['JOB_QUEUE'],
+            jobQueue=job_queue or os.environ['JOB_QUEUE'],
             jobStatus='RUNNABLE',
             maxResults=int(os.environ['MAX_NUMBER_OF_PENDING_JOBS'])
         )
@@ -156,9 +555,20 @@ def is_can_submit_jobs():
 
     return True
 
+# S3 Batch writes the result string of every task to the completion report.
+# It is a json object with the path the copy took, the size and the time of the
+# invocation, so that reports can be aggregated (see scripts/analyze_report.py).
+def get_result_string(message, **fields):
+
+    result = {'Message': message}
+    result.update({name: value for name, value in fields.items() if value is not None})
+
+    return json.dumps(result, separators=(',', ':'))
+
 def lambda_handler(event, _):
 
     logger.debug('## EVENT\r' + jsonpickle.encode(dict(**event)))
+    started = time.time()
 
     destination_bucket=os.environ['DESTINATION_BUCKET_NAME']
 
@@ -175,8 +585,12 @@ def lambda_handler(event, _):
     # Prepare result code and string
     result_code = None
     result_string = None
-
-    minsizeforbatch = int(os.environ['MN_SIZE_FOR_BATCH_IN_BYTES'])
+    size = None
+    mode = None
+    error_code = None
+    batch_job_id = None
+    url = None
+    checksum = None
 
     # Copy object to new bucket with new key name
     try:
@@ -186,26 +600,41 @@ def lambda_handler(event, _):
         check_if_deleted(source_key, pre_flight_response)
         size = pre_flight_response['ContentLength']
 
-        if (size > minsizeforbatch):
+        mode, part_size = choose_copy_mode(source_bucket, destination_bucket, size)
+
+        if (mode != 'lambda'):
 
             check_if_supported_storage_class(source_key, pre_flight_response)
 
-            if (is_can_submit_jobs() == False):
+            if (is_can_submit_jobs(get_job_queue(get_size_class(size))) == False):
 
                 logger.info("too many jobs pending. returning slowdown")
                 result_code = 'TemporaryFailure'
                 result_string = 'Retry request to batch due to too many pending jobs.'
 
+            elif (acquire_prefix_tokens(destination_bucket, source_key) == False):
+
+                result_code = 'TemporaryFailure'
+                result_string = 'Retry request to s3 due to prefix rate limit.'
+
             else:
 
-                batch_job_id = submit_job(s3_batch_job_id, source_bucket, source_key, destination_bucket, size)
+                batch_job_id = submit_job(s3_batch_job_id, source_bucket, source_key, destination_bucket, size, mode, part_size)
                 result_code = 'Succeeded'
-                result_string = 'https://console.aws.amazon.com/batch/v2/home?region=' + os.environ['AWS_REGION'] + '#jobs/detail/'+ batch_job_id
+                result_string = 'Copy job submitted.'
+                url = 'https://console.aws.amazon.com/batch/v2/home?region=' + os.environ['AWS_REGION'] + '#jobs/detail/'+ batch_job_id
+
+        elif (acquire_prefix_tokens(destination_bucket, source_key) == False):
+
+            result_code = 'TemporaryFailure'
+            result_string = 'Retry request to s3 due to prefix rate limit.'
 
         else:
             # <5GB
-            in_place_copy(source_bucket, source_key, destination_bucket)
-            result_string = 'Lambda copy complete'
+            copy_started = time.time()
+            checksum = in_place_copy(source_bucket, source_key, destination_bucket, pre_flight_response.get('Checksum' + get_checksum_algorithm()))
+            record_copy_stats(source_bucket, destination_bucket, size, mode, None, time.time() - copy_started)
+            result_string = 'Lambda copy complete.'
             result_code = 'Succeeded'
 
 
@@ -232,14 +661,21 @@ def lambda_handler(event, _):
             result_string = 'Retry request to s3 due to throttling.'
         else:
             result_code = 'PermanentFailure'
-            result_string = '{}: {}'.format(error_code, error_message)
+            result_string = error_message
 
     except Exception as e:
         # Catch all exceptions to permanently fail the task
         result_code = 'PermanentFailure'
-        result_string = 'Exception: {}'.format(e)
+        result_string = str(e)
+        error_code = type(e).__name__
 
     finally:
+        # only retries use the cached response
+        if result_code == 'Succeeded':
+            get_preflight_cache().discard((source_bucket, source_key))
+
+        result_string = get_result_string(result_string, Path=mode, Bytes=size, Seconds=round(time.time() - started, 3),
+                                          Code=error_code, JobId=batch_job_id, Url=url, Checksum=checksum)
         results.append({
             'taskId': task_id,
             'resultCode': result_code,
@@ -0,0 +1 @@
+../../copier/prefix_tokens.py
\ No newline at end of file
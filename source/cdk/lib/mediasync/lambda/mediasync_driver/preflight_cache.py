@@ -0,0 +1 @@
+../../../common/preflight_cache.py
\ No newline at end of file
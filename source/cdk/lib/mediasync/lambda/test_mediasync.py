@@ -15,7 +15,7 @@ import os
 import unittest
 import boto3
 import mock
-from moto import mock_s3, mock_batch, mock_iam, mock_ec2
+from moto import mock_s3, mock_batch, mock_iam, mock_ec2, mock_dynamodb
 from botocore.exceptions import ClientError
 
 S3_BUCKET_NAME = 'buckettestname'
@@ -109,7 +109,19 @@ class TestMediaSyncLambdaFunction(unittest.TestCase):
             file_content = get_bucket_region(S3_BUCKET_NAME)
             print(file_content)
             self.assertNotEqual(file_content, DEFAULT_REGION)
-    
+
+    def test_get_s3_client_success(self):
+        with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No', 'LogLevel': 'INFO', 'SOLUTION_IDENTIFIER': awsSolutionId}):
+            from mediasync_driver import app
+            self.s3.create_bucket(Bucket='localtestbucketname')
+            with mock.patch.object(app, 's3_clients', {}):
+                # buckets in the region of s3client use it, others a client of their region
+                self.assertIs(app.get_s3_client('localtestbucketname'), app.s3client)
+                client = app.get_s3_client(S3_BUCKET_NAME)
+                self.assertEqual(client.meta.region_name, 'eu-west-1')
+                self.assertIs(app.get_s3_client(DESTINATION_S3_BUCKET_NAME), client)
+                self.assertEqual(app.bucket_regions['localtestbucketname'], 'us-east-1')
+
     def test_pre_flight_check_success(self):
         with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No'}):
             from mediasync_driver.app import pre_flight_check
@@ -152,7 +164,31 @@ class TestMediaSyncLambdaFunction(unittest.TestCase):
             from mediasync_driver.app import submit_job
             file_content = submit_job('1', S3_BUCKET_NAME, S3_TEST_FILE_KEY, DESTINATION_S3_BUCKET_NAME, 1000)
             self.assertEqual(type(file_content), str)
-    
+
+    def test_submit_job_rate_limit_partition(self):
+        with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No', 'JOB_DEFINITION': self.job_definition_arn,'JOB_DEFINITION_X_REGION': self.job_definition_arn, 'JOB_QUEUE': self.job_q_arn, 'DESTINATION_BUCKET_NAME': DESTINATION_S3_BUCKET_NAME, 'RATE_LIMIT_TABLE_NAME': 'ratelimit', 'RATE_LIMIT_REQUESTS_PER_SECOND': '3500', 'LogLevel': 'INFO', 'SOLUTION_IDENTIFIER': awsSolutionId}):
+            from mediasync_driver import app
+            with mock.patch.object(app.batchclient, 'submit_job', return_value={'jobId': 'job'}) as submit_job:
+                app.submit_job('1', S3_BUCKET_NAME, 'media/' + S3_TEST_FILE_KEY, DESTINATION_S3_BUCKET_NAME, 1000)
+            # the copier takes a token for every part from the bucket of the prefix
+            environment = {e['name']: e['value'] for e in submit_job.call_args.kwargs['containerOverrides']['environment']}
+            self.assertEqual(environment, {'RATE_LIMIT_PARTITION': DESTINATION_S3_BUCKET_NAME + '/media', 'RATE_LIMIT_REQUESTS_PER_SECOND': '3500', 'RATE_LIMIT_BURST': '3500', 'RATE_LIMIT_SHARDS': '4'})
+
+    def test_submit_job_share_identifier(self):
+        size_classes = '[{"name": "small", "maxSizeInBytes": 5000, "shareIdentifierPrefix": "small"}, {"name": "x-large"}]'
+        with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No', 'JOB_DEFINITION': self.job_definition_arn,'JOB_DEFINITION_X_REGION': self.job_definition_arn, 'JOB_QUEUE': 'fair-share-queue', 'DESTINATION_BUCKET_NAME': DESTINATION_S3_BUCKET_NAME, 'SIZE_CLASSES': size_classes, 'LogLevel': 'INFO', 'SOLUTION_IDENTIFIER': awsSolutionId}):
+            from mediasync_driver import app
+            app.job_queue_policies.clear()
+            with mock.patch.object(app.batchclient, 'describe_job_queues', return_value={'jobQueues': [{'schedulingPolicyArn': 'policy'}]}) as describe_job_queues, \
+                    mock.patch.object(app.batchclient, 'submit_job', return_value={'jobId': 'job'}) as submit_job:
+                app.submit_job('9357a3a7-5e34', S3_BUCKET_NAME, S3_TEST_FILE_KEY, DESTINATION_S3_BUCKET_NAME, 1000)
+                self.assertEqual(submit_job.call_args.kwargs['shareIdentifier'], 'small9357a3a7')
+                # a fair share queue needs a share identifier for a size class without a prefix too
+                app.submit_job('9357a3a7-5e34', S3_BUCKET_NAME, S3_TEST_FILE_KEY, DESTINATION_S3_BUCKET_NAME, 10000)
+                self.assertEqual(submit_job.call_args.kwargs['shareIdentifier'], 'xlarge9357a3a7')
+                self.assertEqual(describe_job_queues.call_count, 1)
+            app.job_queue_policies.clear()
+
     def test_submit_job_error(self):
          with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No', 'JOB_DEFINITION': self.job_definition_arn,'JOB_DEFINITION_X_REGION': self.job_definition_arn, 'JOB_QUEUE': self.job_q_arn, 'DESTINATION_BUCKET_NAME': DESTINATION_S3_BUCKET_NAME, 'DISABLE_PENDING_JOBS_CHECK': "true", 'MAX_NUMBER_OF_PENDING_JOBS': "96", 'MN_SIZE_FOR_BATCH_IN_BYTES': "524288000", 'LogLevel': 'INFO', 'SOLUTION_IDENTIFIER': awsSolutionId}):
             from mediasync_driver.app import submit_job
@@ -162,7 +198,13 @@ class TestMediaSyncLambdaFunction(unittest.TestCase):
         with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No'}):
             from mediasync_driver.app import in_place_copy
             file_content = in_place_copy(S3_BUCKET_NAME, S3_TEST_FILE_KEY, DESTINATION_S3_BUCKET_NAME)
-            self.assertIsNone(file_content)
+            self.assertRegex(file_content, '^ChecksumSHA256 [A-Za-z0-9+/=]+$')
+
+    def test_in_place_copy_verified(self):
+        with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No'}):
+            from mediasync_driver.app import in_place_copy
+            checksum = in_place_copy(S3_BUCKET_NAME, S3_TEST_FILE_KEY, DESTINATION_S3_BUCKET_NAME).split(' ')[1]
+            self.assertEqual(in_place_copy(S3_BUCKET_NAME, S3_TEST_FILE_KEY, DESTINATION_S3_BUCKET_NAME, checksum), 'ChecksumSHA256 ' + checksum + ' verified')
 
     def test_in_place_copy_error(self):
         with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No'}):
@@ -186,11 +228,149 @@ class TestMediaSyncLambdaFunction(unittest.TestCase):
             event = {'invocationId': invocationId, 'job': {'id': '9357a3a7-5e34-4fa9-a1df-e1a4299b90b7'}, 'tasks': [{'taskId': taskId, 's3BucketArn': 'arn:aws:s3:::buckettestname', 's3Key': 'BigBunnySample.mp4', 's3VersionId': None}], 'invocationSchemaVersion': '1.0'}
             file_content = lambda_handler(event, '_')
             self.assertEqual(file_content.get('results')[0].get('resultCode'), 'Succeeded')
+            result_string = json.loads(file_content['results'][0]['resultString'])
+            self.assertEqual((result_string['Message'], result_string['Path']), ('Lambda copy complete.', 'lambda'))
+            self.assertIn('Seconds', result_string)
 
     def test_lambda_handler_error(self):
         with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No', 'JOB_DEFINITION': self.job_definition_arn,'JOB_DEFINITION_X_REGION': self.job_definition_arn, 'JOB_QUEUE': 'self.job_q_arn_three', 'DESTINATION_BUCKET_NAME': DESTINATION_S3_BUCKET_NAME, 'DISABLE_PENDING_JOBS_CHECK': 'False', 'MAX_NUMBER_OF_PENDING_JOBS': "-1", 'MN_SIZE_FOR_BATCH_IN_BYTES': "524288000", 'LogLevel': 'INFO', 'SOLUTION_IDENTIFIER': awsSolutionId}):
             from mediasync_driver.app import lambda_handler
             event = {'invocationId': invocationId, 'job': {'id': '9357a3a7-5e34-4fa9-a1df-e1a4299b90b7'}, 'tasks': [{'taskId': taskId, 's3BucketArn': 'arn:aws:s3:::buckettestname', 's3Key': 'BigBunnySamp.mp4', 's3VersionId': None}], 'invocationSchemaVersion': '1.0'}
             file_content = lambda_handler(event, '_')
-            self.assertEqual(file_content, {'invocationSchemaVersion': '1.0', 'treatMissingKeysAs': 'PermanentFailure', 'invocationId': invocationId, 'results': [{'taskId': taskId, 'resultCode': 'PermanentFailure', 'resultString': '404: Not Found'}]})
+            result_string = json.loads(file_content['results'][0].pop('resultString'))
+            self.assertEqual(file_content, {'invocationSchemaVersion': '1.0', 'treatMissingKeysAs': 'PermanentFailure', 'invocationId': invocationId, 'results': [{'taskId': taskId, 'resultCode': 'PermanentFailure'}]})
+            self.assertEqual({name: result_string[name] for name in ['Message', 'Code']}, {'Message': 'Not Found', 'Code': '404'})
+
+    def test_get_rate_limit_partition_success(self):
+        with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No', 'RATE_LIMIT_PREFIX_DEPTH': '2', 'LogLevel': 'INFO', 'SOLUTION_IDENTIFIER': awsSolutionId}):
+            from mediasync_driver.app import get_rate_limit_partition
+            self.assertEqual(get_rate_limit_partition(DESTINATION_S3_BUCKET_NAME, 'a/b/c/d.mp4'), DESTINATION_S3_BUCKET_NAME + '/a/b')
+            self.assertEqual(get_rate_limit_partition(DESTINATION_S3_BUCKET_NAME, S3_TEST_FILE_KEY), DESTINATION_S3_BUCKET_NAME + '/')
+
+    def test_in_memory_token_bucket_success(self):
+        with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No', 'LogLevel': 'INFO', 'SOLUTION_IDENTIFIER': awsSolutionId}):
+            from mediasync_driver.app import InMemoryTokenBucketBackend
+            backend = InMemoryTokenBucketBackend()
+            self.assertTrue(backend.take('bucket/a', 64, 100, 100, now=0))
+            self.assertFalse(backend.take('bucket/a', 64, 100, 100, now=0))
+            # other prefixes are not affected
+            self.assertTrue(backend.take('bucket/b', 64, 100, 100, now=0))
+            # refilled at 100 tokens/s
+            self.assertTrue(backend.take('bucket/a', 64, 100, 100, now=1))
+
+    @mock_dynamodb
+    def test_dynamodb_token_bucket_success(self):
+        with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No', 'LogLevel': 'INFO', 'SOLUTION_IDENTIFIER': awsSolutionId}):
+            from mediasync_driver.app import DynamoDBTokenBucketBackend
+            boto3.client('dynamodb', region_name=DEFAULT_REGION).create_table(
+                TableName='ratelimit',
+                KeySchema=[{'AttributeName': 'Partition', 'KeyType': 'HASH'}],
+                AttributeDefinitions=[{'AttributeName': 'Partition', 'AttributeType': 'S'}],
+                BillingMode='PAY_PER_REQUEST'
+            )
+            backend = DynamoDBTokenBucketBackend('ratelimit')
+            self.assertTrue(backend.take('bucket/a', 64, 100, 100, now=0))
+            # a second backend sees the same bucket
+            self.assertFalse(DynamoDBTokenBucketBackend('ratelimit').take('bucket/a', 64, 100, 100, now=0))
+            self.assertTrue(backend.take('bucket/a', 64, 100, 100, now=1))
 
+    def test_lambda_handler_rate_limited(self):
+        with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No', 'JOB_DEFINITION': self.job_definition_arn,'JOB_DEFINITION_X_REGION': self.job_definition_arn, 'JOB_QUEUE': self.job_q_arn, 'DESTINATION_BUCKET_NAME': DESTINATION_S3_BUCKET_NAME, 'DISABLE_PENDING_JOBS_CHECK': 'True', 'MAX_NUMBER_OF_PENDING_JOBS': "96", 'MN_SIZE_FOR_BATCH_IN_BYTES': "524288000", 'RATE_LIMIT_BURST': '0', 'LogLevel': 'INFO', 'SOLUTION_IDENTIFIER': awsSolutionId}):
+            from mediasync_driver.app import lambda_handler
+            event = {'invocationId': invocationId, 'job': {'id': '9357a3a7-5e34-4fa9-a1df-e1a4299b90b7'}, 'tasks': [{'taskId': taskId, 's3BucketArn': 'arn:aws:s3:::buckettestname', 's3Key': 'BigBunnySample.mp4', 's3VersionId': None}], 'invocationSchemaVersion': '1.0'}
+            file_content = lambda_handler(event, '_')
+            self.assertEqual(file_content.get('results')[0].get('resultCode'), 'TemporaryFailure')
+
+    def test_choose_copy_mode_success(self):
+        with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No', 'MN_SIZE_FOR_BATCH_IN_BYTES': "524288000", 'COPY_PART_SIZES_IN_BYTES': '16777216,67108864', 'COPY_EXPLORATION_RATE': '0', 'LogLevel': 'INFO', 'SOLUTION_IDENTIFIER': awsSolutionId}):
+            from mediasync_driver import app
+            size = 1024 ** 3
+            with mock.patch.object(app, 'copy_stats_backend', app.InMemoryCopyStatsBackend()) as backend:
+                # the static rule until there are enough samples
+                self.assertEqual(app.choose_copy_mode(S3_BUCKET_NAME, DESTINATION_S3_BUCKET_NAME, 1000), ('lambda', None))
+                with mock.patch.dict(os.environ, {'COPY_MODE_SELECTION': 'adaptive'}):
+                    self.assertEqual(app.choose_copy_mode(S3_BUCKET_NAME, DESTINATION_S3_BUCKET_NAME, size), ('server', 67108864))
+
+                    # lambda at 100MB/s, server side copies at 150MB/s with 16MB parts
+                    for _ in range(5):
+                        backend.record(app.get_copy_stats_partition(S3_BUCKET_NAME, DESTINATION_S3_BUCKET_NAME, size, 'lambda', None), size, size / 100e6)
+                        backend.record(app.get_copy_stats_partition(S3_BUCKET_NAME, DESTINATION_S3_BUCKET_NAME, size, 'server', 16777216), size, size / 150e6)
+                    with mock.patch.dict(os.environ, {'COPY_OBJECTIVE_WEIGHT': '1'}):
+                        self.assertEqual(app.choose_copy_mode(S3_BUCKET_NAME, DESTINATION_S3_BUCKET_NAME, size), ('lambda', None))
+                    with mock.patch.dict(os.environ, {'COPY_OBJECTIVE_WEIGHT': '0', 'COPY_BATCH_OVERHEAD_IN_SECONDS': '0'}):
+                        self.assertEqual(app.choose_copy_mode(S3_BUCKET_NAME, DESTINATION_S3_BUCKET_NAME, size), ('server', 16777216))
+                    # too slow to finish in the lambda timeout
+                    with mock.patch.dict(os.environ, {'COPY_OBJECTIVE_WEIGHT': '1', 'LAMBDA_COPY_MAX_SECONDS': '10'}):
+                        self.assertEqual(app.choose_copy_mode(S3_BUCKET_NAME, DESTINATION_S3_BUCKET_NAME, size), ('server', 16777216))
+                    # other size bands have no samples
+                    self.assertEqual(app.choose_copy_mode(S3_BUCKET_NAME, DESTINATION_S3_BUCKET_NAME, size * 8), ('server', 67108864))
+
+    def test_choose_copy_mode_explore(self):
+        with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No', 'MN_SIZE_FOR_BATCH_IN_BYTES': "524288000", 'COPY_PART_SIZES_IN_BYTES': '16777216,67108864', 'COPY_MODE_SELECTION': 'adaptive', 'COPY_EXPLORATION_RATE': '1', 'LogLevel': 'INFO', 'SOLUTION_IDENTIFIER': awsSolutionId}):
+            from mediasync_driver import app
+            with mock.patch.object(app, 'copy_stats_backend', app.InMemoryCopyStatsBackend()):
+                # objects that fit in a part are not sent to batch
+                self.assertEqual(app.get_copy_candidates(32 * 1024 * 1024), [('lambda', None), ('server', 16777216), ('stream', 16777216)])
+                self.assertEqual(app.get_copy_candidates(1000), [('lambda', None)])
+                # and objects over 5GB not to lambda
+                self.assertNotIn(('lambda', None), app.get_copy_candidates(6 * 1024 ** 3))
+                # lambda is not tried without samples when it could time out
+                for _ in range(20):
+                    self.assertNotEqual(app.choose_copy_mode(S3_BUCKET_NAME, DESTINATION_S3_BUCKET_NAME, 4 * 1024 ** 3)[0], 'lambda')
+                with mock.patch.dict(os.environ, {'LAMBDA_COPY_MIN_BYTES_PER_SECOND': '1e9'}):
+                    self.assertIn(('lambda', None), set(app.choose_copy_mode(S3_BUCKET_NAME, DESTINATION_S3_BUCKET_NAME, 4 * 1024 ** 3) for _ in range(50)))
+
+    def test_choose_copy_mode_stats_error(self):
+        with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No', 'MN_SIZE_FOR_BATCH_IN_BYTES': "524288000", 'COPY_MODE_SELECTION': 'adaptive', 'LogLevel': 'INFO', 'SOLUTION_IDENTIFIER': awsSolutionId}):
+            from mediasync_driver import app
+            backend = mock.Mock()
+            backend.get.side_effect = ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException', 'Message': 'Throttled'}}, 'BatchGetItem')
+            with mock.patch.object(app, 'copy_stats_backend', backend):
+                # the static rule
+                self.assertEqual(app.choose_copy_mode(S3_BUCKET_NAME, DESTINATION_S3_BUCKET_NAME, 1000), ('lambda', None))
+                self.assertEqual(app.choose_copy_mode(S3_BUCKET_NAME, DESTINATION_S3_BUCKET_NAME, 1024 ** 3), ('server', 67108864))
+
+    @mock_dynamodb
+    def test_dynamodb_copy_stats_success(self):
+        with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No', 'LogLevel': 'INFO', 'SOLUTION_IDENTIFIER': awsSolutionId}):
+            from mediasync_driver.app import DynamoDBCopyStatsBackend
+            boto3.client('dynamodb', region_name=DEFAULT_REGION).create_table(
+                TableName='copystats',
+                KeySchema=[{'AttributeName': 'Partition', 'KeyType': 'HASH'}],
+                AttributeDefinitions=[{'AttributeName': 'Partition', 'AttributeType': 'S'}],
+                BillingMode='PAY_PER_REQUEST'
+            )
+            backend = DynamoDBCopyStatsBackend('copystats')
+            backend.record('a>b#lambda#15#0', 1000, 2.0)
+            backend.record('a>b#lambda#15#0', 3000, 1.5)
+            self.assertEqual(backend.get(['a>b#lambda#15#0', 'a>b#server#15#0']), {'a>b#lambda#15#0': (2, 4000, 3.5)})
+
+    def test_submit_job_part_size_success(self):
+        with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No', 'JOB_DEFINITION': self.job_definition_arn,'JOB_DEFINITION_X_REGION': self.job_definition_arn, 'JOB_QUEUE': self.job_q_arn, 'LogLevel': 'INFO', 'SOLUTION_IDENTIFIER': awsSolutionId}):
+            from mediasync_driver import app
+            with mock.patch.object(app.batchclient, 'submit_job', wraps=app.batchclient.submit_job) as batch_submit_job:
+                self.assertEqual(type(app.submit_job('1', S3_BUCKET_NAME, S3_TEST_FILE_KEY, DESTINATION_S3_BUCKET_NAME, 1000, 'stream', 16777216)), str)
+            kwargs = batch_submit_job.call_args.kwargs
+            self.assertEqual(kwargs['tags']['CopyMode'], 'stream')
+            self.assertEqual(kwargs['containerOverrides']['environment'][0], {'name': 'PART_SIZE_IN_BYTES', 'value': '16777216'})
+
+    def test_get_size_class_success(self):
+        size_classes = '[{"name": "large", "shareIdentifierPrefix": "large"}, {"name": "small", "maxSizeInBytes": 1000, "shareIdentifierPrefix": "small"}]'
+        with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No', 'SIZE_CLASSES': size_classes, 'LogLevel': 'INFO', 'SOLUTION_IDENTIFIER': awsSolutionId}):
+            from mediasync_driver.app import get_size_class, get_share_identifier
+            self.assertEqual(get_size_class(1000)['name'], 'small')
+            self.assertEqual(get_size_class(1001)['name'], 'large')
+            self.assertEqual(get_share_identifier(get_size_class(10), '9357a3a7-5e34-4fa9-a1df-e1a4299b90b7'), 'small9357a3a7')
+
+    def test_get_size_class_default(self):
+        with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No', 'SIZE_CLASSES': '', 'LogLevel': 'INFO', 'SOLUTION_IDENTIFIER': awsSolutionId}):
+            from mediasync_driver.app import get_size_class
+            self.assertEqual(get_size_class(1000), {'name': 'default'})
+
+    def test_submit_job_size_class_queue(self):
+        size_classes = '[{"name": "small", "maxSizeInBytes": 5000, "jobQueue": "%s"}, {"name": "large", "jobQueue": "unknown-queue"}]' % self.job_q_arn
+        with mock.patch.dict(os.environ, {'SendAnonymizedMetric': 'No', 'JOB_DEFINITION': self.job_definition_arn,'JOB_DEFINITION_X_REGION': self.job_definition_arn, 'JOB_QUEUE': 'unknown-queue', 'SIZE_CLASSES': size_classes, 'LogLevel': 'INFO', 'SOLUTION_IDENTIFIER': awsSolutionId}):
+            from mediasync_driver.app import submit_job
+            file_content = submit_job('1', S3_BUCKET_NAME, S3_TEST_FILE_KEY, DESTINATION_S3_BUCKET_NAME, 1000)
+            self.assertEqual(type(file_content), str)
+            self.assertRaises(ClientError, submit_job, '1', S3_BUCKET_NAME, S3_TEST_FILE_KEY, DESTINATION_S3_BUCKET_NAME, 10000)
@@ -18,7 +18,9 @@ import * as logs from "aws-cdk-lib/aws-logs";
 import * as lambda from "aws-cdk-lib/aws-lambda";
 import * as ec2 from "aws-cdk-lib/aws-ec2";
 import * as batch from "aws-cdk-lib/aws-batch";
+import * as dynamodb from "aws-cdk-lib/aws-dynamodb";
 import { RemovalPolicy } from "aws-cdk-lib";
+import * as fs from "fs";
 
 export class MediaSyncStack extends cdk.Stack {
   constructor(scope: Construct, id: string, props?: cdk.StackProps) {
@@ -219,7 +221,7 @@ export class MediaSyncStack extends cdk.Stack {
         type: "MANAGED",
         serviceRole: batchServiceRole.roleArn,
         computeResources: {
-          maxvCpus: 48, // 48x 64 == 3072 < 3500 (number of concurrent PUT requests per prefix.)
+          maxvCpus: 256, // copy jobs take a token per part from RateLimitTable, 3500 PUT/s per destination prefix
           type: "FARGATE_SPOT",
           subnets: vpc.publicSubnets.map((x) => x.subnetId),
           securityGroupIds: [securityGroup.securityGroupId],
@@ -227,8 +229,28 @@ export class MediaSyncStack extends cdk.Stack {
       }
     );
 
+    // Fair share between size classes: small objects keep flowing while multi-TB
+    // objects are copied. A lower weight factor gets a larger share. Every S3
+    // Batch job has its own share in each size class (see SIZE_CLASSES), so the
+    // weights and not scheduling priorities order the size classes.
+    const schedulingPolicy = new batch.CfnSchedulingPolicy(
+      this,
+      "MediaSyncSchedulingPolicy",
+      {
+        fairsharePolicy: {
+          shareDecaySeconds: 300,
+          shareDistribution: [
+            { shareIdentifier: "small*", weightFactor: 0.5 },
+            { shareIdentifier: "medium*", weightFactor: 1 },
+            { shareIdentifier: "large*", weightFactor: 2 },
+          ],
+        },
+      }
+    );
+
     const jobQueue = new batch.CfnJobQueue(this, "MediaSyncJobQueue", {
       priority: 1,
+      schedulingPolicyArn: schedulingPolicy.attrArn,
       computeEnvironmentOrder: [
         {
           order: 1,
@@ -238,12 +260,28 @@ export class MediaSyncStack extends cdk.Stack {
       ],
     });
 
+    // Token buckets shared by concurrent driver invocations and copy jobs, RATE_LIMIT_SHARDS items per destination prefix and window
+    const rateLimitTable = new dynamodb.CfnTable(this, "RateLimitTable", {
+      billingMode: "PAY_PER_REQUEST",
+      keySchema: [{ attributeName: "Partition", keyType: "HASH" }],
+      attributeDefinitions: [{ attributeName: "Partition", attributeType: "S" }],
+      timeToLiveSpecification: { attributeName: "ExpiresAt", enabled: true },
+    });
+
+    // Copy throughput per route, copy mode, size band and part size, recorded by the driver and the copier
+    const copyStatsTable = new dynamodb.CfnTable(this, "CopyStatsTable", {
+      billingMode: "PAY_PER_REQUEST",
+      keySchema: [{ attributeName: "Partition", keyType: "HASH" }],
+      attributeDefinitions: [{ attributeName: "Partition", attributeType: "S" }],
+      timeToLiveSpecification: { attributeName: "ExpiresAt", enabled: true },
+    });
+
     const batchAccessPolicy = new iam.ManagedPolicy(this, "BatchAccessPolicy", {
       statements: [
         new iam.PolicyStatement({
           sid: "batchList",
           effect: iam.Effect.ALLOW,
-          actions: ["batch:ListJobs", "batch:TagResource"],
+          actions: ["batch:ListJobs", "batch:TagResource", "batch:DescribeJobQueues"],
           resources: ["*"],
         }),
         new iam.PolicyStatement({
@@ -292,6 +330,18 @@ export class MediaSyncStack extends cdk.Stack {
           ],
           resources: ["*"],
         }),
+        new iam.PolicyStatement({
+          sid: "dynamodb",
+          effect: iam.Effect.ALLOW,
+          actions: ["dynamodb:GetItem", "dynamodb:PutItem"],
+          resources: [rateLimitTable.attrArn],
+        }),
+        new iam.PolicyStatement({
+          sid: "dynamodbstats",
+          effect: iam.Effect.ALLOW,
+          actions: ["dynamodb:BatchGetItem", "dynamodb:UpdateItem"],
+          resources: [copyStatsTable.attrArn],
+        }),
       ],
     });
 
@@ -324,6 +374,7 @@ export class MediaSyncStack extends cdk.Stack {
             "s3:GetObjectTagging",
             "s3:GetObjectVersionTagging",
             "s3:ListBucket",
+            "s3:ListBucketMultipartUploads",
           ],
         }),
         new iam.PolicyStatement({
@@ -357,6 +408,16 @@ export class MediaSyncStack extends cdk.Stack {
             "kms:DescribeKey",
           ],
         }),
+        new iam.PolicyStatement({
+          resources: [copyStatsTable.attrArn],
+          effect: iam.Effect.ALLOW,
+          actions: ["dynamodb:UpdateItem"],
+        }),
+        new iam.PolicyStatement({
+          resources: [rateLimitTable.attrArn],
+          effect: iam.Effect.ALLOW,
+          actions: ["dynamodb:GetItem", "dynamodb:PutItem"],
+        }),
       ],
     });
     jobRolePolicy.attachToRole(jobRole);
@@ -387,6 +448,12 @@ export class MediaSyncStack extends cdk.Stack {
             "Ref::Size",
             "Ref::SourceBucketRegion",
           ],
+          environment: [
+            // tagged on the destination, same tags as the fixity utility
+            { name: "CHECKSUMS", value: "md5,sha1,xxhash" },
+            { name: "COPY_STATS_TABLE_NAME", value: copyStatsTable.ref },
+            { name: "RATE_LIMIT_TABLE_NAME", value: rateLimitTable.ref },
+          ],
           executionRoleArn: executionRole.roleArn,
           jobRoleArn: jobRole.roleArn,
           fargatePlatformConfiguration: {
@@ -407,7 +474,7 @@ export class MediaSyncStack extends cdk.Stack {
           ],
         },
         retryStrategy: {
-          attempts: 1,
+          attempts: 3, // interrupted copies resume from the last completed part
         },
       }
     );
@@ -427,6 +494,10 @@ export class MediaSyncStack extends cdk.Stack {
             "Ref::Size",
             "Ref::SourceBucketRegion",
           ],
+          environment: [
+            { name: "COPY_STATS_TABLE_NAME", value: copyStatsTable.ref },
+            { name: "RATE_LIMIT_TABLE_NAME", value: rateLimitTable.ref },
+          ],
           executionRoleArn: executionRole.roleArn,
           jobRoleArn: jobRole.roleArn,
           fargatePlatformConfiguration: {
@@ -447,11 +518,25 @@ export class MediaSyncStack extends cdk.Stack {
           ],
         },
         retryStrategy: {
-          attempts: 2,
+          attempts: 3,
         },
       }
     );
 
+    // Tuning of the driver function, shared with tests/simulator so that a
+    // simulation runs with what is deployed. MAX_NUMBER_OF_PENDING_JOBS is 2x
+    // maxvCpus. MN_SIZE_FOR_BATCH_IN_BYTES (500MB) is optimized for cost, set it
+    // to 5GB for optimal speed. COPY_MODE_SELECTION adaptive chooses the lambda,
+    // server side or streaming copy from the observed throughput, weighted by
+    // COPY_OBJECTIVE_WEIGHT (0 for the fastest copy, 1 for the cheapest).
+    // RATE_LIMIT_REQUESTS_PER_SECOND is the PUT rate per destination prefix.
+    // SIZE_CLASSES are small up to 5GB, medium up to 100GB and large.
+    const driverSettings = Object.fromEntries(
+      Object.entries(JSON.parse(fs.readFileSync("lib/mediasync/driver-settings.json", "utf8"))).map(
+        ([name, value]) => [name, typeof value === "string" ? value : JSON.stringify(value)]
+      )
+    );
+
     // The actual MediaSync function
     const mediaSyncDriverFunction = new lambda.Function(
       this,
@@ -461,7 +546,10 @@ export class MediaSyncStack extends cdk.Stack {
         handler: "app.lambda_handler",
         description: "Lambda function to be invoked by s3 batch",
         role: customLambdaRole,
-        code: lambda.Code.fromAsset("lib/mediasync/lambda/mediasync_driver/"),
+        code: lambda.Code.fromAsset("lib/mediasync/lambda/mediasync_driver/", {
+          // checksums.py and preflight_cache.py link to lib/common
+          followSymlinks: cdk.SymlinkFollowMode.ALWAYS,
+        }),
         timeout: cdk.Duration.seconds(300),
         reservedConcurrentExecutions: 256,
         memorySize: 128,
@@ -470,9 +558,9 @@ export class MediaSyncStack extends cdk.Stack {
           JOB_DEFINITION_X_REGION: copyJobDefinitionXRegion.ref,
           JOB_QUEUE: jobQueue.attrJobQueueArn,
           DESTINATION_BUCKET_NAME: destinationBucketName.valueAsString,
-          DISABLE_PENDING_JOBS_CHECK: "true",
-          MAX_NUMBER_OF_PENDING_JOBS: "96", //== 2x of MaxvCpus
-          MN_SIZE_FOR_BATCH_IN_BYTES: "524288000", //500MB - this optimizaed for cost. Set it to 5GB for optimal speed.
+          COPY_STATS_TABLE_NAME: copyStatsTable.ref,
+          RATE_LIMIT_TABLE_NAME: rateLimitTable.ref,
+          ...driverSettings,
           LogLevel: "INFO",
           SOLUTION_IDENTIFIER: "AwsSolution/SO0133/__VERSION__-Mediasync",
           SendAnonymizedMetric: cdk.Fn.findInMap('AnonymizedData', 'SendAnonymizedData', 'Data')
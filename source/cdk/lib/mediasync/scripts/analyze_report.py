@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+# usage: ./analyze_report.py <s3 uri of the report manifest.json, or report csv files or s3 uris>
+#            [--manifest <file or s3 uri>] [--all]
+#
+# Aggregates the completion report of an S3 Batch job of MediaSync or fixity.
+# The report files are read as a stream, so reports of millions of tasks do
+# not need to fit in memory. The drivers write a json result string with the
+# path each task took (lambda, server or stream for MediaSync, small or large
+# for fixity), the size of the object and the time of the invocation. The
+# summary has the tasks by status, the objects, bytes and seconds by path and
+# the failures by error code.
+#
+# Failed tasks that can be retried are written to a CSV manifest that can be
+# used as is for another job, e.g. with run_copy_job.sh or run_hash_job.sh.
+# These are temporary failures and permanent failures with an error code of
+# S3 or Batch that is known to pass, e.g. InternalError. Objects that do not
+# exist, are not readable or are in an unsupported storage class are left out,
+# and so are failures with an error code that is not known; those are counted
+# under Unknown of the summary to be looked at. --all writes every failed task.
+
+import io
+import sys
+import csv
+import json
+import argparse
+import tempfile
+import boto3
+from manifests import parse_s3_uri
+
+# columns of Report_CSV_20180820
+COLUMNS = ['Bucket', 'Key', 'VersionId', 'TaskStatus', 'ErrorCode', 'HTTPStatusCode', 'ResultMessage']
+
+# error codes of failures that pass when they are retried
+RETRYABLE_ERRORS = ['500', '503', 'InternalError', 'ServiceUnavailable', 'SlowDown', 'RequestTimeout', 'TooManyRequestsException', 'ThrottlingException']
+
+# error codes of failures that fail again
+PERMANENT_ERRORS = ['403', '404', 'AccessDenied', 'NoSuchKey', 'NoSuchBucket', 'ObjectDeletedError', 'UnsupportedStorageClassError', 'UnsupportedTextFormatError']
+
+
+def open_report(client, uri):
+
+    if uri.startswith('s3://'):
+        bucket, key = parse_s3_uri(uri)
+        return io.TextIOWrapper(client.get_object(Bucket=bucket, Key=key)['Body'], encoding='utf-8', newline='')
+    return open(uri, encoding='utf-8', newline='')
+
+
+def list_report_files(client, uris):
+
+    # the manifest.json of a report lists its result files
+    for uri in uris:
+        if uri.endswith('manifest.json'):
+            bucket, key = parse_s3_uri(uri)
+            manifest = json.loads(client.get_object(Bucket=bucket, Key=key)['Body'].read())
+            if manifest.get('Format') != 'Report_CSV_20180820':
+                raise ValueError('unsupported report format ' + str(manifest.get('Format')))
+            for result in manifest['Results']:
+                yield 's3://' + result['Bucket'] + '/' + result['Key']
+        else:
+            yield uri
+
+
+def read_report(client, uris):
+
+    for uri in list_report_files(client, uris):
+        with open_report(client, uri) as f:
+            for row in csv.reader(f):
+                if row:
+                    yield dict(zip(COLUMNS, row))
+
+
+def parse_result(message):
+
+    # result strings of earlier versions of the drivers are plain text
+    if message.startswith('{'):
+        try:
+            return json.loads(message)
+        except ValueError:
+            pass
+    return {'Message': message}
+
+
+def is_retryable(task, result):
+
+    return task['ErrorCode'] == 'TemporaryFailure' or result.get('Code') in RETRYABLE_ERRORS
+
+
+def is_unknown(task, result):
+
+    return task['ErrorCode'] != 'TemporaryFailure' and result.get('Code') not in RETRYABLE_ERRORS + PERMANENT_ERRORS
+
+
+def analyze(tasks, manifest=None, retry_all=False):
+
+    summary = {'Tasks': 0, 'Status': {}, 'Paths': {}, 'Failures': {}, 'Unknown': {}, 'Retry': 0}
+    writer = csv.writer(manifest, lineterminator='\n') if manifest else None
+
+    for task in tasks:
+        result = parse_result(task.get('ResultMessage', ''))
+        status = task['TaskStatus']
+
+        summary['Tasks'] += 1
+        summary['Status'][status] = summary['Status'].get(status, 0) + 1
+
+        if status == 'succeeded':
+            path = summary['Paths'].setdefault(result.get('Path', 'unknown'), {'Tasks': 0, 'Bytes': 0, 'Seconds': 0.0})
+            path['Tasks'] += 1
+            path['Bytes'] += result.get('Bytes', 0)
+            path['Seconds'] += result.get('Seconds', 0)
+            continue
+
+        # failures by the result code and the error code of the driver
+        code = task['ErrorCode'] + (':' + result['Code'] if 'Code' in result else '')
+        failure = summary['Failures'].setdefault(code, {'Tasks': 0, 'Message': result.get('Message', '')})
+        failure['Tasks'] += 1
+
+        if is_unknown(task, result):
+            summary['Unknown'][code] = summary['Unknown'].get(code, 0) + 1
+
+        if retry_all or is_retryable(task, result):
+            summary['Retry'] += 1
+            if writer:
+                # keys are url encoded in the report, as in the manifest
+                writer.writerow([task['Bucket'], task['Key']])
+
+    for path in summary['Paths'].values():
+        path['Seconds'] = round(path['Seconds'], 3)
+        # the time of Lambda copies is the copy, the time of jobs is their submission
+        if path['Seconds']:
+            path['MBPerSecond'] = round(path['Bytes'] / 1024 / 1024 / path['Seconds'], 3)
+
+    return summary
+
+
+def main(argv):
+
+    parser = argparse.ArgumentParser(prog='analyze_report.py')
+    parser.add_argument('report', nargs='+', help='s3 uri of the report manifest.json, or report csv files or s3 uris')
+    parser.add_argument('--manifest', default='retry.csv', help='manifest of the tasks to retry, file or s3 uri')
+    parser.add_argument('--all', action='store_true', help='retry every failed task')
+    args = parser.parse_args(argv[1:])
+
+    client = boto3.client('s3')
+
+    with tempfile.TemporaryFile('w+', encoding='utf-8', newline='') as manifest:
+        summary = analyze(read_report(client, args.report), manifest, args.all)
+
+        manifest.seek(0)
+        if args.manifest.startswith('s3://'):
+            bucket, key = parse_s3_uri(args.manifest)
+            client.put_object(Bucket=bucket, Key=key, Body=manifest.read().encode('utf-8'))
+        else:
+            with open(args.manifest, 'w', encoding='utf-8', newline='') as f:
+                f.write(manifest.read())
+
+    print(json.dumps(summary, indent=2))
+
+    # non-zero when there is anything to retry
+    return 1 if summary['Retry'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1 @@
+../../common/job_schedule.py
\ No newline at end of file
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+# usage: ./plan_copy_job.py <manifest csv or s3 uri of inventory manifest.json> <destination bucket>
+#            [--source-region <region>] [--destination-region <region>] [--max-vcpus 256] [--concurrency 256]
+#            [--mn-size-for-batch 524288000] [--part-size 67108864] [--throughput '{"server": 1600}']
+#            [--copy-stats-table <table name>] [--cost-per-second '{"server": 0.0000041}']
+#            [--copy-mode-selection static|adaptive] [--objective-weight 0.5] [--size-classes '<SIZE_CLASSES>']
+#
+# Estimates a MediaSync run before run_copy_job.sh is started. The manifest
+# (bucket,key[,size], as for run_copy_job.sh, HEAD for rows without a size) or
+# the inventory is read as a stream and every object is routed as the driver
+# does: objects up to MN_SIZE_FOR_BATCH_IN_BYTES are copied in Lambda, larger
+# ones by a server side copy job or, across regions, by a streaming copy job.
+#
+# Copies take size / throughput of their mode, and copy jobs another
+# --batch-overhead-seconds to be queued and started. The throughput of each
+# mode is calibrated from the copy stats table of a previous run
+# (--copy-stats-table), by route from the source to the destination bucket as
+# the driver records them, or set with --throughput. Lambda invocations run
+# --concurrency at a time and copy jobs run first in, first out on --max-vcpus.
+# The report has the makespan, the Lambda / Batch split, the copy jobs of each
+# size class, the number of requests and the cost.
+#
+# With --copy-mode-selection adaptive objects are routed as the adaptive
+# driver would once it has the samples of --copy-stats-table. The size classes
+# share the compute environment by fair share scheduling, which is not
+# modeled; the report warns about what it leaves out.
+
+import sys
+import json
+import argparse
+import boto3
+from job_schedule import Schedule
+from manifests import read_manifest, read_inventory, with_sizes
+
+MB = 1024 * 1024
+
+# MB/s of a copy in each mode, from the single object timings in the README
+THROUGHPUT = {'lambda': 150, 'server': 1600, 'stream': 300}
+
+# vCPUs of CopyJobDefinition and CopyJobDefinitionXRegion
+VCPUS = {'server': 1, 'stream': 4}
+
+# $ per second of copying, as COPY_COST_PER_SECOND of the driver
+COST_PER_SECOND = {'lambda': 0.0000021, 'server': 0.0000041, 'stream': 0.0000164}
+
+# $ per request and per GB
+PRICES = {
+    'S3PutRequest': 0.000005,
+    'S3GetRequest': 0.0000004,
+    'LambdaRequest': 0.0000002,
+    'S3BatchJob': 0.25,
+    'S3BatchTask': 0.000001,
+    'InterRegionTransferPerGB': 0.02
+}
+
+# requests to S3 that are charged as PUT
+PUT_REQUESTS = ['CopyObject', 'CreateMultipartUpload', 'UploadPartCopy', 'UploadPart', 'CompleteMultipartUpload', 'PutObjectTagging']
+
+# the copy stats of a mode are used from this many samples
+MIN_SAMPLES = 5
+
+# CopyObject copies up to 5GB
+MAX_COPY_OBJECT_SIZE = 5 * 1024 ** 3
+
+# SIZE_CLASSES of the stack
+SIZE_CLASSES = [
+    {'name': 'small', 'maxSizeInBytes': 5368709120},
+    {'name': 'medium', 'maxSizeInBytes': 107374182400},
+    {'name': 'large'}
+]
+
+
+def get_route(source_bucket, destination_bucket):
+
+    # as get_copy_stats_partition of the driver
+    return source_bucket + '>' + destination_bucket
+
+
+def read_copy_stats(client, table_name):
+
+    # bytes and seconds by route and mode, and by route, mode and size band
+    # (see get_copy_stats_partition of the driver). Routes are not mixed, the
+    # samples of a same region route say nothing about a cross region copy.
+    stats = {}
+    for page in client.get_paginator('scan').paginate(TableName=table_name):
+        for item in page['Items']:
+            route, mode, band, _ = item['Partition']['S'].rsplit('#', 3)
+            for k in [(route, mode), (route, mode, int(band))]:
+                count, total, seconds = stats.get(k, (0, 0, 0.0))
+                stats[k] = (count + int(item['Count']['N']), total + int(item['Bytes']['N']), seconds + float(item['Seconds']['N']))
+    return stats
+
+
+def get_size_band(size):
+
+    # as get_size_band of the driver
+    return size.bit_length() // 2
+
+
+def get_throughput(mode, size, throughput, stats, route):
+
+    # bytes per second, observed on the route for the size band, for the mode or the model
+    for k in [(route, mode, get_size_band(size)), (route, mode)]:
+        count, total, seconds = stats.get(k, (0, 0, 0.0))
+        if count >= MIN_SAMPLES and seconds > 0:
+            return total / seconds
+    return throughput[mode] * MB
+
+
+def choose_copy_mode(size, static_mode, stats, cost_per_second, part_size, batch_overhead, weight, lambda_max_seconds, route):
+
+    # as choose_copy_mode of the driver with COPY_MODE_SELECTION=adaptive, from
+    # the samples of the route and size band and without exploration
+    estimates = {}
+    for mode in THROUGHPUT:
+        count, total, seconds = stats.get((route, mode, get_size_band(size)), (0, 0, 0.0))
+        if count < MIN_SAMPLES or seconds <= 0:
+            continue
+        if (mode == 'lambda' and size > MAX_COPY_OBJECT_SIZE) or (mode != 'lambda' and size <= part_size):
+            continue
+        copy_seconds = size / (total / seconds)
+        if mode == 'lambda' and copy_seconds > lambda_max_seconds:
+            continue
+        overhead = 0 if mode == 'lambda' else batch_overhead
+        estimates[mode] = (copy_seconds + overhead, copy_seconds * cost_per_second[mode])
+
+    if not estimates:
+        return static_mode
+
+    fastest = max(min(estimate[0] for estimate in estimates.values()), 0.001)
+    cheapest = max(min(estimate[1] for estimate in estimates.values()), 0.000000001)
+    return min(estimates, key=lambda mode: (1 - weight) * estimates[mode][0] / fastest + weight * estimates[mode][1] / cheapest)
+
+
+def get_size_class(size, size_classes):
+
+    # as get_size_class of the driver
+    size_classes = sorted(size_classes, key=lambda x: int(x['maxSizeInBytes']) if 'maxSizeInBytes' in x else float('inf'))
+    for size_class in size_classes:
+        if 'maxSizeInBytes' not in size_class or size <= int(size_class['maxSizeInBytes']):
+            return size_class['name']
+    return size_classes[-1]['name']
+
+
+def get_bucket_region(client, bucket, regions, default=None):
+
+    if bucket not in regions:
+        region = default or client.get_bucket_location(Bucket=bucket)['LocationConstraint']
+        # as get_bucket_region of the driver, buckets in us-east-1 have no location constraint, EU is eu-west-1
+        regions[bucket] = {None: 'us-east-1', '': 'us-east-1', 'EU': 'eu-west-1'}.get(region, region)
+    return regions[bucket]
+
+
+def get_prefix(bucket, key, depth):
+
+    # as get_rate_limit_partition of the driver
+    return bucket + '/' + '/'.join(key.split('/')[:-1][:depth])
+
+
+def plan(objects, destination_bucket, regions=None, source_region=None, max_vcpus=256, concurrency=256, mn_size_for_batch=524288000, part_size=64 * MB,
+         throughput=None, stats=None, cost_per_second=None, prices=None, batch_overhead=60,
+         invocation_seconds=0.2, rate_limit=3500, prefix_depth=1, region_client=None, copy_mode_selection='static',
+         objective_weight=0.5, lambda_max_seconds=240, size_classes=None):
+
+    throughput = {**THROUGHPUT, **(throughput or {})}
+    cost_per_second = {**COST_PER_SECOND, **(cost_per_second or {})}
+    prices = {**PRICES, **(prices or {})}
+    stats = stats or {}
+    regions = dict(regions or {})
+
+    schedule = Schedule(concurrency, max_vcpus)
+    modes = {mode: {'Objects': 0, 'Bytes': 0, 'Seconds': 0.0} for mode in THROUGHPUT}
+    requests = {}
+    prefixes = {}
+    size_classes = size_classes if size_classes is not None else SIZE_CLASSES
+    classes = {}
+    routes = set()
+    transfer = 0
+
+    def count(request, n=1):
+        requests[request] = requests.get(request, 0) + n
+
+    for bucket, key, size in objects:
+        count('S3BatchTask')
+        count('LambdaInvocation')
+        count('HeadObject')
+
+        # the routing of get_static_copy_mode
+        if size <= mn_size_for_batch:
+            mode = 'lambda'
+        elif get_bucket_region(region_client, bucket, regions, source_region) == get_bucket_region(region_client, destination_bucket, regions):
+            mode = 'server'
+        else:
+            mode = 'stream'
+        route = get_route(bucket, destination_bucket)
+        routes.add(route)
+        if copy_mode_selection == 'adaptive':
+            mode = choose_copy_mode(size, mode, stats, cost_per_second, part_size, batch_overhead, objective_weight, lambda_max_seconds, route)
+
+        seconds = size / get_throughput(mode, size, throughput, stats, route)
+        modes[mode]['Objects'] += 1
+        modes[mode]['Bytes'] += size
+        modes[mode]['Seconds'] += seconds
+
+        if mode == 'lambda':
+            count('CopyObject')
+            puts = 1
+            schedule.invoke(invocation_seconds + seconds)
+        else:
+            parts = max(1, -(-size // part_size))
+            count('SubmitJob')
+            count('CreateMultipartUpload')
+            count('CompleteMultipartUpload')
+            if mode == 'server':
+                count('UploadPartCopy', parts)
+            else:
+                count('GetObject', parts)
+                count('UploadPart', parts)
+                count('PutObjectTagging')
+                transfer += size
+            puts = parts + 2
+            if size_classes:
+                size_class = classes.setdefault(get_size_class(size, size_classes), {'Objects': 0, 'Bytes': 0})
+                size_class['Objects'] += 1
+                size_class['Bytes'] += size
+            schedule.run_job(schedule.invoke(invocation_seconds), VCPUS[mode], batch_overhead + seconds)
+
+        prefix = get_prefix(destination_bucket, key, prefix_depth)
+        prefixes[prefix] = prefixes.get(prefix, 0) + puts
+
+    # the PUT rate of the busiest prefix bounds the run as well
+    bound = max(prefixes.values(), default=0) / rate_limit
+    objects_count = sum(mode['Objects'] for mode in modes.values())
+
+    cost = {
+        'Lambda': round((cost_per_second['lambda'] * invocation_seconds + prices['LambdaRequest']) * requests.get('LambdaInvocation', 0)
+                        + cost_per_second['lambda'] * modes['lambda']['Seconds'], 2),
+        'Batch': round(sum(cost_per_second[mode] * (modes[mode]['Seconds'] + batch_overhead * modes[mode]['Objects']) for mode in VCPUS), 2),
+        'S3Requests': round(prices['S3PutRequest'] * sum(requests.get(r, 0) for r in PUT_REQUESTS)
+                            + prices['S3GetRequest'] * (requests.get('HeadObject', 0) + requests.get('GetObject', 0)), 2),
+        'S3Batch': round(prices['S3BatchJob'] + prices['S3BatchTask'] * requests.get('S3BatchTask', 0), 2) if objects_count else 0,
+        'DataTransfer': round(prices['InterRegionTransferPerGB'] * transfer / 1024 ** 3, 2)
+    }
+    cost['Total'] = round(sum(cost.values()), 2)
+
+    # what the schedule does not model
+    warnings = []
+    if copy_mode_selection == 'adaptive' and not any(len(k) == 3 and k[0] in routes and v[0] >= MIN_SAMPLES for k, v in stats.items()):
+        warnings.append('COPY_MODE_SELECTION is adaptive but there are no copy stats of the routes, the static rule is modeled')
+    if len(classes) > 1:
+        warnings.append('the size classes ' + ', '.join(classes) + ' share the vCPUs by fair share, the makespan assumes one first in, first out queue')
+
+    return {
+        'Objects': objects_count,
+        'Bytes': sum(mode['Bytes'] for mode in modes.values()),
+        'Makespan': round(max(schedule.makespan, bound), 1),
+        'MakespanHours': round(max(schedule.makespan, bound) / 3600, 2),
+        'PrefixRateBound': round(bound, 1),
+        'Modes': {mode: {'Objects': v['Objects'], 'Bytes': v['Bytes'], 'Seconds': round(v['Seconds'], 1)} for mode, v in modes.items() if v['Objects']},
+        'SizeClasses': classes,
+        'Requests': requests,
+        'Cost': cost,
+        'Warnings': warnings
+    }
+
+
+def main(argv):
+
+    parser = argparse.ArgumentParser(prog='plan_copy_job.py')
+    parser.add_argument('manifest', help='csv manifest (file or s3 uri) or s3 uri of an inventory manifest.json')
+    parser.add_argument('destination_bucket')
+    parser.add_argument('--source-region', help='region of all source buckets, looked up when not set')
+    parser.add_argument('--destination-region', help='region of the destination bucket, looked up when not set')
+    parser.add_argument('--max-vcpus', type=int, default=256, help='maxvCpus of the compute environment')
+    parser.add_argument('--concurrency', type=int, default=256, help='reservedConcurrentExecutions of the driver')
+    parser.add_argument('--mn-size-for-batch', type=int, default=524288000, help='MN_SIZE_FOR_BATCH_IN_BYTES')
+    parser.add_argument('--part-size', type=int, default=64 * MB, help='COPY_PART_SIZE_IN_BYTES')
+    parser.add_argument('--batch-overhead-seconds', type=float, default=60, help='COPY_BATCH_OVERHEAD_IN_SECONDS')
+    parser.add_argument('--rate-limit', type=float, default=3500, help='RATE_LIMIT_REQUESTS_PER_SECOND')
+    parser.add_argument('--prefix-depth', type=int, default=1, help='RATE_LIMIT_PREFIX_DEPTH')
+    parser.add_argument('--throughput', default='{}', help='json object of MB/s by mode (lambda, server, stream)')
+    parser.add_argument('--copy-stats-table', help='COPY_STATS_TABLE_NAME of a previous run, calibrates the throughput')
+    parser.add_argument('--cost-per-second', default='{}', help='COPY_COST_PER_SECOND')
+    parser.add_argument('--prices', default='{}', help='json object of prices, see PRICES')
+    parser.add_argument('--copy-mode-selection', choices=['static', 'adaptive'], default='static', help='COPY_MODE_SELECTION, adaptive needs --copy-stats-table')
+    parser.add_argument('--objective-weight', type=float, default=0.5, help='COPY_OBJECTIVE_WEIGHT')
+    parser.add_argument('--lambda-max-seconds', type=float, default=240, help='LAMBDA_COPY_MAX_SECONDS')
+    parser.add_argument('--size-classes', default=json.dumps(SIZE_CLASSES), help='SIZE_CLASSES')
+    args = parser.parse_args(argv[1:])
+
+    client = boto3.client('s3')
+    stats = read_copy_stats(boto3.client('dynamodb'), args.copy_stats_table) if args.copy_stats_table else {}
+
+    regions = {args.destination_bucket: args.destination_region} if args.destination_region else {}
+
+    objects = read_inventory(client, args.manifest) if args.manifest.endswith('manifest.json') else with_sizes(client, read_manifest(client, args.manifest))
+
+    report = plan(objects, args.destination_bucket, regions, args.source_region, args.max_vcpus, args.concurrency, args.mn_size_for_batch, args.part_size,
+                  throughput=json.loads(args.throughput), stats=stats, cost_per_second=json.loads(args.cost_per_second),
+                  prices=json.loads(args.prices), batch_overhead=args.batch_overhead_seconds, rate_limit=args.rate_limit,
+                  prefix_depth=args.prefix_depth, region_client=client, copy_mode_selection=args.copy_mode_selection,
+                  objective_weight=args.objective_weight, lambda_max_seconds=args.lambda_max_seconds, size_classes=json.loads(args.size_classes))
+
+    for warning in report['Warnings']:
+        print('warning: ' + warning, file=sys.stderr)
+    print(json.dumps(report, indent=2))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
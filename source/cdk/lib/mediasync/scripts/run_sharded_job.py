@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+# usage: ./run_sharded_job.py <manifest csv or s3 uri of inventory manifest.json> <s3 uri of the shards prefix>
+#            [--shards 16] [--tool mediasync|fixity] [--priority 10] [--priority-step 0] [--no-wait] [--interval 60]
+#
+# Splits a large manifest into several S3 Batch jobs instead of the single job
+# of run_copy_job.sh and run_hash_job.sh. The manifest (bucket,key[,size]) or
+# the inventory is read as a stream and every object goes to the shard with the
+# fewest bytes so far, so the shards take about the same time regardless of the
+# number of keys. The shards are written next to each other under the shards
+# prefix, and each one is submitted as its own job with the driver function of
+# the MediaSync or fixity stack (ENV, see run_copy_job.sh). The completion
+# reports are written under <shards prefix>/reports.
+#
+# All jobs get --priority and run side by side. With --priority-step each
+# shard gets that much less than the one before (down to 0), so that S3 Batch
+# favors the first shards and they finish first.
+#
+# The jobs are then tracked together until all of them are complete. A shard
+# whose job fails (e.g. over the failure threshold of S3 Batch) does not stop
+# the others; its manifest is listed at the end so that it can be looked at
+# and submitted again. Running the same command again does not create the jobs
+# twice.
+
+import io
+import os
+import sys
+import csv
+import json
+import time
+import uuid
+import heapq
+import argparse
+import tempfile
+import boto3
+from manifests import parse_s3_uri, read_manifest, read_inventory
+
+# stack name, function arn output and role arn output of each tool
+TOOLS = {
+    'mediasync': ('mediaexchange-tools-mediasync-', 'LambdaFunctionArn', 'S3BatchRoleArn'),
+    'fixity': ('mediaexchange-tools-fixity-', 'FixtyDriverFunctionArn', 'FixtyS3BatchIAMRoleArn')
+}
+
+# job statuses of S3 Batch that are final
+COMPLETE = ['Complete', 'Failed', 'Cancelled']
+
+
+def shard(objects, writers):
+
+    # every object goes to the shard with the fewest bytes, objects without a
+    # size count as one byte so that they are spread by count
+    shards = [(0, i) for i in range(len(writers))]
+    totals = [{'Objects': 0, 'Bytes': 0} for _ in writers]
+
+    for bucket, key, size in objects:
+        total, i = heapq.heappop(shards)
+        writers[i].writerow([bucket, key])
+        totals[i]['Objects'] += 1
+        totals[i]['Bytes'] += size or 0
+        heapq.heappush(shards, (total + max(size or 0, 1), i))
+
+    return totals
+
+
+def get_stack_outputs(cloudformation, tool):
+
+    stack_name, function_output, role_output = TOOLS[tool]
+    outputs = cloudformation.describe_stacks(StackName=stack_name + os.environ.get('ENV', 'dev'))['Stacks'][0]['Outputs']
+    outputs = {output['OutputKey']: output['OutputValue'] for output in outputs}
+
+    return outputs[function_output], outputs[role_output]
+
+
+def submit(control, account_id, function_arn, role_arn, shards_uri, shards, priority, description, priority_step=0):
+
+    bucket, prefix = parse_s3_uri(shards_uri.rstrip('/'))
+    jobs = []
+
+    for i, (key, etag) in enumerate(shards):
+        response = control.create_job(
+            AccountId=account_id,
+            ConfirmationRequired=False,
+            Operation={'LambdaInvoke': {'FunctionArn': function_arn}},
+            Report={'Bucket': 'arn:aws:s3:::' + bucket, 'Prefix': prefix + '/reports', 'Format': 'Report_CSV_20180820', 'Enabled': True, 'ReportScope': 'AllTasks'},
+            Manifest={
+                'Spec': {'Format': 'S3BatchOperations_CSV_20180820', 'Fields': ['Bucket', 'Key']},
+                'Location': {'ObjectArn': 'arn:aws:s3:::' + bucket + '/' + key, 'ETag': etag}
+            },
+            RoleArn=role_arn,
+            # the same shard is submitted once
+            ClientRequestToken=str(uuid.uuid5(uuid.NAMESPACE_URL, 's3://' + bucket + '/' + key + '#' + etag)),
+            Priority=max(priority - i * priority_step, 0),
+            Description=description + ' ' + str(i + 1) + '/' + str(len(shards))
+        )
+        jobs.append(response['JobId'])
+
+    return jobs
+
+
+def track(control, account_id, jobs, interval=60, wait=True, out=sys.stdout):
+
+    while True:
+        status = {}
+        progress = {'TotalNumberOfTasks': 0, 'NumberOfTasksSucceeded': 0, 'NumberOfTasksFailed': 0}
+        failed = []
+
+        for job_id in jobs:
+            job = control.describe_job(AccountId=account_id, JobId=job_id)['Job']
+            status[job['Status']] = status.get(job['Status'], 0) + 1
+            for name in progress:
+                progress[name] += job.get('ProgressSummary', {}).get(name, 0)
+            if job['Status'] in ['Failed', 'Cancelled']:
+                failed.append({'JobId': job_id, 'Manifest': job['Manifest']['Location']['ObjectArn'], 'FailureReasons': [
+                    reason.get('FailureReason', '') for reason in job.get('FailureReasons', [])]})
+
+        out.write(json.dumps({'Jobs': status, **progress}) + '\n')
+        out.flush()
+
+        if not wait or all(s in COMPLETE for s in status):
+            return {'Jobs': status, **progress, 'Failed': failed}
+
+        time.sleep(interval)
+
+
+def main(argv):
+
+    parser = argparse.ArgumentParser(prog='run_sharded_job.py')
+    parser.add_argument('manifest', help='csv manifest (file or s3 uri) or s3 uri of an inventory manifest.json')
+    parser.add_argument('prefix', help='s3 uri of the prefix for the shards and the reports')
+    parser.add_argument('--shards', dest='count', type=int, default=16, help='number of shards')
+    parser.add_argument('--tool', choices=list(TOOLS), default='mediasync')
+    parser.add_argument('--priority', type=int, default=10, help='priority of the first job')
+    parser.add_argument('--priority-step', type=int, default=0, help='priority decrement of every next job')
+    parser.add_argument('--interval', type=float, default=60, help='seconds between status updates')
+    parser.add_argument('--no-wait', action='store_true')
+    args = parser.parse_args(argv[1:])
+
+    client = boto3.client('s3')
+    control = boto3.client('s3control')
+    account_id = boto3.client('sts').get_caller_identity()['Account']
+    function_arn, role_arn = get_stack_outputs(boto3.client('cloudformation'), args.tool)
+
+    # the keys are written to the shards as they are
+    if args.manifest.endswith('manifest.json'):
+        objects = read_inventory(client, args.manifest, decode_keys=False, require_size=False)
+    else:
+        objects = read_manifest(client, args.manifest, decode_keys=False)
+    bucket, prefix = parse_s3_uri(args.prefix.rstrip('/'))
+
+    # the shards are spooled to disk and streamed to S3, they are not held in memory
+    files = [io.TextIOWrapper(tempfile.TemporaryFile(), encoding='utf-8', newline='') for _ in range(args.count)]
+    try:
+        totals = shard(objects, [csv.writer(f, lineterminator='\n') for f in files])
+
+        shards = []
+        for i, f in enumerate(files):
+            if not totals[i]['Objects']:
+                continue
+            f.flush()
+            f.buffer.seek(0)
+            key = prefix + '/shard-' + str(i).zfill(4) + '.csv'
+            client.upload_fileobj(f.buffer, bucket, key)
+            shards.append((key, client.head_object(Bucket=bucket, Key=key)['ETag']))
+    finally:
+        for f in files:
+            f.close()
+
+    print(json.dumps({'Shards': [t for t in totals if t['Objects']]}))
+
+    jobs = submit(control, account_id, function_arn, role_arn, args.prefix, shards, args.priority, args.tool, args.priority_step)
+    summary = track(control, account_id, jobs, args.interval, not args.no_wait)
+
+    print(json.dumps(summary, indent=2))
+
+    # non-zero when a shard failed
+    return 1 if summary['Failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
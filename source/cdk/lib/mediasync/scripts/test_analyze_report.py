@@ -0,0 +1,84 @@
+#######################################################################################################################
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.                                                 #
+#                                                                                                                     #
+#  Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance     #
+#  with the License. A copy of the License is located at                                                              #
+#                                                                                                                     #
+#      http://www.apache.org/licenses/LICENSE-2.0                                                                     #
+#                                                                                                                     #
+#  or in the 'license' file accompanying this file. This file is distributed on an 'AS IS' BASIS, WITHOUT WARRANTIES  #
+#  OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions     #
+#  and limitations under the License.                                                                                 #
+#######################################################################################################################
+import csv
+import io
+import json
+import os
+import unittest
+import boto3
+import mock
+from moto import mock_s3
+
+S3_BUCKET_NAME = 'buckettestname'
+DEFAULT_REGION = 'us-east-1'
+
+MB = 1024 * 1024
+
+ROWS = [
+    [S3_BUCKET_NAME, 'a.mp4', '', 'succeeded', '200', '', json.dumps({'Message': 'Lambda copy complete.', 'Path': 'lambda', 'Bytes': 10 * MB, 'Seconds': 1.0})],
+    [S3_BUCKET_NAME, 'b.mp4', '', 'succeeded', '200', '', json.dumps({'Message': 'Lambda copy complete.', 'Path': 'lambda', 'Bytes': 30 * MB, 'Seconds': 1.0})],
+    [S3_BUCKET_NAME, 'c.mxf', '', 'succeeded', '200', '', json.dumps({'Message': 'Copy job submitted.', 'Path': 'server', 'Bytes': 1000 * MB, 'Seconds': 0.5})],
+    [S3_BUCKET_NAME, 'd+e.mp4', '', 'failed', 'TemporaryFailure', '', json.dumps({'Message': 'Retry request to s3 due to prefix rate limit.', 'Path': 'lambda', 'Bytes': 1})],
+    [S3_BUCKET_NAME, 'f.mp4', '', 'failed', 'PermanentFailure', '', json.dumps({'Message': 'Not Found', 'Code': '404'})],
+    [S3_BUCKET_NAME, 'g.mp4', '', 'failed', 'PermanentFailure', '', json.dumps({'Message': 'Internal Error', 'Code': 'InternalError'})],
+    [S3_BUCKET_NAME, 'h.mp4', '', 'failed', 'PermanentFailure', '', 'Exception: an earlier version of the driver'],
+    [S3_BUCKET_NAME, 'i.mp4', '', 'failed', 'PermanentFailure', '', json.dumps({'Message': 'Checksum mismatch', 'Code': 'ChecksumMismatchError'})]
+]
+
+
+def to_csv(rows):
+    f = io.StringIO()
+    csv.writer(f, lineterminator='\n').writerows(rows)
+    return f.getvalue()
+
+
+@mock_s3
+class TestAnalyzeReport(unittest.TestCase):
+    def setUp(self):
+        # moto does not decode aws-chunked uploads
+        environ = mock.patch.dict(os.environ, {'AWS_DEFAULT_REGION': DEFAULT_REGION, 'AWS_REQUEST_CHECKSUM_CALCULATION': 'when_required'})
+        environ.start()
+        self.addCleanup(environ.stop)
+        boto3.setup_default_session()
+        self.s3 = boto3.client('s3', region_name=DEFAULT_REGION)
+        self.s3.create_bucket(Bucket=S3_BUCKET_NAME)
+
+    def test_analyze_success(self):
+        from analyze_report import analyze, COLUMNS
+        manifest = io.StringIO()
+        summary = analyze((dict(zip(COLUMNS, row)) for row in ROWS), manifest)
+        self.assertEqual(summary['Status'], {'succeeded': 3, 'failed': 5})
+        self.assertEqual(summary['Paths']['lambda'], {'Tasks': 2, 'Bytes': 40 * MB, 'Seconds': 2.0, 'MBPerSecond': 20.0})
+        self.assertEqual(summary['Failures']['PermanentFailure:404'], {'Tasks': 1, 'Message': 'Not Found'})
+        self.assertEqual(summary['Failures']['PermanentFailure']['Message'], 'Exception: an earlier version of the driver')
+        # the missing object is not retried
+        self.assertEqual(summary['Unknown'], {'PermanentFailure': 1, 'PermanentFailure:ChecksumMismatchError': 1})
+        self.assertEqual(summary['Retry'], 2)
+        self.assertEqual(manifest.getvalue().splitlines(), [S3_BUCKET_NAME + ',d+e.mp4', S3_BUCKET_NAME + ',g.mp4'])
+
+    def test_analyze_all_success(self):
+        from analyze_report import analyze, COLUMNS
+        self.assertEqual(analyze((dict(zip(COLUMNS, row)) for row in ROWS), retry_all=True)['Retry'], 5)
+
+    def test_main_success(self):
+        from analyze_report import main
+        for i, rows in enumerate([ROWS[:3], ROWS[3:]]):
+            self.s3.put_object(Bucket=S3_BUCKET_NAME, Key='report/job-1/results/' + str(i) + '.csv', Body=to_csv(rows))
+        manifest = {'Format': 'Report_CSV_20180820', 'ReportSchema': 'Bucket, Key, VersionId, TaskStatus, ErrorCode, HTTPStatusCode, ResultMessage',
+                    'Results': [{'TaskExecutionStatus': status, 'Bucket': S3_BUCKET_NAME, 'Key': 'report/job-1/results/' + str(i) + '.csv'} for i, status in enumerate(['succeeded', 'failed'])]}
+        self.s3.put_object(Bucket=S3_BUCKET_NAME, Key='report/job-1/manifest.json', Body=json.dumps(manifest))
+
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            self.assertEqual(main(['analyze_report.py', 's3://' + S3_BUCKET_NAME + '/report/job-1/manifest.json', '--manifest', 's3://' + S3_BUCKET_NAME + '/retry.csv']), 1)
+        self.assertEqual(json.loads(stdout.getvalue())['Tasks'], 8)
+        self.assertEqual(len(self.s3.get_object(Bucket=S3_BUCKET_NAME, Key='retry.csv')['Body'].read().splitlines()), 2)
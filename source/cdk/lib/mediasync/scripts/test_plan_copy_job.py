@@ -0,0 +1,145 @@
+#######################################################################################################################
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.                                                 #
+#                                                                                                                     #
+#  Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance     #
+#  with the License. A copy of the License is located at                                                              #
+#                                                                                                                     #
+#      http://www.apache.org/licenses/LICENSE-2.0                                                                     #
+#                                                                                                                     #
+#  or in the 'license' file accompanying this file. This file is distributed on an 'AS IS' BASIS, WITHOUT WARRANTIES  #
+#  OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions     #
+#  and limitations under the License.                                                                                 #
+#######################################################################################################################
+import gzip
+import io
+import json
+import os
+import tempfile
+import unittest
+import boto3
+import mock
+from moto import mock_s3, mock_dynamodb
+
+S3_BUCKET_NAME = 'buckettestname'
+DESTINATION_S3_BUCKET_NAME = 'actualtestbucketname'
+DEFAULT_REGION = 'us-east-1'
+
+MB = 1024 * 1024
+GB = 1024 * MB
+
+
+@mock_s3
+@mock_dynamodb
+class TestPlanCopyJob(unittest.TestCase):
+    def setUp(self):
+        # moto does not decode aws-chunked uploads
+        environ = mock.patch.dict(os.environ, {'AWS_DEFAULT_REGION': DEFAULT_REGION, 'AWS_REQUEST_CHECKSUM_CALCULATION': 'when_required'})
+        environ.start()
+        self.addCleanup(environ.stop)
+        boto3.setup_default_session()
+        self.s3 = boto3.client('s3', region_name=DEFAULT_REGION)
+        self.s3.create_bucket(Bucket=S3_BUCKET_NAME)
+        self.s3.create_bucket(Bucket=DESTINATION_S3_BUCKET_NAME, CreateBucketConfiguration={'LocationConstraint': 'us-west-2'})
+
+    def test_plan_success(self):
+        from plan_copy_job import plan
+        objects = [(S3_BUCKET_NAME, 'a/' + str(i) + '.mp4', 150 * MB) for i in range(4)] + [(S3_BUCKET_NAME, 'b/large.mxf', 16 * GB)]
+        report = plan(iter(objects), DESTINATION_S3_BUCKET_NAME, {DESTINATION_S3_BUCKET_NAME: DEFAULT_REGION}, DEFAULT_REGION,
+                      concurrency=2, throughput={'lambda': 150, 'server': 1024}, invocation_seconds=0)
+        self.assertEqual(report['Modes'], {'lambda': {'Objects': 4, 'Bytes': 600 * MB, 'Seconds': 4.0}, 'server': {'Objects': 1, 'Bytes': 16 * GB, 'Seconds': 16.0}})
+        # two rounds of Lambda copies, then the copy job is submitted
+        self.assertEqual(report['Makespan'], 2 + 60 + 16)
+        self.assertEqual(report['Requests']['CopyObject'], 4)
+        self.assertEqual(report['Requests']['UploadPartCopy'], 256)
+        self.assertEqual(report['Requests']['HeadObject'], 5)
+        self.assertEqual(report['Cost']['DataTransfer'], 0)
+
+    def test_plan_cross_region_success(self):
+        from plan_copy_job import plan
+        objects = [(S3_BUCKET_NAME, 'large-' + str(i) + '.mxf', GB) for i in range(4)]
+        report = plan(iter(objects), DESTINATION_S3_BUCKET_NAME, max_vcpus=8, throughput={'stream': 1024}, region_client=self.s3)
+        self.assertEqual(list(report['Modes']), ['stream'])
+        # two jobs of 4 vCPUs at a time
+        self.assertAlmostEqual(report['Makespan'], 0.2 + 2 * (60 + 1), delta=0.1)
+        self.assertEqual(report['Requests']['GetObject'], 64)
+        self.assertEqual(report['Cost']['DataTransfer'], 0.08)
+
+    def test_plan_prefix_rate_bound(self):
+        from plan_copy_job import plan
+        objects = [(S3_BUCKET_NAME, 'a/' + str(i) + '.mp4', 1) for i in range(100)]
+        report = plan(iter(objects), DESTINATION_S3_BUCKET_NAME, source_region='us-west-2', rate_limit=10, region_client=self.s3)
+        self.assertEqual(report['PrefixRateBound'], 10)
+        self.assertEqual(report['Makespan'], 10)
+
+    def test_read_copy_stats_success(self):
+        from plan_copy_job import read_copy_stats, get_throughput, THROUGHPUT
+        dynamodb = boto3.client('dynamodb', region_name=DEFAULT_REGION)
+        dynamodb.create_table(TableName='stats', KeySchema=[{'AttributeName': 'Partition', 'KeyType': 'HASH'}],
+                              AttributeDefinitions=[{'AttributeName': 'Partition', 'AttributeType': 'S'}], BillingMode='PAY_PER_REQUEST')
+        for partition, count, size, seconds in [('a>b#server#15#67108864', 5, 5 * GB, 5.0), ('a>b#server#16#67108864', 1, 4 * GB, 1.0), ('a>c#lambda#15#0', 5, 5 * GB, 5.0)]:
+            dynamodb.put_item(TableName='stats', Item={'Partition': {'S': partition}, 'Count': {'N': str(count)}, 'Bytes': {'N': str(size)}, 'Seconds': {'N': str(seconds)}})
+
+        stats = read_copy_stats(dynamodb, 'stats')
+        self.assertEqual(stats[('a>b', 'server')], (6, 9 * GB, 6.0))
+        # the size band, the mode and the model
+        self.assertEqual(get_throughput('server', GB, THROUGHPUT, stats, 'a>b'), GB)
+        self.assertEqual(get_throughput('server', 4 * GB, THROUGHPUT, stats, 'a>b'), 1.5 * GB)
+        self.assertEqual(get_throughput('stream', GB, THROUGHPUT, stats, 'a>b'), THROUGHPUT['stream'] * MB)
+        # the samples of another route are not used
+        self.assertEqual(get_throughput('lambda', GB, THROUGHPUT, stats, 'a>b'), THROUGHPUT['lambda'] * MB)
+        self.assertEqual(get_throughput('lambda', GB, THROUGHPUT, stats, 'a>c'), GB)
+
+    def test_plan_adaptive_success(self):
+        from plan_copy_job import plan
+        objects = [(S3_BUCKET_NAME, 'a/' + str(i) + '.mp4', GB) for i in range(2)]
+        # lambda copies of the size band at 100MB/s, server side copies at 50MB/s
+        band = GB.bit_length() // 2
+        route = S3_BUCKET_NAME + '>' + DESTINATION_S3_BUCKET_NAME
+        stats = {(route, 'lambda', band): (5, 5 * GB, 5 * GB / 100e6), (route, 'server', band): (5, 5 * GB, 5 * GB / 50e6)}
+        args = dict(regions={DESTINATION_S3_BUCKET_NAME: DEFAULT_REGION}, source_region=DEFAULT_REGION, stats=stats, invocation_seconds=0)
+        self.assertEqual(list(plan(iter(objects), DESTINATION_S3_BUCKET_NAME, **args)['Modes']), ['server'])
+        report = plan(iter(objects), DESTINATION_S3_BUCKET_NAME, copy_mode_selection='adaptive', objective_weight=1, **args)
+        self.assertEqual(list(report['Modes']), ['lambda'])
+        self.assertEqual(report['Warnings'], [])
+        # too slow to finish in the lambda timeout
+        report = plan(iter(objects), DESTINATION_S3_BUCKET_NAME, copy_mode_selection='adaptive', objective_weight=1, lambda_max_seconds=5, **args)
+        self.assertEqual(list(report['Modes']), ['server'])
+        # without stats the static rule, with a warning
+        report = plan(iter(objects), DESTINATION_S3_BUCKET_NAME, copy_mode_selection='adaptive', **dict(args, stats={}))
+        self.assertEqual(list(report['Modes']), ['server'])
+        self.assertEqual(len(report['Warnings']), 1)
+        # nor with the stats of another route
+        report = plan(iter(objects), DESTINATION_S3_BUCKET_NAME, copy_mode_selection='adaptive', objective_weight=1,
+                      **dict(args, stats={('other>' + DESTINATION_S3_BUCKET_NAME,) + k[1:]: v for k, v in stats.items()}))
+        self.assertEqual(list(report['Modes']), ['server'])
+        self.assertEqual(len(report['Warnings']), 1)
+
+    def test_get_bucket_region_success(self):
+        from plan_copy_job import get_bucket_region
+        client = mock.Mock()
+        for constraint, region in [(None, 'us-east-1'), ('EU', 'eu-west-1'), ('us-west-2', 'us-west-2')]:
+            client.get_bucket_location.return_value = {'LocationConstraint': constraint}
+            self.assertEqual(get_bucket_region(client, 'bucket', {}), region)
+        # a region that is set is not looked up
+        self.assertEqual(get_bucket_region(client, 'bucket', {}, 'ap-south-1'), 'ap-south-1')
+
+    def test_plan_size_classes_success(self):
+        from plan_copy_job import plan
+        objects = [(S3_BUCKET_NAME, 'a.mxf', GB), (S3_BUCKET_NAME, 'b.mxf', 6 * GB), (S3_BUCKET_NAME, 'c.mxf', 200 * GB)]
+        report = plan(iter(objects), DESTINATION_S3_BUCKET_NAME, {DESTINATION_S3_BUCKET_NAME: DEFAULT_REGION}, DEFAULT_REGION)
+        self.assertEqual(report['SizeClasses'], {'small': {'Objects': 1, 'Bytes': GB}, 'medium': {'Objects': 1, 'Bytes': 6 * GB}, 'large': {'Objects': 1, 'Bytes': 200 * GB}})
+        self.assertIn('fair share', report['Warnings'][0])
+        report = plan(iter(objects), DESTINATION_S3_BUCKET_NAME, {DESTINATION_S3_BUCKET_NAME: DEFAULT_REGION}, DEFAULT_REGION, size_classes=[])
+        self.assertEqual((report['SizeClasses'], report['Warnings']), ({}, []))
+
+    def test_main_success(self):
+        from plan_copy_job import main
+        self.s3.put_object(Bucket=S3_BUCKET_NAME, Key='a b.mp4', Body=b'abc')
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write(S3_BUCKET_NAME + ',a+b.mp4\n' + S3_BUCKET_NAME + ',c.mp4,' + str(GB) + '\n')
+        self.addCleanup(os.remove, f.name)
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            self.assertEqual(main(['plan_copy_job.py', f.name, DESTINATION_S3_BUCKET_NAME]), 0)
+        report = json.loads(stdout.getvalue())
+        self.assertEqual(report['Bytes'], 3 + GB)
+        self.assertEqual(list(report['Modes']), ['lambda', 'stream'])
@@ -0,0 +1,101 @@
+#######################################################################################################################
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.                                                 #
+#                                                                                                                     #
+#  Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance     #
+#  with the License. A copy of the License is located at                                                              #
+#                                                                                                                     #
+#      http://www.apache.org/licenses/LICENSE-2.0                                                                     #
+#                                                                                                                     #
+#  or in the 'license' file accompanying this file. This file is distributed on an 'AS IS' BASIS, WITHOUT WARRANTIES  #
+#  OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions     #
+#  and limitations under the License.                                                                                 #
+#######################################################################################################################
+import csv
+import io
+import os
+import unittest
+import boto3
+import mock
+from moto import mock_s3
+
+S3_BUCKET_NAME = 'buckettestname'
+DEFAULT_REGION = 'us-east-1'
+ACCOUNT_ID = '123456789012'
+
+
+def job(job_id, status, total, succeeded, failed, reasons=None):
+    return {'Job': {'JobId': job_id, 'Status': status, 'ProgressSummary': {'TotalNumberOfTasks': total, 'NumberOfTasksSucceeded': succeeded, 'NumberOfTasksFailed': failed},
+                    'Manifest': {'Location': {'ObjectArn': 'arn:aws:s3:::' + S3_BUCKET_NAME + '/shards/' + job_id + '.csv'}}, 'FailureReasons': reasons or []}}
+
+
+@mock_s3
+class TestRunShardedJob(unittest.TestCase):
+    def setUp(self):
+        # moto does not decode aws-chunked uploads
+        environ = mock.patch.dict(os.environ, {'AWS_DEFAULT_REGION': DEFAULT_REGION, 'AWS_REQUEST_CHECKSUM_CALCULATION': 'when_required'})
+        environ.start()
+        self.addCleanup(environ.stop)
+        boto3.setup_default_session()
+        self.s3 = boto3.client('s3', region_name=DEFAULT_REGION)
+        self.s3.create_bucket(Bucket=S3_BUCKET_NAME)
+
+    def test_shard_success(self):
+        from run_sharded_job import shard
+        files = [io.StringIO() for _ in range(3)]
+        objects = [(S3_BUCKET_NAME, 'large.mxf', 100)] + [(S3_BUCKET_NAME, str(i) + '.mp4', 10) for i in range(20)]
+        totals = shard(iter(objects), [csv.writer(f, lineterminator='\n') for f in files])
+        # balanced by bytes, not by keys
+        self.assertEqual(totals, [{'Objects': 1, 'Bytes': 100}, {'Objects': 10, 'Bytes': 100}, {'Objects': 10, 'Bytes': 100}])
+        self.assertEqual(files[0].getvalue(), S3_BUCKET_NAME + ',large.mxf\n')
+
+    def test_submit_success(self):
+        from run_sharded_job import submit
+        control = mock.MagicMock()
+        control.create_job.side_effect = [{'JobId': 'a'}, {'JobId': 'b'}, {'JobId': 'a'}]
+        jobs = submit(control, ACCOUNT_ID, 'function', 'role', 's3://' + S3_BUCKET_NAME + '/shards/', [('shards/shard-0000.csv', '"1"'), ('shards/shard-0001.csv', '"2"')], 20, 'mediasync')
+        self.assertEqual(jobs, ['a', 'b'])
+
+        kwargs = control.create_job.call_args_list[1].kwargs
+        self.assertEqual(kwargs['Manifest']['Location'], {'ObjectArn': 'arn:aws:s3:::' + S3_BUCKET_NAME + '/shards/shard-0001.csv', 'ETag': '"2"'})
+        self.assertEqual((kwargs['Priority'], kwargs['Description'], kwargs['Report']['Prefix']), (20, 'mediasync 2/2', 'shards/reports'))
+        # the token of a shard does not change
+        submit(control, ACCOUNT_ID, 'function', 'role', 's3://' + S3_BUCKET_NAME + '/shards', [('shards/shard-0000.csv', '"1"')], 20, 'mediasync')
+        self.assertEqual(control.create_job.call_args_list[0].kwargs['ClientRequestToken'], control.create_job.call_args_list[2].kwargs['ClientRequestToken'])
+
+    def test_submit_priority_step_success(self):
+        from run_sharded_job import submit
+        control = mock.MagicMock()
+        control.create_job.side_effect = [{'JobId': str(i)} for i in range(3)]
+        shards = [('shards/shard-000' + str(i) + '.csv', '"' + str(i) + '"') for i in range(3)]
+        submit(control, ACCOUNT_ID, 'function', 'role', 's3://' + S3_BUCKET_NAME + '/shards', shards, 15, 'mediasync', priority_step=10)
+        # every next shard a step lower, not below 0
+        self.assertEqual([c.kwargs['Priority'] for c in control.create_job.call_args_list], [15, 5, 0])
+
+    def test_track_success(self):
+        from run_sharded_job import track
+        control = mock.MagicMock()
+        control.describe_job.side_effect = [job('a', 'Active', 10, 5, 0), job('b', 'Active', 10, 2, 1),
+                                            job('a', 'Complete', 10, 10, 0), job('b', 'Failed', 10, 2, 8, [{'FailureReason': 'failure threshold exceeded'}])]
+        out = io.StringIO()
+        with mock.patch('time.sleep') as sleep:
+            summary = track(control, ACCOUNT_ID, ['a', 'b'], out=out)
+        sleep.assert_called_once()
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
+        self.assertEqual(summary['Jobs'], {'Complete': 1, 'Failed': 1})
+        self.assertEqual(summary['NumberOfTasksFailed'], 8)
+        self.assertEqual(summary['Failed'], [{'JobId': 'b', 'Manifest': 'arn:aws:s3:::' + S3_BUCKET_NAME + '/shards/b.csv', 'FailureReasons': ['failure threshold exceeded']}])
+
+    def test_main_success(self):
+        import run_sharded_job
+        self.s3.put_object(Bucket=S3_BUCKET_NAME, Key='manifest.csv', Body=''.join(S3_BUCKET_NAME + ',' + str(i) + '.mp4,' + str(i) + '\n' for i in range(10)))
+        clients = {'s3': self.s3, 's3control': mock.MagicMock(), 'sts': mock.MagicMock(), 'cloudformation': mock.MagicMock()}
+        clients['s3control'].create_job.side_effect = [{'JobId': 'a'}, {'JobId': 'b'}]
+        clients['s3control'].describe_job.side_effect = [job('a', 'Complete', 5, 5, 0), job('b', 'Complete', 5, 5, 0)]
+        clients['cloudformation'].describe_stacks.return_value = {'Stacks': [{'Outputs': [{'OutputKey': 'LambdaFunctionArn', 'OutputValue': 'function'}, {'OutputKey': 'S3BatchRoleArn', 'OutputValue': 'role'}]}]}
+
+        with mock.patch.object(run_sharded_job.boto3, 'client', side_effect=lambda name: clients[name]), mock.patch('sys.stdout', new_callable=io.StringIO):
+            self.assertEqual(run_sharded_job.main(['run_sharded_job.py', 's3://' + S3_BUCKET_NAME + '/manifest.csv', 's3://' + S3_BUCKET_NAME + '/shards', '--shards', '2']), 0)
+
+        shards = [self.s3.get_object(Bucket=S3_BUCKET_NAME, Key='shards/shard-000' + str(i) + '.csv')['Body'].read().decode().splitlines() for i in range(2)]
+        self.assertEqual([len(s) for s in shards], [5, 5])
+        clients['cloudformation'].describe_stacks.assert_called_with(StackName='mediaexchange-tools-mediasync-dev')
@@ -0,0 +1,101 @@
+#######################################################################################################################
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.                                                 #
+#                                                                                                                     #
+#  Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance     #
+#  with the License. A copy of the License is located at                                                              #
+#                                                                                                                     #
+#      http://www.apache.org/licenses/LICENSE-2.0                                                                     #
+#                                                                                                                     #
+#  or in the 'license' file accompanying this file. This file is distributed on an 'AS IS' BASIS, WITHOUT WARRANTIES  #
+#  OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions     #
+#  and limitations under the License.                                                                                 #
+#######################################################################################################################
+import gzip
+import io
+import json
+import os
+import unittest
+import boto3
+import mock
+from moto import mock_s3
+
+S3_BUCKET_NAME = 'buckettestname'
+DESTINATION_S3_BUCKET_NAME = 'actualtestbucketname'
+DEFAULT_REGION = 'us-east-1'
+
+
+@mock_s3
+class TestVerifyCopy(unittest.TestCase):
+    def setUp(self):
+        # moto does not decode aws-chunked uploads
+        environ = mock.patch.dict(os.environ, {'AWS_DEFAULT_REGION': DEFAULT_REGION, 'AWS_REQUEST_CHECKSUM_CALCULATION': 'when_required'})
+        environ.start()
+        self.addCleanup(environ.stop)
+        boto3.setup_default_session()
+        self.s3 = boto3.client('s3', region_name=DEFAULT_REGION)
+        self.s3.create_bucket(Bucket=S3_BUCKET_NAME)
+        self.s3.create_bucket(Bucket=DESTINATION_S3_BUCKET_NAME)
+
+        for key, body in [('a.mp4', b'a'), ('b c+d.mp4', b'b'), ('c.mp4', b'c'), ('d.mp4', b'd'), ('e.mp4', b'e')]:
+            self.s3.put_object(Bucket=S3_BUCKET_NAME, Key=key, Body=body)
+        for key, body in [('a.mp4', b'a'), ('c.mp4', b'cc'), ('d.mp4', b'x'), ('f.mp4', b'f')]:
+            self.s3.put_object(Bucket=DESTINATION_S3_BUCKET_NAME, Key=key, Body=body)
+
+    def test_compare_success(self):
+        from verify_copy import compare
+        source = iter([('a', 1, 'aa', None), ('b', 1, 'bb', None), ('c', 5, 'cc-2', None), ('e', 1, 'ee', None), ('f', 1, 'ff', 'SSE-S3'), ('g', 1, 'gg', 'SSE-KMS')])
+        destination = iter([('a', 1, 'aa', None), ('c', 5, 'cc', None), ('d', 1, 'dd', None), ('e', 2, 'ee', None), ('f', 1, 'fx', 'NOT-SSE'), ('g', 1, 'gx', 'SSE-KMS')])
+        self.assertEqual([(status, (s or d)[0]) for status, s, d in compare(source, destination)],
+                         [('Match', 'a'), ('Missing', 'b'), ('Unverified', 'c'), ('Extra', 'd'), ('SizeMismatch', 'e'), ('ETagMismatch', 'f'), ('Unverified', 'g')])
+
+    def test_compare_checksums_success(self):
+        from verify_copy import compare_checksums
+        client = mock.Mock()
+        client.head_object.side_effect = [{'ETag': '"a"', 'ServerSideEncryption': 'aws:kms', 'ChecksumSHA256': 'x'}, {'ETag': '"b"', 'ServerSideEncryption': 'aws:kms', 'ChecksumSHA256': 'x'},
+                                          {'ETag': '"a"', 'ServerSideEncryption': 'aws:kms', 'ChecksumSHA256': 'x'}, {'ETag': '"b"', 'ServerSideEncryption': 'aws:kms', 'ChecksumSHA256': 'y'},
+                                          {'ETag': '"a"', 'ServerSideEncryption': 'aws:kms'}, {'ETag': '"b"', 'ServerSideEncryption': 'aws:kms'}]
+        self.assertEqual([compare_checksums(client, S3_BUCKET_NAME, DESTINATION_S3_BUCKET_NAME, 'a.mp4') for _ in range(3)], ['Match', 'ChecksumMismatch', 'Unverified'])
+
+    def test_prefetch_error(self):
+        from verify_copy import prefetch
+        with self.assertRaises(ValueError):
+            list(prefetch(iter([[('b', 1, 'b')], [('a', 1, 'a')]])))
+
+    def test_verify_success(self):
+        from verify_copy import verify
+        manifest, report = io.StringIO(), io.StringIO()
+        counts = verify(self.s3, S3_BUCKET_NAME, DESTINATION_S3_BUCKET_NAME, manifest=manifest, report=report)
+        # the encryption is not listed, the ETags of d.mp4 are not compared
+        self.assertEqual(counts, {'Match': 1, 'Missing': 2, 'SizeMismatch': 1, 'Unverified': 1, 'Extra': 1})
+        # keys are url encoded for S3 Batch
+        self.assertEqual(manifest.getvalue().splitlines(), [S3_BUCKET_NAME + ',b+c%2Bd.mp4', S3_BUCKET_NAME + ',c.mp4', S3_BUCKET_NAME + ',e.mp4'])
+        self.assertEqual(len(report.getvalue().splitlines()), 6)
+
+    def test_verify_checksums_success(self):
+        from verify_copy import verify
+        manifest = io.StringIO()
+        # the HEAD shows both objects are not SSE-KMS
+        counts = verify(self.s3, S3_BUCKET_NAME, DESTINATION_S3_BUCKET_NAME, manifest=manifest, checksums=True)
+        self.assertEqual(counts, {'Match': 1, 'Missing': 2, 'SizeMismatch': 1, 'ETagMismatch': 1, 'Extra': 1})
+        self.assertEqual(len(manifest.getvalue().splitlines()), 4)
+
+    def test_verify_inventory_success(self):
+        from verify_copy import verify
+        # an inventory of the destination in two files
+        rows = [['actualtestbucketname', 'c.mp4', '2', '"' + self.s3.head_object(Bucket=DESTINATION_S3_BUCKET_NAME, Key='c.mp4')['ETag'].strip('"') + '"'],
+                ['actualtestbucketname', 'a.mp4', '1', self.s3.head_object(Bucket=DESTINATION_S3_BUCKET_NAME, Key='a.mp4')['ETag'].strip('"')]]
+        for i, row in enumerate(rows):
+            self.s3.put_object(Bucket=DESTINATION_S3_BUCKET_NAME, Key='inventory/data/' + str(i) + '.csv.gz', Body=gzip.compress((','.join(row) + '\n').encode()))
+        manifest = {'fileFormat': 'CSV', 'fileSchema': 'Bucket, Key, Size, ETag', 'destinationBucket': 'arn:aws:s3:::' + DESTINATION_S3_BUCKET_NAME,
+                    'files': [{'key': 'inventory/data/0.csv.gz'}, {'key': 'inventory/data/1.csv.gz'}]}
+        self.s3.put_object(Bucket=DESTINATION_S3_BUCKET_NAME, Key='inventory/manifest.json', Body=json.dumps(manifest))
+
+        counts = verify(self.s3, S3_BUCKET_NAME, DESTINATION_S3_BUCKET_NAME, destination_inventory='s3://' + DESTINATION_S3_BUCKET_NAME + '/inventory/manifest.json')
+        self.assertEqual(counts, {'Match': 1, 'Missing': 3, 'SizeMismatch': 1})
+
+    def test_main_success(self):
+        from verify_copy import main
+        self.s3.delete_object(Bucket=DESTINATION_S3_BUCKET_NAME, Key='f.mp4')
+        self.assertEqual(main(['verify_copy.py', S3_BUCKET_NAME, DESTINATION_S3_BUCKET_NAME, '--prefix', 'a', '--manifest', 's3://' + DESTINATION_S3_BUCKET_NAME + '/recopy.csv']), 0)
+        self.assertEqual(main(['verify_copy.py', S3_BUCKET_NAME, DESTINATION_S3_BUCKET_NAME, '--manifest', 's3://' + DESTINATION_S3_BUCKET_NAME + '/recopy.csv']), 1)
+        self.assertEqual(len(self.s3.get_object(Bucket=DESTINATION_S3_BUCKET_NAME, Key='recopy.csv')['Body'].read().splitlines()), 3)
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+# usage: ./verify_copy.py <source bucket> <destination bucket> [--prefix <prefix>]
+#            [--source-inventory <s3 uri of manifest.json>] [--destination-inventory <s3 uri of manifest.json>]
+#            [--manifest <file or s3 uri>] [--report <file>] [--checksums] [--strict]
+#
+# Verifies a MediaSync run without a HEAD request per object. The listings (or
+# S3 inventory reports) of both buckets are read in key order and merge-joined,
+# and the size and ETag of every object are compared. Objects that are missing
+# or differ in the destination are written to a CSV manifest that can be used
+# as is for another copy job, e.g. with run_copy_job.sh.
+#
+# The ETag of a multipart upload depends on the part size, and large objects
+# are copied with a different part size than the source was uploaded with.
+# Under SSE-KMS the ETag is not the MD5 of the content either, so different
+# ETags only mean different content when both objects are known to be
+# unencrypted or SSE-S3, from the EncryptionStatus field of the inventories.
+# Otherwise, when the sizes match, the object is counted as unverified.
+# --checksums HEADs the unverified objects and compares their additional
+# checksums, or their ETags when both turn out not to be SSE-KMS. --strict
+# copies the objects that are still unverified again too.
+
+import io
+import sys
+import csv
+import gzip
+import json
+import queue
+import heapq
+import argparse
+import tempfile
+import threading
+import urllib.parse
+import boto3
+from checksums import ChecksumMismatchError, verify_checksum
+from manifests import parse_s3_uri
+
+# statuses that are copied again
+RECOPY = ['Missing', 'SizeMismatch', 'ETagMismatch', 'ChecksumMismatch']
+
+# encryption of which the ETag of a single part upload is the MD5 of the content
+MD5_ETAG_ENCRYPTION = ['NOT-SSE', 'SSE-S3']
+
+CHECKSUM_ALGORITHMS = ['SHA256', 'SHA1', 'CRC64NVME', 'CRC32C', 'CRC32']
+
+
+def list_objects(client, bucket, prefix):
+
+    # pages of (key, size, etag, encryption), S3 lists keys in UTF-8 binary
+    # order. The encryption is not listed.
+    for page in client.get_paginator('list_objects_v2').paginate(Bucket=bucket, Prefix=prefix):
+        yield [(item['Key'], item['Size'], item['ETag'].strip('"'), None) for item in page.get('Contents', [])]
+
+
+def read_inventory_file(client, bucket, key, columns, prefix):
+
+    body = client.get_object(Bucket=bucket, Key=key)['Body'].read()
+    for row in csv.reader(io.TextIOWrapper(gzip.GzipFile(fileobj=io.BytesIO(body)), encoding='utf-8')):
+        # keys are url encoded in inventory reports
+        entry = dict(zip(columns, row))
+        object_key = urllib.parse.unquote_plus(entry['Key'])
+        if object_key.startswith(prefix) and entry.get('IsLatest', 'true') == 'true' and entry.get('IsDeleteMarker', 'false') != 'true':
+            yield object_key, int(entry['Size']), entry['ETag'].strip('"'), entry.get('EncryptionStatus') or None
+
+
+def list_inventory(client, manifest_uri, prefix):
+
+    bucket, key = parse_s3_uri(manifest_uri)
+    manifest = json.loads(client.get_object(Bucket=bucket, Key=key)['Body'].read())
+
+    if manifest.get('fileFormat') != 'CSV':
+        raise ValueError('unsupported inventory format ' + str(manifest.get('fileFormat')))
+
+    columns = [column.strip() for column in manifest['fileSchema'].split(',')]
+    for column in ['Key', 'Size', 'ETag']:
+        if column not in columns:
+            raise ValueError('inventory has no ' + column + ' field')
+
+    # every file is in key order, the files are merged
+    files = [read_inventory_file(client, manifest['destinationBucket'].split(':::')[-1], f['key'], columns, prefix) for f in manifest['files']]
+    page = []
+    for entry in heapq.merge(*files):
+        page.append(entry)
+        if len(page) == 1000:
+            yield page
+            page = []
+    yield page
+
+
+def prefetch(pages, size=100):
+
+    # reads the pages in a thread, so that both listings are read at the same time
+    pending = queue.Queue(maxsize=size)
+    done = object()
+
+    def run():
+        try:
+            for page in pages:
+                pending.put(page)
+        except Exception as e:
+            pending.put(e)
+        pending.put(done)
+
+    threading.Thread(target=run, daemon=True).start()
+
+    previous = None
+    while True:
+        page = pending.get()
+        if page is done:
+            return
+        if isinstance(page, Exception):
+            raise page
+        for entry in page:
+            if previous is not None and entry[0] <= previous:
+                raise ValueError('listing is not in key order at ' + entry[0])
+            previous = entry[0]
+            yield entry
+
+
+def compare_entry(source, destination):
+
+    if source[1] != destination[1]:
+        return 'SizeMismatch'
+    if source[2] == destination[2]:
+        return None
+    if '-' in source[2] or '-' in destination[2]:
+        return 'Unverified'
+    if source[3] not in MD5_ETAG_ENCRYPTION or destination[3] not in MD5_ETAG_ENCRYPTION:
+        return 'Unverified'
+    return 'ETagMismatch'
+
+
+def compare_checksums(client, source_bucket, destination_bucket, key):
+
+    # the additional checksums compare the content whatever the encryption
+    source = client.head_object(Bucket=source_bucket, Key=key, ChecksumMode='ENABLED')
+    destination = client.head_object(Bucket=destination_bucket, Key=key, ChecksumMode='ENABLED')
+
+    for algorithm in CHECKSUM_ALGORITHMS:
+        name = 'Checksum' + algorithm
+        if name in source and name in destination:
+            try:
+                if verify_checksum(algorithm, source[name], destination[name]).endswith(' verified'):
+                    return 'Match'
+            except ChecksumMismatchError:
+                return 'ChecksumMismatch'
+
+    encryption = [source.get('ServerSideEncryption', 'AES256'), destination.get('ServerSideEncryption', 'AES256')]
+    if source['ETag'] != destination['ETag'] and '-' not in source['ETag'] + destination['ETag'] and encryption == ['AES256', 'AES256']:
+        return 'ETagMismatch'
+
+    return 'Unverified'
+
+
+def compare(source, destination):
+
+    # merge-join of two listings in key order, yields (status, source, destination)
+    s = next(source, None)
+    d = next(destination, None)
+
+    while s is not None or d is not None:
+        if d is None or (s is not None and s[0] < d[0]):
+            yield 'Missing', s, None
+            s = next(source, None)
+        elif s is None or d[0] < s[0]:
+            yield 'Extra', None, d
+            d = next(destination, None)
+        else:
+            status = compare_entry(s, d)
+            yield status or 'Match', s, d
+            s = next(source, None)
+            d = next(destination, None)
+
+
+def verify(client, source_bucket, destination_bucket, prefix='', source_inventory=None, destination_inventory=None, manifest=None, report=None, strict=False, checksums=False):
+
+    source = list_inventory(client, source_inventory, prefix) if source_inventory else list_objects(client, source_bucket, prefix)
+    destination = list_inventory(client, destination_inventory, prefix) if destination_inventory else list_objects(client, destination_bucket, prefix)
+    recopy = RECOPY + ['Unverified'] if strict else RECOPY
+
+    counts = {}
+    manifest_writer = csv.writer(manifest, lineterminator='\n') if manifest else None
+    report_writer = csv.writer(report, lineterminator='\n') if report else None
+    if report_writer:
+        report_writer.writerow(['Status', 'Key', 'SourceSize', 'SourceETag', 'DestinationSize', 'DestinationETag'])
+
+    for status, s, d in compare(prefetch(source), prefetch(destination)):
+        if status == 'Unverified' and checksums:
+            status = compare_checksums(client, source_bucket, destination_bucket, s[0])
+
+        counts[status] = counts.get(status, 0) + 1
+
+        if status in recopy and manifest_writer:
+            # same format as generate_inventory.sh, keys are url encoded for S3 Batch
+            manifest_writer.writerow([source_bucket, urllib.parse.quote_plus(s[0], safe='/')])
+
+        if status != 'Match' and report_writer:
+            entry = s or d
+            report_writer.writerow([status, entry[0]] + (list(s[1:3]) if s else ['', '']) + (list(d[1:3]) if d else ['', '']))
+
+    return counts
+
+
+def main(argv):
+
+    parser = argparse.ArgumentParser(prog='verify_copy.py')
+    parser.add_argument('source_bucket')
+    parser.add_argument('destination_bucket')
+    parser.add_argument('--prefix', default='')
+    parser.add_argument('--source-inventory')
+    parser.add_argument('--destination-inventory')
+    parser.add_argument('--manifest', default='recopy.csv')
+    parser.add_argument('--report')
+    parser.add_argument('--checksums', action='store_true', help='HEAD the objects that the listings can not verify')
+    parser.add_argument('--strict', action='store_true')
+    args = parser.parse_args(argv[1:])
+
+    client = boto3.client('s3')
+
+    with tempfile.TemporaryFile('w+', encoding='utf-8', newline='') as manifest:
+        report = open(args.report, 'w', encoding='utf-8', newline='') if args.report else None
+        try:
+            counts = verify(client, args.source_bucket, args.destination_bucket, args.prefix, args.source_inventory, args.destination_inventory, manifest, report, args.strict, args.checksums)
+        finally:
+            if report:
+                report.close()
+
+        manifest.seek(0)
+        if args.manifest.startswith('s3://'):
+            bucket, key = parse_s3_uri(args.manifest)
+            client.put_object(Bucket=bucket, Key=key, Body=manifest.read().encode('utf-8'))
+        else:
+            with open(args.manifest, 'w', encoding='utf-8', newline='') as f:
+                f.write(manifest.read())
+
+    print(json.dumps(counts, indent=2))
+
+    # non-zero when there is anything to copy again
+    return 1 if any(counts.get(status) for status in (RECOPY + ['Unverified'] if args.strict else RECOPY)) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
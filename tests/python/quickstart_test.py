@@ -10,6 +10,9 @@ import requests
 import hashlib
 import jsonpickle
 import tempfile
+import random
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from boto3.s3.transfer import TransferConfig
 
 @pytest.fixture()
 def config():
@@ -115,3 +118,218 @@ def test_push_pull(config):
 
     s3_client = session.client('s3')
     s3_client.delete_object(Bucket=config['MEDIAEXCHANGE_BUCKET_NAME'],Key=config['FILE_NAME'])
+
+
+# Throughput mode, a repeatable performance acceptance test. It is skipped
+# unless THROUGHPUT_OBJECTS is set, e.g.
+#
+#   THROUGHPUT_OBJECTS=1000 THROUGHPUT_SIZES=1KB:40,1MB:30,100MB:25,5GB:5 THROUGHPUT_CONCURRENCY=32 python3 -m pytest -s python/ -k throughput
+#
+# Objects of sizes drawn from THROUGHPUT_SIZES (size:weight) are generated as a
+# stream, published to the exchange bucket and read back by the subscriber,
+# THROUGHPUT_CONCURRENCY at a time. The SHA256 of every object is computed on
+# the way up and on the way down, nothing is held in memory or on disk. The
+# bytes repeat one random block after a header of each object, the rate the
+# client generates and hashes them at is reported as GeneratorMBPerSecond. With
+# AUTOINGEST_BUCKET_NAME the copy in the subscriber's autoingest bucket (under
+# AUTOINGEST_PREFIX) is verified and deleted as well. With THROUGHPUT_ENDPOINT_URL (e.g. moto_server or MinIO) it
+# runs against a local S3 stand-in, without the onboarding info and roles.
+
+UNITS = {'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3, 'TB': 1024 ** 4}
+
+# generated once, a per object generator would cap the throughput at one core
+RANDOM_BLOCK = os.urandom(8 * UNITS['MB'])
+
+
+class GeneratedObject:
+
+    # a file like object of random bytes that hashes what is read, the header
+    # makes the content (and the ETag) of every object unique
+    def __init__(self, size, seed):
+        self.remaining = size
+        self.header = hashlib.sha256(seed.encode('utf-8')).digest()
+        self.position = 0
+        self.hasher = hashlib.sha256()
+
+    def read(self, size=-1):
+        size = self.remaining if size is None or size < 0 else min(size, self.remaining)
+        data = bytearray()
+        while len(data) < size:
+            if self.position < len(self.header):
+                chunk = self.header[self.position:self.position + size - len(data)]
+            else:
+                offset = (self.position - len(self.header)) % len(RANDOM_BLOCK)
+                chunk = RANDOM_BLOCK[offset:offset + size - len(data)]
+            data += chunk
+            self.position += len(chunk)
+        self.remaining -= size
+        self.hasher.update(data)
+        return bytes(data)
+
+
+def measure_generator(size=256 * UNITS['MB']):
+    # MB/s one thread generates and hashes, the upper bound of what is measured
+    source = GeneratedObject(size, 'generator')
+    started = time.time()
+    while source.read(8 * UNITS['MB']):
+        pass
+    return size / UNITS['MB'] / max(time.time() - started, 0.001)
+
+
+def parse_sizes(sizes):
+    distribution = []
+    for entry in sizes.split(','):
+        size, _, weight = entry.strip().partition(':')
+        unit = size[-2:].upper()
+        distribution.append((int(float(size[:-2]) * UNITS[unit]) if unit in UNITS else int(size), float(weight or 1)))
+    return distribution
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    return {'p' + str(p): round(values[min(len(values) - 1, int(len(values) * p / 100))], 3) for p in [50, 90, 99]}
+
+
+def assume_role_session(config, role):
+    if config.get('THROUGHPUT_ENDPOINT_URL'):
+        return boto3.session.Session(region_name=config['AWS_REGION'])
+
+    resp = boto3.client("sts").assume_role(
+        RoleArn=config[role],
+        RoleSessionName="mediaexchange-test-session"
+    )
+    return boto3.session.Session(aws_access_key_id=resp['Credentials']['AccessKeyId'], aws_secret_access_key=resp['Credentials']['SecretAccessKey'], aws_session_token=resp['Credentials']['SessionToken'], region_name=config['AWS_REGION'])
+
+
+def read_checksum(s3_client, bucket, key):
+    hasher = hashlib.sha256()
+    for chunk in s3_client.get_object(Bucket=bucket, Key=key)['Body'].iter_chunks(8 * 1024 * 1024):
+        hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def wait_for_object(s3_client, bucket, key, timeout):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return s3_client.head_object(Bucket=bucket, Key=key)
+        except s3_client.exceptions.ClientError as e:
+            if e.response['Error']['Code'] not in ['404', 'NoSuchKey'] or time.time() > deadline:
+                raise
+        time.sleep(5)
+
+
+def transfer_object(config, publisher, subscriber, index, size):
+    bucket = config['MEDIAEXCHANGE_BUCKET_NAME']
+    key = config['THROUGHPUT_PREFIX'] + '/' + str(index).zfill(8) + '-' + str(size)
+    source = GeneratedObject(size, config['THROUGHPUT_SEED'] + '-' + str(index))
+    transfer_config = TransferConfig(max_concurrency=int(config['THROUGHPUT_PART_CONCURRENCY']))
+    result = {'Key': key, 'Size': size}
+
+    started = time.time()
+    publisher.upload_fileobj(source, bucket, key, Config=transfer_config)
+    result['Upload'] = time.time() - started
+
+    started = time.time()
+    result['Match'] = read_checksum(subscriber, bucket, key) == source.hasher.hexdigest()
+    result['Download'] = time.time() - started
+
+    if config.get('AUTOINGEST_BUCKET_NAME'):
+        # autoingest copies under its DESTINATION_PREFIX
+        ingest_key = config['AUTOINGEST_PREFIX'] + '/' + key
+        wait_for_object(subscriber, config['AUTOINGEST_BUCKET_NAME'], ingest_key, float(config['AUTOINGEST_TIMEOUT_IN_SECONDS']))
+        result['Ingest'] = time.time() - started - result['Download']
+        result['Match'] = result['Match'] and read_checksum(subscriber, config['AUTOINGEST_BUCKET_NAME'], ingest_key) == source.hasher.hexdigest()
+        subscriber.delete_object(Bucket=config['AUTOINGEST_BUCKET_NAME'], Key=ingest_key)
+
+    publisher.delete_object(Bucket=bucket, Key=key)
+    return result
+
+
+@pytest.fixture()
+def throughput_config():
+    if not os.environ.get('THROUGHPUT_OBJECTS'):
+        pytest.skip('THROUGHPUT_OBJECTS is not set')
+
+    throughput_info = {
+        'THROUGHPUT_SIZES': '1KB:40,1MB:30,100MB:25,1GB:5',
+        'THROUGHPUT_CONCURRENCY': '16',
+        'THROUGHPUT_PART_CONCURRENCY': '4',
+        'THROUGHPUT_SEED': 'mediaexchange',
+        'THROUGHPUT_PREFIX': 'throughput-test/' + str(int(time.time())),
+        'THROUGHPUT_MIN_MB_PER_SECOND': '0',
+        'THROUGHPUT_MIN_OBJECTS_PER_SECOND': '0',
+        'AUTOINGEST_PREFIX': 'ingest',
+        'AUTOINGEST_TIMEOUT_IN_SECONDS': '900',
+        'AWS_REGION': os.environ.get('AWS_REGION', os.environ.get('AWS_DEFAULT_REGION', 'us-east-1'))
+    }
+
+    if os.environ.get('THROUGHPUT_ENDPOINT_URL'):
+        throughput_info['MEDIAEXCHANGE_BUCKET_NAME'] = 'mediaexchange-throughput-test'
+    else:
+        for name in ['./publisher.env', './subscriber.env']:
+            with open(name) as f:
+                for part in f.read().split(' '):
+                    v = part.split('=')
+                    throughput_info[v[0]] = v[1].strip()
+        for role, name in [('PUBLISHER_ROLE', 'publisher-role'), ('SUBSCRIBER_ROLE', 'subscriber-role')]:
+            if throughput_info[role].endswith(':root'):
+                throughput_info[role] = throughput_info[role].replace(':root', ':role/' + name)
+
+    throughput_info.update({k: v for k, v in os.environ.items() if k.startswith('THROUGHPUT_') or k.startswith('AUTOINGEST_')})
+    yield throughput_info
+
+
+def test_throughput(throughput_config):
+    config = throughput_config
+    endpoint_url = config.get('THROUGHPUT_ENDPOINT_URL')
+
+    publisher = assume_role_session(config, 'PUBLISHER_ROLE').client('s3', endpoint_url=endpoint_url)
+    subscriber = assume_role_session(config, 'SUBSCRIBER_ROLE').client('s3', endpoint_url=endpoint_url)
+    if endpoint_url:
+        publisher.create_bucket(Bucket=config['MEDIAEXCHANGE_BUCKET_NAME'])
+
+    distribution = parse_sizes(config['THROUGHPUT_SIZES'])
+    sizes = random.Random(config['THROUGHPUT_SEED'])
+    concurrency = int(config['THROUGHPUT_CONCURRENCY'])
+
+    results = []
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = set()
+        # objects are generated as they are submitted
+        for index in range(int(config['THROUGHPUT_OBJECTS'])):
+            size = sizes.choices([s for s, _ in distribution], weights=[w for _, w in distribution])[0]
+            pending.add(executor.submit(transfer_object, config, publisher, subscriber, index, size))
+            if len(pending) >= 2 * concurrency:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                results.extend(f.result() for f in done)
+        results.extend(f.result() for f in pending)
+    elapsed = time.time() - started
+
+    size = sum(r['Size'] for r in results)
+    report = {
+        'Objects': len(results),
+        'MB': round(size / UNITS['MB'], 3),
+        'Seconds': round(elapsed, 3),
+        'MBPerSecond': round(size / UNITS['MB'] / elapsed, 3),
+        'ObjectsPerSecond': round(len(results) / elapsed, 3),
+        'GeneratorMBPerSecond': round(measure_generator(), 3),
+        'Mismatches': [r['Key'] for r in results if not r['Match']]
+    }
+    for stage in ['Upload', 'Download', 'Ingest']:
+        seconds = [r[stage] for r in results if stage in r]
+        if seconds:
+            report[stage + 'Seconds'] = percentiles(seconds)
+            report[stage + 'MBPerSecond'] = percentiles([r['Size'] / UNITS['MB'] / max(r[stage], 0.001) for r in results if stage in r])
+
+    print(json.dumps(report, indent=2))
+    if config.get('THROUGHPUT_REPORT'):
+        with open(config['THROUGHPUT_REPORT'], 'w') as f:
+            json.dump(report, f, indent=2)
+
+    assert report['Mismatches'] == []
+    assert report['MBPerSecond'] >= float(config['THROUGHPUT_MIN_MB_PER_SECOND'])
+    assert report['ObjectsPerSecond'] >= float(config['THROUGHPUT_MIN_OBJECTS_PER_SECOND'])
@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: Apache-2.0
+
+# usage: ./simulate.py <mediasync|fixity> <manifest csv> [--concurrency 256] [--max-vcpus 256]
+#            [--container-start-seconds 45] [--throughput '{"server": 500}'] [--env KEY=VALUE ...]
+#            [--timeline <csv file>] [--timeline-interval 60]
+#
+# Plays S3 Batch against the MediaSync or fixity driver without AWS. Every row
+# of the manifest (bucket,key[,size] as for run_copy_job.sh and run_hash_job.sh)
+# is a task that is handed to the real lambda_handler / s3_batch_handler, with
+# at most --concurrency invocations at a time. Tasks that return
+# TemporaryFailure are retried after --retry-seconds.
+#
+# The handlers talk to local stand-ins of S3 and AWS Batch on a virtual clock.
+# S3 answers HEAD requests from the sizes in the manifest and a Lambda copy
+# takes size / throughput. Batch jobs wait in the queue for free vCPUs
+# (--max-vcpus), take --container-start-seconds to start and then run for
+# size / throughput of their job definition. The output is the makespan, the
+# API calls by operation and a timeline of the queue depth, so that thresholds
+# such as MN_SIZE_FOR_BATCH_IN_BYTES or MAX_NUMBER_OF_PENDING_JOBS can be tuned
+# offline. A 1PB manifest runs in minutes, no bytes are moved.
+
+import os
+import sys
+import csv
+import json
+import heapq
+import random
+import argparse
+import datetime
+import urllib.parse
+from types import SimpleNamespace
+from collections import deque, Counter
+from botocore.exceptions import ClientError
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'source', 'cdk', 'lib')
+
+MB = 1024 * 1024
+
+# MB/s of a Lambda copy and of one job of each job definition
+THROUGHPUT = {'lambda': 150, 'server': 500, 'stream': 200, 'hash-small': 150, 'hash-large': 400}
+
+# vCPUs of the job definitions in the stacks
+VCPUS = {'server': 1, 'stream': 4, 'hash-small': 1, 'hash-large': 16}
+
+# resources of the driver functions in the stacks
+RESOURCES = {
+    'mediasync': {
+        'DESTINATION_BUCKET_NAME': 'destination',
+        'JOB_DEFINITION': 'server',
+        'JOB_DEFINITION_X_REGION': 'stream',
+        'JOB_QUEUE': 'queue'
+    },
+    'fixity': {
+        'JOB_SIZE_SMALL': 'hash-small',
+        'JOB_SIZE_LARGE': 'hash-large',
+        'JOB_QUEUE': 'queue'
+    }
+}
+
+
+def read_settings(pipeline):
+
+    # the tuning the stack deploys the driver function with
+    with open(os.path.join(ROOT, pipeline, 'driver-settings.json'), encoding='utf-8') as f:
+        settings = json.load(f)
+
+    return {name: value if isinstance(value, str) else json.dumps(value, separators=(',', ':')) for name, value in settings.items()}
+
+
+# environment of the driver functions in the stacks
+ENVIRONMENT = {pipeline: {**resources, **read_settings(pipeline)} for pipeline, resources in RESOURCES.items()}
+
+
+class VirtualClock:
+
+    # replaces the time module of the drivers
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class SimulatedS3:
+
+    def __init__(self, clock, objects, regions, throughput, calls):
+        self.meta = SimpleNamespace(region_name='us-east-1')
+        self.clock = clock
+        self.objects = objects
+        self.regions = regions
+        self.throughput = throughput
+        self.calls = calls
+
+    def head_object(self, Bucket, Key, **_):
+        self.calls['s3:HeadObject'] += 1
+        size = self.objects.get((Bucket, Key))
+        if size is None:
+            raise ClientError({'Error': {'Code': '404', 'Message': 'Not Found'}}, 'HeadObject')
+        return {
+            'ContentLength': size,
+            'ETag': '"' + str(size) + '"',
+            'StorageClass': 'STANDARD',
+            'LastModified': datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+        }
+
+    def get_bucket_location(self, Bucket):
+        self.calls['s3:GetBucketLocation'] += 1
+        return {'LocationConstraint': self.regions.get(Bucket, self.regions['*'])}
+
+    def copy_object(self, Bucket, CopySource, Key, **_):
+        self.calls['s3:CopyObject'] += 1
+        # the copy takes its time within the invocation
+        self.clock.now += self.objects[(CopySource['Bucket'], CopySource['Key'])] / (self.throughput['lambda'] * MB)
+        return {'CopyObjectResult': {'ETag': '"copy"'}}
+
+
+class SimulatedBatch:
+
+    def __init__(self, clock, max_vcpus, container_start, throughput, calls, schedule):
+        self.meta = SimpleNamespace(region_name='us-east-1')
+        self.clock = clock
+        self.max_vcpus = max_vcpus
+        self.container_start = container_start
+        self.throughput = throughput
+        self.calls = calls
+        self.schedule = schedule
+        self.runnable = deque()
+        self.running = 0
+        self.vcpus = 0
+        self.submitted = Counter()
+        self.jobs = 0
+
+    def submit_job(self, jobDefinition, parameters, tags, **_):
+        self.calls['batch:SubmitJob'] += 1
+        self.jobs += 1
+        size = int(parameters.get('Size') or tags['Size'])
+        self.submitted[jobDefinition] += 1
+        self.runnable.append((str(self.jobs), jobDefinition, size))
+        self.start_jobs()
+        return {'jobId': str(self.jobs)}
+
+    def describe_job_queues(self, jobQueues):
+        # the job queue of the stack has a fair share scheduling policy
+        self.calls['batch:DescribeJobQueues'] += 1
+        return {'jobQueues': [{'jobQueueName': name, 'schedulingPolicyArn': 'policy'} for name in jobQueues]}
+
+    def list_jobs(self, jobStatus, maxResults=100, **_):
+        self.calls['batch:ListJobs'] += 1
+        jobs = list(self.runnable)[:maxResults] if jobStatus == 'RUNNABLE' else []
+        response = {'jobSummaryList': [{'jobId': job[0]} for job in jobs]}
+        if jobStatus == 'RUNNABLE' and len(self.runnable) > maxResults:
+            response['nextToken'] = 'next'
+        return response
+
+    def start_jobs(self):
+        # first in, first out, as long as there are free vCPUs
+        while self.runnable and self.vcpus + VCPUS[self.runnable[0][1]] <= self.max_vcpus:
+            _, job_definition, size = self.runnable.popleft()
+            self.running += 1
+            self.vcpus += VCPUS[job_definition]
+            duration = self.container_start + size / (self.throughput[job_definition] * MB)
+            self.schedule(self.clock.now + duration, 'job_done', job_definition)
+
+    def finish_job(self, job_definition):
+        self.running -= 1
+        self.vcpus -= VCPUS[job_definition]
+        self.start_jobs()
+
+
+def read_manifest(path, default_size):
+
+    # bucket,key[,size], keys are url encoded
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.reader(f):
+            if row:
+                yield row[0], row[1], int(row[2]) if len(row) > 2 and row[2] else default_size
+
+
+def load_driver(pipeline):
+
+    # the drivers read these when they are imported
+    for name, value in {'SOLUTION_IDENTIFIER': 'simulator', 'SendAnonymizedMetric': 'No', 'LogLevel': 'WARNING',
+                        'AWS_DEFAULT_REGION': 'us-east-1', 'AWS_ACCESS_KEY_ID': 'simulator', 'AWS_SECRET_ACCESS_KEY': 'simulator'}.items():
+        os.environ.setdefault(name, value)
+
+    path = os.path.join(ROOT, pipeline, 'lambda')
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+    if pipeline == 'mediasync':
+        from mediasync_driver import app
+        return app, app.lambda_handler
+
+    from fixity_driver import app
+    return app, app.s3_batch_handler
+
+
+def reset_driver(app):
+
+    # state that a warm function keeps between invocations
+    for name in ['rate_limit_backend', 'copy_stats_backend', 'preflight_cache']:
+        if isinstance(getattr(app, name, None), dict):
+            getattr(app, name).clear()
+        elif hasattr(app, name):
+            setattr(app, name, None)
+    for name in ['bucket_regions', 'batch_clients', 's3_clients', 'checksum_cache', 'job_queue_policies']:
+        if hasattr(app, name):
+            getattr(app, name).clear()
+
+
+def simulate(pipeline, manifest, concurrency=256, max_vcpus=256, container_start=45, throughput=None, environment=None,
+             regions=None, invocation_seconds=0.1, retry_seconds=30, max_attempts=100, timeline_interval=60, seed=0):
+
+    random.seed(seed)
+    throughput = {**THROUGHPUT, **(throughput or {})}
+    regions = {'*': 'us-east-1', **(regions or {})}
+
+    clock = VirtualClock()
+    calls = Counter()
+    events = []
+    sequence = [0]
+
+    def schedule(at, kind, payload=None):
+        sequence[0] += 1
+        heapq.heappush(events, (at, sequence[0], kind, payload))
+
+    tasks = deque()
+    objects = {}
+    for bucket, key, size in manifest:
+        # objects without a size do not exist
+        if size is not None:
+            objects[(bucket, urllib.parse.unquote_plus(key))] = size
+        tasks.append({'Bucket': bucket, 'Key': key, 'Size': size, 'Attempts': 0})
+
+    s3 = SimulatedS3(clock, objects, regions, throughput, calls)
+    batch = SimulatedBatch(clock, max_vcpus, container_start, throughput, calls, schedule)
+    app, handler = load_driver(pipeline)
+
+    # the preflight cache is shared code with its own time module
+    preflight_cache = sys.modules[app.PreflightCache.__module__]
+    saved = {name: getattr(app, name) for name in ['s3client', 'batchclient', 'time']}
+    saved_environ = dict(os.environ)
+    os.environ.update({**ENVIRONMENT[pipeline], 'AWS_REGION': 'us-east-1', **(environment or {})})
+
+    results = Counter()
+    modes = Counter()
+    timeline = []
+    in_flight = 0
+    total = len(tasks)
+    finished = 0
+    makespan = 0.0
+
+    try:
+        app.s3client, app.batchclient, app.time = s3, batch, clock
+        preflight_cache.time = clock
+        reset_driver(app)
+        # buckets in every region are simulated by the same client
+        app.s3_clients.update({region: s3 for region in regions.values()})
+
+        schedule(0, 'sample')
+        while events:
+            at, _, kind, payload = heapq.heappop(events)
+            clock.now = at
+
+            if kind == 'sample':
+                timeline.append({'Time': at, 'Tasks': len(tasks), 'Invocations': in_flight, 'Runnable': len(batch.runnable), 'Running': batch.running, 'VCpus': batch.vcpus})
+                if finished < total or batch.running or batch.runnable:
+                    schedule(at + timeline_interval, 'sample')
+
+            elif kind == 'retry':
+                tasks.append(payload)
+
+            elif kind == 'invocation_done':
+                in_flight -= 1
+                task, result_code = payload
+                makespan = max(makespan, at)
+                if result_code == 'TemporaryFailure' and task['Attempts'] < max_attempts:
+                    results['Retries'] += 1
+                    schedule(at + retry_seconds, 'retry', task)
+                else:
+                    results[result_code] += 1
+                    finished += 1
+
+            elif kind == 'job_done':
+                batch.finish_job(payload)
+                modes[payload] += 1
+                makespan = max(makespan, at)
+
+            # hand out tasks to free invocations
+            while tasks and in_flight < concurrency:
+                task = tasks.popleft()
+                task['Attempts'] += 1
+                in_flight += 1
+                calls['lambda:Invoke'] += 1
+
+                event = {
+                    'invocationSchemaVersion': '1.0',
+                    'invocationId': str(calls['lambda:Invoke']),
+                    'job': {'id': 'simulator'},
+                    'tasks': [{'taskId': str(calls['lambda:Invoke']), 's3BucketArn': 'arn:aws:s3:::' + task['Bucket'], 's3Key': task['Key'], 's3VersionId': None}]
+                }
+                result = handler(event, None)['results'][0]
+                if result['resultCode'] == 'Succeeded' and json.loads(result['resultString']).get('Path') == 'lambda':
+                    modes['lambda'] += 1
+
+                done = clock.now + invocation_seconds
+                clock.now = at
+                schedule(done, 'invocation_done', (task, result['resultCode']))
+
+    finally:
+        app.s3client, app.batchclient, app.time = saved['s3client'], saved['batchclient'], saved['time']
+        preflight_cache.time = saved['time']
+        os.environ.clear()
+        os.environ.update(saved_environ)
+
+    return {
+        'Makespan': makespan,
+        'Objects': total,
+        'Bytes': sum(objects.values()),
+        'Results': dict(results),
+        'Modes': dict(modes),
+        'Calls': dict(calls),
+        'Timeline': timeline
+    }
+
+
+def main(argv):
+
+    parser = argparse.ArgumentParser(prog='simulate.py')
+    parser.add_argument('pipeline', choices=['mediasync', 'fixity'])
+    parser.add_argument('manifest')
+    parser.add_argument('--default-size', type=int, default=100 * MB, help='size of rows without a size column')
+    parser.add_argument('--concurrency', type=int, default=256, help='concurrent invocations, reservedConcurrentExecutions of the driver')
+    parser.add_argument('--max-vcpus', type=int, default=256, help='maxvCpus of the compute environment')
+    parser.add_argument('--container-start-seconds', type=float, default=45)
+    parser.add_argument('--invocation-seconds', type=float, default=0.1)
+    parser.add_argument('--retry-seconds', type=float, default=30)
+    parser.add_argument('--max-attempts', type=int, default=100)
+    parser.add_argument('--throughput', default='{}', help='json object of MB/s by copy mode or job definition')
+    parser.add_argument('--source-region', default='us-east-1')
+    parser.add_argument('--destination-region', default='us-east-1')
+    parser.add_argument('--env', action='append', default=[], help='KEY=VALUE of the driver environment')
+    parser.add_argument('--timeline', help='csv file of the queue depth over time')
+    parser.add_argument('--timeline-interval', type=float, default=60)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv[1:])
+
+    environment = dict(value.split('=', 1) for value in args.env)
+    regions = {'*': args.source_region, environment.get('DESTINATION_BUCKET_NAME', ENVIRONMENT['mediasync']['DESTINATION_BUCKET_NAME']): args.destination_region}
+
+    report = simulate(args.pipeline, read_manifest(args.manifest, args.default_size), args.concurrency, args.max_vcpus, args.container_start_seconds,
+                      json.loads(args.throughput), environment, regions, args.invocation_seconds, args.retry_seconds, args.max_attempts,
+                      args.timeline_interval, args.seed)
+
+    timeline = report.pop('Timeline')
+    if args.timeline:
+        with open(args.timeline, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=['Time', 'Tasks', 'Invocations', 'Runnable', 'Running', 'VCpus'], lineterminator='\n')
+            writer.writeheader()
+            writer.writerows(timeline)
+
+    report['MakespanHours'] = round(report['Makespan'] / 3600, 2)
+    report['PeakRunnable'] = max((sample['Runnable'] for sample in timeline), default=0)
+    print(json.dumps(report, indent=2))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
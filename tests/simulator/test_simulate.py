@@ -0,0 +1,97 @@
+#######################################################################################################################
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.                                                 #
+#                                                                                                                     #
+#  Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance     #
+#  with the License. A copy of the License is located at                                                              #
+#                                                                                                                     #
+#      http://www.apache.org/licenses/LICENSE-2.0                                                                     #
+#                                                                                                                     #
+#  or in the 'license' file accompanying this file. This file is distributed on an 'AS IS' BASIS, WITHOUT WARRANTIES  #
+#  OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions     #
+#  and limitations under the License.                                                                                 #
+#######################################################################################################################
+import io
+import json
+import os
+import unittest
+import mock
+
+GB = 1024 * 1024 * 1024
+
+# ten small objects, four copy jobs and a missing object
+MANIFEST = [('source', 'small/' + str(i) + '.mp4', 100 * 1024 * 1024) for i in range(10)] + \
+           [('source', 'large/' + str(i) + '.mxf', 10 * GB) for i in range(4)] + [('missing', 'a.mp4', None)]
+
+
+class TestSimulate(unittest.TestCase):
+    def setUp(self):
+        environ = mock.patch.dict(os.environ, {'AWS_DEFAULT_REGION': 'us-east-1'})
+        environ.start()
+        self.addCleanup(environ.stop)
+
+    def manifest(self):
+        return [(bucket, key, size) for bucket, key, size in MANIFEST if size]
+
+    def test_mediasync_success(self):
+        from simulate import simulate
+        report = simulate('mediasync', self.manifest(), concurrency=4, max_vcpus=2, container_start=45,
+                          throughput={'lambda': 100, 'server': 1024})
+        self.assertEqual(report['Results'], {'Succeeded': 14})
+        self.assertEqual(report['Modes'], {'lambda': 10, 'server': 4})
+        self.assertEqual(report['Calls']['batch:SubmitJob'], 4)
+        # submitted after two rounds of Lambda copies, then two jobs at a time that take 45 seconds to start and 10 seconds to copy
+        self.assertAlmostEqual(report['Makespan'], 2 * 1.1 + 2 * 55, delta=0.5)
+        self.assertEqual(max(sample['Running'] for sample in report['Timeline']), 2)
+
+    def test_mediasync_retry_success(self):
+        from simulate import simulate
+        report = simulate('mediasync', self.manifest(), concurrency=16, max_vcpus=1,
+                          environment={'DISABLE_PENDING_JOBS_CHECK': 'False', 'MAX_NUMBER_OF_PENDING_JOBS': '1'})
+        self.assertEqual(report['Results']['Succeeded'], 14)
+        self.assertGreater(report['Results']['Retries'], 0)
+        # retries are answered from the preflight cache
+        self.assertEqual(report['Calls']['s3:HeadObject'], 14)
+        self.assertEqual(report['Calls']['lambda:Invoke'], 14 + report['Results']['Retries'])
+
+    def test_mediasync_retry_expired_success(self):
+        from simulate import simulate
+        # the cached HEAD responses expire on the virtual clock between retries
+        report = simulate('mediasync', self.manifest(), concurrency=16, max_vcpus=1, retry_seconds=30,
+                          environment={'DISABLE_PENDING_JOBS_CHECK': 'False', 'MAX_NUMBER_OF_PENDING_JOBS': '1', 'PREFLIGHT_CACHE_TTL_IN_SECONDS': '10'})
+        self.assertEqual(report['Results']['Succeeded'], 14)
+        self.assertEqual(report['Calls']['s3:HeadObject'], 14 + report['Results']['Retries'])
+
+    def test_environment_success(self):
+        from simulate import ENVIRONMENT
+        # the tuning of the stack
+        self.assertEqual([size_class['name'] for size_class in json.loads(ENVIRONMENT['mediasync']['SIZE_CLASSES'])], ['small', 'medium', 'large'])
+        self.assertEqual(ENVIRONMENT['fixity']['JOB_SIZE_THRESHOLD'], '10737418240')
+
+    def test_mediasync_adaptive_success(self):
+        from simulate import simulate
+        report = simulate('mediasync', self.manifest(), concurrency=4, max_vcpus=2,
+                          throughput={'lambda': 100, 'server': 1024},
+                          environment={'COPY_MODE_SELECTION': 'adaptive', 'COPY_STATS_MIN_SAMPLES': '1'})
+        self.assertEqual(report['Results'], {'Succeeded': 14})
+        # 10GB does not copy within the timeout of the function at the minimum throughput
+        self.assertEqual(report['Modes'], {'lambda': 10, 'server': 4})
+
+    def test_fixity_success(self):
+        from simulate import simulate
+        report = simulate('fixity', MANIFEST[10:14] + [('missing', 'a.mp4', None)], max_vcpus=16)
+        self.assertEqual(report['Results'], {'Succeeded': 4, 'PermanentFailure': 1})
+        self.assertEqual(report['Modes'], {'hash-large': 4})
+        # one large job at a time
+        self.assertAlmostEqual(report['Makespan'], 4 * (45 + 10 * 1024 / 400), delta=1)
+
+    def test_main_success(self):
+        from simulate import main
+        manifest = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'manifest.csv')
+        with open(manifest, 'w', encoding='utf-8') as f:
+            f.write('source,a+b.mp4,1024\nsource,c.mp4\n')
+        self.addCleanup(os.remove, manifest)
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            self.assertEqual(main(['simulate.py', 'mediasync', manifest]), 0)
+        report = json.loads(stdout.getvalue())
+        self.assertEqual(report['Results'], {'Succeeded': 2})
+        self.assertEqual(report['Bytes'], 1024 + 100 * 1024 * 1024)